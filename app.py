@@ -1,12 +1,33 @@
 # app.py - VERSÃO COMPLETA E AJUSTADA
 
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, g, has_app_context, make_response, Response, stream_with_context
 from flask_cors import CORS
 import sqlite3
 import bcrypt
+import click
+import cProfile
 import jwt
+import base64
+import csv
 import datetime
+import gzip
+import hashlib
+import heapq
+import io
 import json
+import marshal
+import os
+import pstats
+import queue
+import random
+import re
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import wraps
 # from collections import defaultdict # Não está sendo usado, pode remover se quiser
 
@@ -14,40 +35,1105 @@ app = Flask(__name__)
 CORS(app)
 app.config['SECRET_KEY'] = 'sua_chave_secreta_agendamento_labs_uern_2025'
 DATABASE = 'agendamento.db'
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = 5000 # Espera pelo lock de escrita em vez de falhar com "database is locked"
+app.config['SQLITE_CACHED_STATEMENTS'] = 256 # Cache de statements preparados por conexão (padrão do Python: 128)
+app.config['SQLITE_POOL_MAX'] = 16 # Conexões ociosas mantidas para reuso
+app.config['BCRYPT_ROUNDS'] = int(os.environ.get('BCRYPT_ROUNDS', 12)) # Custo das senhas novas/rehash no login
+app.config['BCRYPT_MAX_WORKERS'] = int(os.environ.get('BCRYPT_MAX_WORKERS', os.cpu_count() or 2))
+app.config['BCRYPT_MAX_FILA'] = int(os.environ.get('BCRYPT_MAX_FILA', 64)) # Em execução + aguardando
+app.config['BCRYPT_RETRY_AFTER'] = 2 # Segundos sugeridos ao cliente quando a fila está cheia
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get('SLOW_REQUEST_MS', 0)) # > 0 registra requisições lentas com o SQL executado
+app.config['PERFIL_REQUISICOES'] = os.environ.get('PERFIL_REQUISICOES') == '1' # Admin pede o perfil (cProfile) de uma requisição com X-Perfil: 1
+app.config['PERFIL_AMOSTRAGEM'] = float(os.environ.get('PERFIL_AMOSTRAGEM', 0)) # Fração das requisições perfiladas por sorteio (ex.: 0.01)
+app.config['PERFIL_MAX'] = int(os.environ.get('PERFIL_MAX', 50)) # Perfis guardados em memória (os mais antigos saem)
+app.config['PERFIL_LINHAS_TEXTO'] = 40 # Funções no resumo em texto, por tempo acumulado
+app.config['ESCRITOR_RESERVAS'] = os.environ.get('ESCRITOR_RESERVAS') == '1' # Uma thread grava as escritas em lotes (group commit)
+app.config['ESCRITOR_LOTE_MAX'] = int(os.environ.get('ESCRITOR_LOTE_MAX', 32)) # Comandos por COMMIT no modo escritor
+app.config['ESCRITOR_TIMEOUT'] = 30 # Segundos que a requisição espera pelo resultado do escritor
+app.config['ARQUIVO_DATABASE'] = os.environ.get('ARQUIVO_DATABASE') # Banco das reservas arquivadas (padrão: agendamento_arquivo.db)
+app.config['ARQUIVO_CORTE_DIAS'] = int(os.environ.get('ARQUIVO_CORTE_DIAS', 180)) # Reservas mais antigas que isso vão para o arquivo
+app.config['ARQUIVO_LOTE'] = 1000 # Reservas movidas por transação
+app.config['ARQUIVO_INTERVALO_HORAS'] = float(os.environ.get('ARQUIVO_INTERVALO_HORAS', 0)) # > 0 arquiva periodicamente em segundo plano
+app.config['SHARDS'] = os.environ.get('SHARDS', '') # 'campus:lab,lab;outro:lab' -> reservas desses labs em agendamento_<campus>.db
+app.config['GZIP_MIN_BYTES'] = 1024 # Respostas condicionais maiores que isso saem comprimidas (se o cliente aceitar)
+app.config['ALTERACOES_INTERVALO_S'] = 1.0 # Frequência com que o stream SSE verifica novas alterações de reservas
+app.config['ALTERACOES_DURACAO_MAX_S'] = 300 # Depois disso o stream fecha e o EventSource reconecta
+app.config['STREAM_TOKEN_VALIDADE_S'] = 60 # Validade do token curto que abre o stream (vai na URL do EventSource)
+app.config['HORARIO_ABERTURA'] = '07:00' # Funcionamento dos laboratórios: base da busca de horários e da taxa de ocupação
+app.config['HORARIO_FECHAMENTO'] = '22:00'
+app.config['DIAS_FUNCIONAMENTO'] = (0, 1, 2, 3, 4, 5) # date.weekday(): segunda a sábado
+app.config['AUTH_CACHE_TTL_S'] = float(os.environ.get('AUTH_CACHE_TTL_S', 60)) # Validade do status/tipo/geração de token de um professor no cache do processo
+app.config['AUTH_CACHE_MAX'] = 4096 # Professores mantidos no cache de autenticação (LRU)
+app.config['AUTH_VERSAO_INTERVALO_S'] = float(os.environ.get('AUTH_VERSAO_INTERVALO_S', 1.0)) # De quanto em quanto tempo cada processo confere a versão de autenticação no banco
+app.config['DIRETORIO_VERSAO_INTERVALO_S'] = float(os.environ.get('DIRETORIO_VERSAO_INTERVALO_S', 5.0)) # Com SHARDS: de quanto em quanto tempo cada processo confere se professores/laboratórios mudaram no principal
+app.config['ICS_DIAS_PASSADOS'] = 30 # Feeds ICS: reservas a partir de hoje menos isso (as futuras entram todas)
+app.config['ICS_CACHE_MAX'] = 256 # Feeds ICS já gerados mantidos em memória
+app.config['ICS_FUSO'] = 'America/Fortaleza' # Natal: UTC-3, sem horário de verão
 
-def get_db_connection():
-    """Conecta ao banco SQLite e configura row_factory"""
-    conn = sqlite3.connect(DATABASE)
+MAX_SQL_POR_REQUISICAO = 100 # Comandos guardados por requisição para o log de lentidão
+
+class ConexaoInstrumentada(sqlite3.Connection):
+    """Conexão que contabiliza, na requisição corrente, quantos comandos SQL rodaram e quanto tempo levaram.
+
+    Mede o execute() (preparo e primeiro passo); o restante do fetch não entra na conta.
+    """
+
+    def _registrar(self, sql, inicio):
+        if has_app_context() and 'sql_consultas' in g:
+            duracao = time.perf_counter() - inicio
+            g.sql_consultas += 1
+            g.sql_segundos += duracao
+            if len(g.sql_comandos) < MAX_SQL_POR_REQUISICAO:
+                g.sql_comandos.append((sql, duracao))
+
+    def execute(self, sql, *args):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            self._registrar(sql, inicio)
+
+    def executemany(self, sql, *args):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            self._registrar(sql, inicio)
+
+def _nova_conexao(caminho=None):
+    """Abre uma conexão SQLite já ajustada (WAL, synchronous=NORMAL, busy_timeout, foreign_keys)"""
+    busy_timeout_ms = app.config['SQLITE_BUSY_TIMEOUT_MS']
+    conn = sqlite3.connect(
+        caminho or DATABASE, timeout=busy_timeout_ms / 1000,
+        cached_statements=app.config['SQLITE_CACHED_STATEMENTS'],
+        check_same_thread=False, # Uma conexão só é usada por um contexto por vez, mas pode trocar de thread
+        factory=ConexaoInstrumentada
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA busy_timeout = {int(busy_timeout_ms)}')
+    conn.execute('PRAGMA foreign_keys = ON')
     return conn
 
-# VERSÃO AJUSTADA DA FUNÇÃO init_database()
-def init_database():
-    """Cria tabelas e insere dados iniciais se não existirem, com foco na robustez do admin"""
-    conn = get_db_connection()
-    
-    # Verificar e adicionar colunas 'status' e 'tipo' na tabela professores se não existirem
-    try:
-        cursor = conn.execute("PRAGMA table_info(professores)")
-        columns = [column[1] for column in cursor.fetchall()]
-        if 'status' not in columns:
-            print("Adicionando coluna 'status' à tabela professores...")
-            conn.execute('ALTER TABLE professores ADD COLUMN status TEXT DEFAULT "ativo"')
-            # commit aqui é opcional se houver um commit maior no final da função, mas seguro
-            conn.commit() 
-            print("✅ Coluna 'status' adicionada com sucesso!")
-        if 'tipo' not in columns:
-            print("Adicionando coluna 'tipo' à tabela professores...")
-            conn.execute('ALTER TABLE professores ADD COLUMN tipo TEXT DEFAULT "professor"')
+class PoolConexoes:
+    """Pool de conexões SQLite reaproveitadas entre requisições.
+
+    Cada contexto da aplicação pega uma conexão (a mais recente devolvida, ainda "quente"),
+    usa-a em todas as chamadas a get_db_connection() e a devolve no teardown.
+    """
+
+    def __init__(self, caminho=None):
+        self.caminho = caminho # None = DATABASE (o banco principal)
+        self._lock = threading.Lock()
+        self._ociosas = []
+        self.criadas = 0
+        self.reutilizadas = 0
+        self.em_uso = 0
+
+    def obter(self):
+        with self._lock:
+            self.em_uso += 1
+            if self._ociosas:
+                self.reutilizadas += 1
+                return self._ociosas.pop()
+            self.criadas += 1
+        return _nova_conexao(self.caminho)
+
+    def devolver(self, conn):
+        if conn.in_transaction:
+            conn.rollback() # Nunca devolve ao pool uma transação pendente de uma requisição que falhou
+        with self._lock:
+            self.em_uso -= 1
+            if len(self._ociosas) < app.config['SQLITE_POOL_MAX']:
+                self._ociosas.append(conn)
+                return
+        conn.close()
+
+    def descartar(self, conn):
+        with self._lock:
+            self.em_uso -= 1
+        conn.close()
+
+    def limpar(self):
+        with self._lock:
+            ociosas, self._ociosas = self._ociosas, []
+        for conn in ociosas:
+            conn.close()
+
+    def estatisticas(self):
+        with self._lock:
+            pedidos = self.criadas + self.reutilizadas
+            return {
+                'ociosas': len(self._ociosas), 'em_uso': self.em_uso,
+                'criadas': self.criadas, 'reutilizadas': self.reutilizadas,
+                'taxa_reuso': round(self.reutilizadas / pedidos, 4) if pedidos else 0.0,
+            }
+
+pool = PoolConexoes()
+
+def get_db_connection(shard=None):
+    """Conexão do contexto atual (vinda do pool); fora de um contexto Flask abre uma conexão avulsa,
+    que deve ser fechada por quem chamou. Com `shard`, a conexão é a do banco daquele campus."""
+    if shard is not None:
+        if not has_app_context():
+            return _nova_conexao(caminho_shard(shard))
+        conexoes = g.setdefault('conexoes_shard', {})
+        if shard not in conexoes:
+            conexoes[shard] = obter_conexao_shard(shard)
+        return conexoes[shard]
+    if not has_app_context():
+        return _nova_conexao()
+    if 'db' not in g:
+        g.db = pool.obter()
+    return g.db
+
+def liberar_conexao():
+    """Devolve ao pool, antes do fim do contexto, a conexão que o contexto atual estiver usando.
+    O arquivo anexado por esta requisição é desanexado antes, para não vazar para a próxima."""
+    conn = g.pop('db', None)
+    if conn is None:
+        return
+    if g.pop('arquivo_anexado', False):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute('DETACH DATABASE arquivo')
+        except sqlite3.Error: # Ex.: cursor ainda aberto sobre o arquivo; a conexão não volta ao pool
+            pool.descartar(conn)
+            return
+    pool.devolver(conn)
+
+@app.teardown_appcontext
+def devolver_conexao(exception):
+    liberar_conexao()
+    for shard, conn in g.pop('conexoes_shard', {}).items():
+        pool_do_shard(shard).devolver(conn)
+
+# --- MÉTRICAS ---
+
+class MetricasRequisicoes:
+    """Histogramas de latência por endpoint/método/status e totais de SQL por endpoint"""
+
+    LIMITES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # segundos
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencias = {}  # (endpoint, metodo, status) -> [contagem por faixa..., soma, total]
+        self._sql = {}  # endpoint -> [consultas, segundos]
+        self._condicionais = {}  # endpoint -> [respostas, 304, comprimidas]
+
+    def registrar(self, endpoint, metodo, status, duracao, consultas, segundos_sql):
+        with self._lock:
+            serie = self._latencias.setdefault((endpoint, metodo, status), [0] * len(self.LIMITES) + [0.0, 0])
+            for indice, limite in enumerate(self.LIMITES):
+                if duracao <= limite:
+                    serie[indice] += 1
+            serie[-2] += duracao
+            serie[-1] += 1
+            sql = self._sql.setdefault(endpoint, [0, 0.0])
+            sql[0] += consultas
+            sql[1] += segundos_sql
+
+    def registrar_condicional(self, endpoint, nao_modificado, comprimido):
+        with self._lock:
+            valores = self._condicionais.setdefault(endpoint, [0, 0, 0])
+            valores[0] += 1
+            valores[1] += nao_modificado
+            valores[2] += comprimido
+
+    def condicionais(self):
+        """{endpoint: {respostas, nao_modificadas, comprimidas, taxa_acerto}} das rotas com @resposta_condicional"""
+        with self._lock:
+            return {endpoint: {
+                'respostas': total, 'nao_modificadas': nao_modificadas, 'comprimidas': comprimidas,
+                'taxa_acerto': round(nao_modificadas / total, 4) if total else 0.0,
+            } for endpoint, (total, nao_modificadas, comprimidas) in sorted(self._condicionais.items())}
+
+    def prometheus(self):
+        """Métricas no formato texto do Prometheus"""
+        with self._lock:
+            latencias = {chave: list(serie) for chave, serie in self._latencias.items()}
+            sql = {endpoint: list(valores) for endpoint, valores in self._sql.items()}
+            condicionais = {endpoint: list(valores) for endpoint, valores in self._condicionais.items()}
+        linhas = [
+            '# HELP agendamento_requisicao_segundos Latência das requisições HTTP',
+            '# TYPE agendamento_requisicao_segundos histogram',
+        ]
+        for (endpoint, metodo, status), serie in sorted(latencias.items()):
+            rotulos = f'endpoint="{endpoint}",metodo="{metodo}",status="{status}"'
+            for limite, contagem in zip(self.LIMITES, serie):
+                linhas.append(f'agendamento_requisicao_segundos_bucket{{{rotulos},le="{limite}"}} {contagem}')
+            linhas.append(f'agendamento_requisicao_segundos_bucket{{{rotulos},le="+Inf"}} {serie[-1]}')
+            linhas.append(f'agendamento_requisicao_segundos_sum{{{rotulos}}} {serie[-2]:.6f}')
+            linhas.append(f'agendamento_requisicao_segundos_count{{{rotulos}}} {serie[-1]}')
+        linhas += [
+            '# HELP agendamento_sql_consultas_total Comandos SQL executados, por endpoint',
+            '# TYPE agendamento_sql_consultas_total counter',
+        ]
+        linhas += [f'agendamento_sql_consultas_total{{endpoint="{endpoint}"}} {valores[0]}'
+                   for endpoint, valores in sorted(sql.items())]
+        linhas += [
+            '# HELP agendamento_sql_segundos_total Tempo gasto no SQLite, por endpoint',
+            '# TYPE agendamento_sql_segundos_total counter',
+        ]
+        linhas += [f'agendamento_sql_segundos_total{{endpoint="{endpoint}"}} {valores[1]:.6f}'
+                   for endpoint, valores in sorted(sql.items())]
+        linhas += [
+            '# HELP agendamento_get_condicional_total Respostas das rotas com ETag/Last-Modified, por resultado',
+            '# TYPE agendamento_get_condicional_total counter',
+        ]
+        for endpoint, (total, nao_modificadas, comprimidas) in sorted(condicionais.items()):
+            linhas.append(f'agendamento_get_condicional_total{{endpoint="{endpoint}",resultado="304"}} {nao_modificadas}')
+            linhas.append(f'agendamento_get_condicional_total{{endpoint="{endpoint}",resultado="200"}} {total - nao_modificadas}')
+            linhas.append(f'agendamento_get_condicional_total{{endpoint="{endpoint}",resultado="gzip"}} {comprimidas}')
+        estatisticas = pool.estatisticas()
+        linhas += [
+            '# HELP agendamento_pool_conexoes Conexões SQLite do pool, por estado',
+            '# TYPE agendamento_pool_conexoes gauge',
+            f'agendamento_pool_conexoes{{estado="ociosas"}} {estatisticas["ociosas"]}',
+            f'agendamento_pool_conexoes{{estado="em_uso"}} {estatisticas["em_uso"]}',
+            '# HELP agendamento_pool_obtencoes_total Conexões entregues pelo pool (criadas ou reutilizadas)',
+            '# TYPE agendamento_pool_obtencoes_total counter',
+            f'agendamento_pool_obtencoes_total{{origem="criada"}} {estatisticas["criadas"]}',
+            f'agendamento_pool_obtencoes_total{{origem="reutilizada"}} {estatisticas["reutilizadas"]}',
+            '# HELP agendamento_escritor_total Lotes e comandos gravados pela thread escritora (ESCRITOR_RESERVAS=1)',
+            '# TYPE agendamento_escritor_total counter',
+            f'agendamento_escritor_total{{tipo="lotes"}} {escritor.lotes}',
+            f'agendamento_escritor_total{{tipo="comandos"}} {escritor.comandos}',
+        ]
+        return '\n'.join(linhas) + '\n'
+
+metricas = MetricasRequisicoes()
+
+@app.before_request
+def iniciar_medicao():
+    g.inicio_requisicao = time.perf_counter()
+    g.sql_consultas, g.sql_segundos, g.sql_comandos = 0, 0.0, []
+
+@app.after_request
+def registrar_medicao(response):
+    if 'inicio_requisicao' not in g:
+        return response
+    duracao = time.perf_counter() - g.inicio_requisicao
+    endpoint = request.endpoint or 'desconhecido'
+    metricas.registrar(endpoint, request.method, response.status_code, duracao, g.sql_consultas, g.sql_segundos)
+    limite_ms = app.config['SLOW_REQUEST_MS']
+    if limite_ms and duracao * 1000 >= limite_ms:
+        comandos = ''.join(f"\n    [{segundos * 1000:.1f} ms] {' '.join(sql.split())}" for sql, segundos in g.sql_comandos)
+        app.logger.warning(
+            f"Requisição lenta: {request.method} {request.path} -> {response.status_code} em {duracao * 1000:.1f} ms "
+            f"({g.sql_consultas} comandos SQL, {g.sql_segundos * 1000:.1f} ms no SQLite){comandos}"
+        )
+    return response
+
+# --- PERFILAMENTO SOB DEMANDA ---
+
+class PerfisRequisicoes:
+    """Últimos perfis de requisições (estatísticas do cProfile + resumo em texto), num buffer circular"""
+
+    def __init__(self, maximo):
+        self._lock = threading.Lock()
+        self._perfis = deque(maxlen=maximo)
+        self._ultimo_id = 0
+
+    def novo_id(self):
+        with self._lock:
+            self._ultimo_id += 1
+            return self._ultimo_id
+
+    def guardar(self, perfil):
+        with self._lock:
+            self._perfis.append(perfil)
+
+    def listar(self):
+        """Metadados dos perfis guardados, do mais recente para o mais antigo"""
+        with self._lock:
+            return [{chave: valor for chave, valor in perfil.items() if chave not in ('estatisticas', 'texto')}
+                    for perfil in reversed(self._perfis)]
+
+    def obter(self, perfil_id):
+        with self._lock:
+            return next((perfil for perfil in self._perfis if perfil['id'] == perfil_id), None)
+
+perfis = PerfisRequisicoes(app.config['PERFIL_MAX'])
+
+def _token_de_admin(cabecalho):
+    if cabecalho.startswith('Bearer '): cabecalho = cabecalho[7:]
+    try:
+        dados = jwt.decode(cabecalho, app.config['SECRET_KEY'], algorithms=['HS256'])
+    except jwt.InvalidTokenError:
+        return False
+    with app.app_context(): # Fora da requisição do Flask: conexão própria, devolvida ao sair
+        usuario, _ = validar_sessao(dados)
+    return usuario is not None and usuario['tipo'] == 'admin' and 'uso' not in dados
+
+class PerfilamentoWSGI:
+    """Middleware WSGI que roda sob cProfile as requisições sorteadas (PERFIL_AMOSTRAGEM) ou pedidas
+    por um admin com o header X-Perfil: 1 (PERFIL_REQUISICOES=1).
+
+    Só é instalado quando uma das opções está ligada; desligado, o app.wsgi_app é o original.
+    O perfil cobre a rota e a geração do corpo (inclusive streaming) e fica em `perfis`, com o id
+    devolvido no header X-Perfil-Id.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self._ocupado = threading.Lock() # Um perfil por vez: o cProfile não admite dois ativos ao mesmo tempo
+
+    def _motivo(self, environ):
+        if (app.config['PERFIL_REQUISICOES'] and environ.get('HTTP_X_PERFIL') == '1'
+                and _token_de_admin(environ.get('HTTP_AUTHORIZATION', ''))):
+            return 'cabecalho'
+        if random.random() < app.config['PERFIL_AMOSTRAGEM']:
+            return 'amostragem'
+        return None
+
+    def __call__(self, environ, start_response):
+        motivo = self._motivo(environ)
+        # Pedido explícito espera um pouco a vez; amostragem só aproveita quando não há outro perfil
+        if motivo is None or not self._ocupado.acquire(timeout=1 if motivo == 'cabecalho' else 0):
+            return self.wsgi_app(environ, start_response)
+        perfil = {
+            'id': perfis.novo_id(), 'motivo': motivo, 'metodo': environ.get('REQUEST_METHOD'),
+            'caminho': environ.get('PATH_INFO'), 'query': environ.get('QUERY_STRING', ''),
+            'momento': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        }
+
+        def start_response_perfil(status, headers, exc_info=None):
+            perfil['status'] = int(status.split(' ', 1)[0])
+            return start_response(status, list(headers) + [('X-Perfil-Id', str(perfil['id']))], exc_info)
+
+        profiler = cProfile.Profile()
+        inicio = time.perf_counter()
+        profiler.enable()
+        try:
+            corpo = self.wsgi_app(environ, start_response_perfil)
+        except BaseException:
+            profiler.disable()
+            self._ocupado.release()
+            raise
+        return _CorpoPerfilado(corpo, profiler, perfil, inicio, self._ocupado)
+
+class _CorpoPerfilado:
+    """Corpo da resposta perfilada: o perfil termina no close() (chamado pelo servidor WSGI mesmo
+    que o corpo não seja lido até o fim)"""
+
+    def __init__(self, corpo, profiler, perfil, inicio, ocupado):
+        self.corpo, self.profiler, self.perfil, self.inicio, self.ocupado = corpo, profiler, perfil, inicio, ocupado
+        self.fechado = False
+
+    def __iter__(self):
+        return iter(self.corpo)
+
+    def close(self):
+        if self.fechado:
+            return
+        self.fechado = True
+        try:
+            if hasattr(self.corpo, 'close'):
+                self.corpo.close()
+        finally:
+            self.profiler.disable()
+            self.perfil['duracao_ms'] = round((time.perf_counter() - self.inicio) * 1000, 2)
+            self.ocupado.release()
+            texto = io.StringIO()
+            estatisticas = pstats.Stats(self.profiler, stream=texto)
+            estatisticas.sort_stats('cumulative').print_stats(app.config['PERFIL_LINHAS_TEXTO'])
+            self.perfil['estatisticas'], self.perfil['texto'] = estatisticas.stats, texto.getvalue()
+            perfis.guardar(self.perfil)
+
+if app.config['PERFIL_REQUISICOES'] or app.config['PERFIL_AMOSTRAGEM'] > 0:
+    app.wsgi_app = PerfilamentoWSGI(app.wsgi_app)
+
+# reservas.data/horario_* continuam TEXT; dia, inicio_min e fim_min (inteiros, mantidos por trigger)
+# são as colunas usadas nos índices e nas verificações de conflito.
+_ORDINAL_DIA_ZERO = datetime.date(1970, 1, 1).toordinal()
+
+def numero_dia(dia):
+    """date -> dias desde 1970-01-01, o mesmo valor que _sql_dia calcula no banco"""
+    return dia.toordinal() - _ORDINAL_DIA_ZERO
+
+def _sql_dia(data):
+    """Data 'AAAA-MM-DD' -> dias desde 1970-01-01 (NULL se não for uma data)"""
+    return f"CAST(julianday({data}) - 2440587.5 AS INTEGER)"
+
+def _sql_minuto_do_dia(horario):
+    """'HH:MM' -> minutos desde 00:00"""
+    return f"(CAST(substr({horario}, 1, 2) AS INTEGER) * 60 + CAST(substr({horario}, 4, 2) AS INTEGER))"
+
+def minutos_do_dia(horario):
+    """'HH:MM' (ou 'HH:MM:SS') -> minutos desde 00:00; None se não for um horário válido"""
+    try:
+        horas, minutos = str(horario).split(':')[:2]
+        return int(horas) * 60 + int(minutos)
+    except (TypeError, ValueError):
+        return None
+
+_RE_HORARIO = re.compile(r'[0-9]{2}:[0-5][0-9](:[0-5][0-9])?') # Mesma regra de SQL_VALIDACAO_TEMPO
+
+def minutos_horario_valido(horario):
+    """Como minutos_do_dia, mas None se não for HH:MM[:SS] entre 00:00 e 24:00"""
+    horario = str(horario)
+    if not _RE_HORARIO.fullmatch(horario):
+        return None
+    minutos = minutos_do_dia(horario)
+    return minutos if minutos <= 24 * 60 else None
+
+def erro_data_horario(data, inicio, fim):
+    """Mensagem de erro se a data não for AAAA-MM-DD ou os horários não forem HH:MM com início < fim"""
+    try:
+        # isoformat() de volta recusa o que fromisoformat aceita a mais (ex.: '2030-W01-1')
+        if not isinstance(data, str) or len(data) != 10 or datetime.date.fromisoformat(data).isoformat() != data:
+            raise ValueError(data)
+    except ValueError:
+        return 'Data deve estar no formato AAAA-MM-DD.'
+    minutos = [minutos_horario_valido(horario) for horario in (inicio, fim)]
+    if None in minutos:
+        return 'Horários devem estar no formato HH:MM.'
+    if minutos[0] >= minutos[1]:
+        return 'O horário de início deve ser anterior ao de fim.'
+    return None
+
+def horarios_sobrepostos(inicio_existente, fim_existente, inicio, fim):
+    """Mesma regra de conflito das queries de reservas (strings HH:MM ou minutos do dia)"""
+    return (
+        (inicio_existente < fim and fim_existente > inicio) or
+        (inicio_existente < inicio and fim_existente > fim) or
+        (inicio_existente >= inicio and fim_existente <= fim)
+    )
+
+# Consultas de conflito, todas pelo índice (laboratorio_id, dia, inicio_min, fim_min, status)
+SQL_CONFLITOS_DIA = f'''
+    SELECT COUNT(*) FROM reservas
+    WHERE laboratorio_id = ? AND dia = {_sql_dia('?')} AND status != 'cancelada' AND id IS NOT ?
+    AND (
+        (inicio_min < ? AND fim_min > ?) OR
+        (inicio_min < ? AND fim_min > ?) OR
+        (inicio_min >= ? AND fim_min <= ?)
+    )
+'''
+
+def contar_conflitos(conn, laboratorio_id, data, inicio, fim, ignorar_id=None):
+    """Quantas reservas ativas do dia se sobrepõem a [inicio, fim), exceto `ignorar_id`"""
+    inicio, fim = minutos_do_dia(inicio), minutos_do_dia(fim)
+    return conn.execute(
+        SQL_CONFLITOS_DIA, (laboratorio_id, data, ignorar_id, fim, inicio, inicio, fim, inicio, fim)
+    ).fetchone()[0]
+
+def hash_senha(senha):
+    return bcrypt.hashpw(senha.encode('utf-8'), bcrypt.gensalt(rounds=app.config['BCRYPT_ROUNDS']))
+
+def custo_hash(senha_hash):
+    """Fator de custo gravado no hash bcrypt ($2b$<custo>$...)"""
+    if isinstance(senha_hash, str):
+        senha_hash = senha_hash.encode('utf-8')
+    try:
+        return int(senha_hash.split(b'$')[2])
+    except (IndexError, ValueError):
+        return None
+
+class FilaSenhasCheia(Exception):
+    """Há mais verificações de senha pendentes do que BCRYPT_MAX_FILA"""
+
+class ExecutorSenhas:
+    """Executa o bcrypt (CPU intensivo) fora da thread da requisição, com fila limitada.
+
+    Quando a fila enche, falha na hora com FilaSenhasCheia em vez de acumular requisições
+    esperando; o login responde 503 com Retry-After.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._vagas = None
+
+    def _iniciar(self):
+        with self._lock:
+            if self._executor is None:
+                self._vagas = threading.BoundedSemaphore(app.config['BCRYPT_MAX_FILA'])
+                self._executor = ThreadPoolExecutor(
+                    max_workers=app.config['BCRYPT_MAX_WORKERS'], thread_name_prefix='bcrypt'
+                )
+
+    def _executar(self, funcao, *args):
+        if self._executor is None:
+            self._iniciar()
+        if not self._vagas.acquire(blocking=False):
+            raise FilaSenhasCheia()
+        try:
+            future = self._executor.submit(funcao, *args)
+        except Exception:
+            self._vagas.release()
+            raise
+        future.add_done_callback(lambda _: self._vagas.release())
+        return future.result()
+
+    def verificar(self, senha, senha_hash):
+        if isinstance(senha_hash, str):
+            senha_hash = senha_hash.encode('utf-8')
+        return self._executar(bcrypt.checkpw, senha.encode('utf-8'), senha_hash)
+
+    def gerar_hash(self, senha):
+        return self._executar(hash_senha, senha)
+
+executor_senhas = ExecutorSenhas()
+
+def resposta_fila_cheia():
+    response = jsonify({'error': 'Servidor ocupado, tente novamente em instantes'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(app.config['BCRYPT_RETRY_AFTER'])
+    return response
+
+# --- ESCRITAS SERIALIZADAS ---
+# Toda escrita de reserva/professor é uma função comando(tx, ...) -> (corpo, status) executada por
+# executar_escrita(): verificação de conflito e gravação ficam na mesma transação BEGIN IMMEDIATE.
+
+class TransacaoEscrita:
+    """Conexão dentro de uma transação de escrita"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def contar_conflitos(self, laboratorio_id, data, inicio, fim, ignorar_id=None):
+        # Dentro do BEGIN IMMEDIATE: enxerga as escritas de outros processos e as desta transação
+        return contar_conflitos(self.conn, laboratorio_id, data, inicio, fim, ignorar_id)
+
+class EscritorReservas:
+    """Thread única que recebe comandos de escrita por uma fila e os grava em lotes.
+
+    Os comandos que chegam enquanto um lote está sendo gravado formam o próximo: cada um roda
+    num SAVEPOINT (um erro desfaz só aquele comando) e o lote inteiro sai com um único COMMIT.
+    Quem chamou recebe o próprio resultado (ou exceção) por um Future.
+    """
+
+    def __init__(self, shard=None):
+        self.shard = shard # None = banco principal
+        self._lock = threading.Lock()
+        self._fila = queue.Queue()
+        self._thread = None
+        self.lotes = 0
+        self.comandos = 0
+
+    def _iniciar(self):
+        with self._lock:
+            if self._thread is None:
+                nome = 'escritor-reservas' + (f'-{self.shard}' if self.shard else '')
+                self._thread = threading.Thread(target=self._rodar, name=nome, daemon=True)
+                self._thread.start()
+
+    def executar(self, comando, *args):
+        if self._thread is None:
+            self._iniciar()
+        futuro = Future()
+        self._fila.put((comando, args, futuro))
+        return futuro.result(timeout=app.config['ESCRITOR_TIMEOUT'])
+
+    def _rodar(self):
+        conn = _nova_conexao(caminho_shard(self.shard) if self.shard else None)
+        conn.isolation_level = None # BEGIN/COMMIT/SAVEPOINT explícitos
+        while True:
+            lote = [self._fila.get()]
+            while len(lote) < app.config['ESCRITOR_LOTE_MAX']:
+                try:
+                    lote.append(self._fila.get_nowait())
+                except queue.Empty:
+                    break
+            self._gravar(conn, lote)
+
+    def _gravar(self, conn, lote):
+        tx = TransacaoEscrita(conn)
+        resultados = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for comando, args, futuro in lote:
+                conn.execute('SAVEPOINT comando')
+                try:
+                    resultados.append((futuro, comando(tx, *args), None))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO comando')
+                    resultados.append((futuro, None, e))
+                conn.execute('RELEASE comando')
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for _, _, futuro in lote:
+                futuro.set_exception(e)
+            return
+        self.lotes += 1
+        self.comandos += len(lote)
+        for futuro, resultado, erro in resultados:
+            if erro is not None:
+                futuro.set_exception(erro)
+            else:
+                futuro.set_result(resultado)
+
+escritor = EscritorReservas()
+_trava_escrita = threading.Lock() # Sem o escritor: serializa as escritas deste processo
+_escritores_shard, _travas_shard = {}, {} # Cada shard é um arquivo à parte: escritor/trava próprios
+_lock_shards = threading.Lock()
+
+def _escritor_e_trava(shard):
+    if shard is None:
+        return escritor, _trava_escrita
+    with _lock_shards:
+        if shard not in _escritores_shard:
+            _escritores_shard[shard], _travas_shard[shard] = EscritorReservas(shard), threading.Lock()
+        return _escritores_shard[shard], _travas_shard[shard]
+
+def executar_escrita(comando, *args, shard=None):
+    """Roda comando(tx, *args) numa transação BEGIN IMMEDIATE, pela thread escritora ou na própria requisição.
+    Com `shard`, no banco daquele campus (ver shard_do_laboratorio)."""
+    escritor_banco, trava = _escritor_e_trava(shard)
+    if shard is not None and has_app_context():
+        get_db_connection(shard) # Diretório copiado para o shard antes da escrita (chaves estrangeiras)
+    if app.config['ESCRITOR_RESERVAS']:
+        return escritor_banco.executar(comando, *args)
+    with trava:
+        conn = get_db_connection(shard)
+        tx = TransacaoEscrita(conn)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            resultado = comando(tx, *args)
             conn.commit()
-            print("✅ Coluna 'tipo' adicionada com sucesso!")
-    except sqlite3.OperationalError:
-        # Tabela não existe, será criada abaixo
-        print("INFO: Tabela 'professores' não existe ainda, será criada.")
-        pass
-    
-    # Criação da tabela professores
-    conn.execute('''
+        except Exception:
+            conn.rollback()
+            raise
+    return resultado
+
+# Contadores por professor mantidos por triggers, na mesma transação de qualquer escrita em reservas
+SQL_CONTADORES_PROFESSOR = '''
+    CREATE TABLE IF NOT EXISTS contadores_professor (
+        professor_id INTEGER PRIMARY KEY,
+        total INTEGER NOT NULL DEFAULT 0,
+        confirmadas INTEGER NOT NULL DEFAULT 0,
+        pendentes INTEGER NOT NULL DEFAULT 0,
+        canceladas INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (professor_id) REFERENCES professores (id) ON DELETE CASCADE
+    );
+    CREATE TRIGGER IF NOT EXISTS trg_contadores_reserva_insert AFTER INSERT ON reservas
+    BEGIN
+        INSERT OR IGNORE INTO contadores_professor (professor_id) VALUES (NEW.professor_id);
+        UPDATE contadores_professor SET
+            total = total + 1,
+            confirmadas = confirmadas + (NEW.status IS 'confirmada'),
+            pendentes = pendentes + (NEW.status IS 'pendente'),
+            canceladas = canceladas + (NEW.status IS 'cancelada')
+        WHERE professor_id = NEW.professor_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_contadores_reserva_delete AFTER DELETE ON reservas
+    BEGIN
+        UPDATE contadores_professor SET
+            total = total - 1,
+            confirmadas = confirmadas - (OLD.status IS 'confirmada'),
+            pendentes = pendentes - (OLD.status IS 'pendente'),
+            canceladas = canceladas - (OLD.status IS 'cancelada')
+        WHERE professor_id = OLD.professor_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_contadores_reserva_update AFTER UPDATE OF professor_id, status ON reservas
+    BEGIN
+        UPDATE contadores_professor SET
+            total = total - 1,
+            confirmadas = confirmadas - (OLD.status IS 'confirmada'),
+            pendentes = pendentes - (OLD.status IS 'pendente'),
+            canceladas = canceladas - (OLD.status IS 'cancelada')
+        WHERE professor_id = OLD.professor_id;
+        INSERT OR IGNORE INTO contadores_professor (professor_id) VALUES (NEW.professor_id);
+        UPDATE contadores_professor SET
+            total = total + 1,
+            confirmadas = confirmadas + (NEW.status IS 'confirmada'),
+            pendentes = pendentes + (NEW.status IS 'pendente'),
+            canceladas = canceladas + (NEW.status IS 'cancelada')
+        WHERE professor_id = NEW.professor_id;
+    END;
+'''
+
+def _sql_incrementar_versao(tabela):
+    return f'''
+        INSERT INTO versoes_dados (tabela, versao, atualizado_em) VALUES ('{tabela}', 1, CURRENT_TIMESTAMP)
+        ON CONFLICT (tabela) DO UPDATE SET versao = versao + 1, atualizado_em = CURRENT_TIMESTAMP;'''
+
+def sql_versao_tabela(tabela, colunas=None):
+    """Triggers que incrementam versoes_dados[tabela] a cada INSERT/UPDATE/DELETE na tabela
+    (com `colunas`, só UPDATEs que alteram essas colunas contam)"""
+    atualizacao = f"UPDATE OF {', '.join(colunas)}" if colunas else 'UPDATE'
+    return ''.join(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_versao_{tabela}_{nome} AFTER {operacao} ON {tabela}
+    BEGIN{_sql_incrementar_versao(tabela)}
+    END;
+    ''' for nome, operacao in (('insert', 'INSERT'), ('update', atualizacao), ('delete', 'DELETE')))
+
+# Versão por tabela, compartilhada por todos os processos via banco; usada para validar caches
+SQL_VERSOES_DADOS = '''
+    CREATE TABLE IF NOT EXISTS versoes_dados (
+        tabela TEXT PRIMARY KEY,
+        versao INTEGER NOT NULL DEFAULT 0,
+        atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+''' + sql_versao_tabela('laboratorios')
+
+def _sql_minutos(inicio, fim):
+    """Duração em minutos de horários 'HH:MM' (nunca negativa)"""
+    return (f"MAX(0, (CAST(substr({fim}, 1, 2) AS INTEGER) * 60 + CAST(substr({fim}, 4, 2) AS INTEGER))"
+            f" - (CAST(substr({inicio}, 1, 2) AS INTEGER) * 60 + CAST(substr({inicio}, 4, 2) AS INTEGER)))")
+
+def _sql_ocupacao_somar(reserva):
+    """Soma a reserva OLD/NEW em ocupacao_diaria, no departamento atual do professor"""
+    return f'''
+        INSERT INTO ocupacao_diaria (laboratorio_id, data, departamento, status, reservas, minutos)
+        SELECT {reserva}.laboratorio_id, {reserva}.data, IFNULL(departamento, ''), IFNULL({reserva}.status, ''), 1,
+               {_sql_minutos(f'{reserva}.horario_inicio', f'{reserva}.horario_fim')}
+        FROM professores WHERE id = {reserva}.professor_id
+        ON CONFLICT (laboratorio_id, data, departamento, status) DO UPDATE SET
+            reservas = reservas + excluded.reservas, minutos = minutos + excluded.minutos;'''
+
+def _sql_ocupacao_subtrair(reserva):
+    """Desconta a reserva OLD/NEW de ocupacao_diaria (nada a fazer se o professor já foi removido)"""
+    chave = f'''laboratorio_id = {reserva}.laboratorio_id AND data = {reserva}.data AND status = IFNULL({reserva}.status, '')
+            AND departamento = (SELECT IFNULL(departamento, '') FROM professores WHERE id = {reserva}.professor_id)'''
+    return f'''
+        UPDATE ocupacao_diaria SET reservas = reservas - 1,
+            minutos = minutos - {_sql_minutos(f'{reserva}.horario_inicio', f'{reserva}.horario_fim')}
+        WHERE {chave};
+        DELETE FROM ocupacao_diaria WHERE {chave} AND reservas <= 0;'''
+
+def _sql_ocupacao_professor(sinal, professor):
+    """Soma (+) ou desconta (-) todas as reservas de um professor no departamento OLD/NEW dele"""
+    agregado = f'''
+            SELECT laboratorio_id, data, IFNULL({professor}.departamento, '') AS departamento, IFNULL(status, '') AS status,
+                   COUNT(*) AS reservas, SUM({_sql_minutos('horario_inicio', 'horario_fim')}) AS minutos
+            FROM reservas WHERE professor_id = {professor}.id
+            GROUP BY laboratorio_id, data, IFNULL(status, '')'''
+    if sinal == '+':
+        return f'''
+        INSERT INTO ocupacao_diaria (laboratorio_id, data, departamento, status, reservas, minutos) {agregado}
+        ON CONFLICT (laboratorio_id, data, departamento, status) DO UPDATE SET
+            reservas = reservas + excluded.reservas, minutos = minutos + excluded.minutos;'''
+    return f'''
+        UPDATE ocupacao_diaria SET reservas = ocupacao_diaria.reservas - a.reservas, minutos = ocupacao_diaria.minutos - a.minutos
+        FROM ({agregado}) AS a
+        WHERE ocupacao_diaria.laboratorio_id = a.laboratorio_id AND ocupacao_diaria.data = a.data
+            AND ocupacao_diaria.departamento = a.departamento AND ocupacao_diaria.status = a.status;
+        DELETE FROM ocupacao_diaria WHERE departamento = IFNULL({professor}.departamento, '') AND reservas <= 0;'''
+
+# Ocupação por (laboratório, dia, departamento, status), mantida por triggers na mesma transação
+# de cada escrita em reservas; os relatórios de utilização leem apenas daqui.
+SQL_OCUPACAO_DIARIA = f'''
+    CREATE TABLE IF NOT EXISTS ocupacao_diaria (
+        laboratorio_id INTEGER NOT NULL,
+        data DATE NOT NULL,
+        departamento TEXT NOT NULL DEFAULT '',
+        status TEXT NOT NULL DEFAULT '',
+        reservas INTEGER NOT NULL DEFAULT 0,
+        minutos INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (laboratorio_id, data, departamento, status),
+        FOREIGN KEY (laboratorio_id) REFERENCES laboratorios (id) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_ocupacao_diaria_data ON ocupacao_diaria (data);
+    CREATE TRIGGER IF NOT EXISTS trg_ocupacao_reserva_insert AFTER INSERT ON reservas
+    BEGIN{_sql_ocupacao_somar('NEW')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_ocupacao_reserva_delete AFTER DELETE ON reservas
+    BEGIN{_sql_ocupacao_subtrair('OLD')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_ocupacao_reserva_update
+    AFTER UPDATE OF professor_id, laboratorio_id, data, horario_inicio, horario_fim, status ON reservas
+    BEGIN{_sql_ocupacao_subtrair('OLD')}{_sql_ocupacao_somar('NEW')}
+    END;
+    -- Na exclusão em cascata o professor já não existe quando as reservas saem; desconta antes
+    CREATE TRIGGER IF NOT EXISTS trg_ocupacao_professor_delete BEFORE DELETE ON professores
+    BEGIN{_sql_ocupacao_professor('-', 'OLD')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_ocupacao_professor_departamento AFTER UPDATE OF departamento ON professores
+    WHEN IFNULL(OLD.departamento, '') != IFNULL(NEW.departamento, '')
+    BEGIN{_sql_ocupacao_professor('-', 'OLD')}{_sql_ocupacao_professor('+', 'NEW')}
+    END;
+'''
+
+_SQL_VERSAO_RESERVAS = "(SELECT versao FROM versoes_dados WHERE tabela = 'reservas')"
+
+# Feed de alterações: cada escrita em reservas incrementa versoes_dados['reservas'] e grava o novo
+# valor em versao_alteracao da linha; exclusões definitivas (cascata) ficam em reservas_removidas.
+SQL_ALTERACOES_RESERVAS = f'''
+    ALTER TABLE reservas ADD COLUMN versao_alteracao INTEGER NOT NULL DEFAULT 0;
+    CREATE INDEX IF NOT EXISTS idx_reservas_versao_alteracao ON reservas (versao_alteracao);
+    CREATE TABLE IF NOT EXISTS reservas_removidas (
+        reserva_id INTEGER PRIMARY KEY,
+        laboratorio_id INTEGER NOT NULL,
+        versao_alteracao INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_reservas_removidas_versao ON reservas_removidas (versao_alteracao);
+    CREATE TRIGGER IF NOT EXISTS trg_alteracao_reserva_insert AFTER INSERT ON reservas
+    BEGIN{_sql_incrementar_versao('reservas')}
+        UPDATE reservas SET versao_alteracao = {_SQL_VERSAO_RESERVAS} WHERE id = NEW.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_alteracao_reserva_update AFTER UPDATE OF
+        professor_id, laboratorio_id, data, horario_inicio, horario_fim, disciplina, turma, descricao_atividade, status
+    ON reservas
+    BEGIN{_sql_incrementar_versao('reservas')}
+        UPDATE reservas SET versao_alteracao = {_SQL_VERSAO_RESERVAS} WHERE id = NEW.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_alteracao_reserva_delete AFTER DELETE ON reservas
+    BEGIN{_sql_incrementar_versao('reservas')}
+        INSERT OR REPLACE INTO reservas_removidas (reserva_id, laboratorio_id, versao_alteracao)
+        VALUES (OLD.id, OLD.laboratorio_id, {_SQL_VERSAO_RESERVAS});
+    END;
+'''
+
+# Durante o arquivamento há uma linha em arquivamento_ativo (só dentro da transação que apaga as
+# reservas já copiadas): contadores, ocupação e feed de alterações tratam o histórico como intacto.
+_SQL_SEM_ARQUIVAMENTO = 'WHEN NOT EXISTS (SELECT 1 FROM arquivamento_ativo)'
+SQL_GATILHOS_ARQUIVAMENTO = f'''
+    CREATE TABLE IF NOT EXISTS arquivamento_ativo (ativo INTEGER NOT NULL);
+    DROP TRIGGER IF EXISTS trg_contadores_reserva_delete;
+    CREATE TRIGGER trg_contadores_reserva_delete AFTER DELETE ON reservas {_SQL_SEM_ARQUIVAMENTO}
+    BEGIN
+        UPDATE contadores_professor SET
+            total = total - 1,
+            confirmadas = confirmadas - (OLD.status IS 'confirmada'),
+            pendentes = pendentes - (OLD.status IS 'pendente'),
+            canceladas = canceladas - (OLD.status IS 'cancelada')
+        WHERE professor_id = OLD.professor_id;
+    END;
+    DROP TRIGGER IF EXISTS trg_ocupacao_reserva_delete;
+    CREATE TRIGGER trg_ocupacao_reserva_delete AFTER DELETE ON reservas {_SQL_SEM_ARQUIVAMENTO}
+    BEGIN{_sql_ocupacao_subtrair('OLD')}
+    END;
+    DROP TRIGGER IF EXISTS trg_alteracao_reserva_delete;
+    CREATE TRIGGER trg_alteracao_reserva_delete AFTER DELETE ON reservas {_SQL_SEM_ARQUIVAMENTO}
+    BEGIN{_sql_incrementar_versao('reservas')}
+        INSERT OR REPLACE INTO reservas_removidas (reserva_id, laboratorio_id, versao_alteracao)
+        VALUES (OLD.id, OLD.laboratorio_id, {_SQL_VERSAO_RESERVAS});
+    END;
+'''
+
+# Índice de texto das reservas (disciplina, turma, descrição e nome do professor), rowid = reservas.id.
+# Mantido por triggers; ao arquivar, as linhas ficam no índice para a busca com incluir_arquivo=1.
+_SQL_LINHA_BUSCA = '''
+        INSERT INTO reservas_busca (rowid, disciplina, turma, descricao_atividade, professor, professor_id)
+        SELECT NEW.id, NEW.disciplina, NEW.turma, IFNULL(NEW.descricao_atividade, ''),
+               (SELECT nome_completo FROM professores WHERE id = NEW.professor_id), NEW.professor_id;'''
+SQL_BUSCA_RESERVAS = f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS reservas_busca USING fts5(
+        disciplina, turma, descricao_atividade, professor, professor_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    );
+    CREATE TRIGGER IF NOT EXISTS trg_busca_reserva_insert AFTER INSERT ON reservas
+    BEGIN{_SQL_LINHA_BUSCA}
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_busca_reserva_update AFTER UPDATE OF
+        professor_id, disciplina, turma, descricao_atividade
+    ON reservas
+    BEGIN
+        DELETE FROM reservas_busca WHERE rowid = OLD.id;{_SQL_LINHA_BUSCA}
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_busca_reserva_delete AFTER DELETE ON reservas {_SQL_SEM_ARQUIVAMENTO}
+    BEGIN
+        DELETE FROM reservas_busca WHERE rowid = OLD.id;
+    END;
+    -- Renomear um professor é raro: varre o índice, o que também alcança as reservas arquivadas
+    CREATE TRIGGER IF NOT EXISTS trg_busca_professor_update AFTER UPDATE OF nome_completo ON professores
+    BEGIN
+        UPDATE reservas_busca SET professor = NEW.nome_completo WHERE professor_id = NEW.id;
+    END;
+'''
+
+# dia/inicio_min/fim_min espelham data/horario_inicio/horario_fim (ver _sql_dia); os índices cobrem
+# as consultas de conflito, o dashboard e os filtros por status + período sem ler a linha da tabela.
+_SQL_COLUNAS_TEMPO = (f"dia = {_sql_dia('data')}, inicio_min = {_sql_minuto_do_dia('horario_inicio')}, "
+                      f"fim_min = {_sql_minuto_do_dia('horario_fim')}")
+SQL_TEMPO_RESERVAS = f'''
+    CREATE TRIGGER IF NOT EXISTS trg_tempo_reserva_insert AFTER INSERT ON reservas
+    BEGIN
+        UPDATE reservas SET {_SQL_COLUNAS_TEMPO} WHERE id = NEW.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_tempo_reserva_update AFTER UPDATE OF data, horario_inicio, horario_fim ON reservas
+    BEGIN
+        UPDATE reservas SET {_SQL_COLUNAS_TEMPO} WHERE id = NEW.id;
+    END;
+    CREATE INDEX IF NOT EXISTS idx_reservas_lab_dia_horario ON reservas (laboratorio_id, dia, inicio_min, fim_min, status);
+    CREATE INDEX IF NOT EXISTS idx_reservas_prof_status_dia ON reservas (professor_id, status, dia, inicio_min);
+    CREATE INDEX IF NOT EXISTS idx_reservas_status_dia ON reservas (status, dia);
+    -- Substituído por idx_reservas_prof_status_dia
+    DROP INDEX IF EXISTS idx_reservas_prof_status_data;
+'''
+
+# Última barreira para dia/inicio_min/fim_min: julianday() devolve NULL para uma data inválida e o CAST
+# de um horário inválido vira 0, e a reserva ficaria fora das verificações de conflito.
+def _sql_tempo_valido(reserva):
+    horarios = ' AND '.join(
+        f"(({reserva}.{h} GLOB '[0-9][0-9]:[0-5][0-9]' OR {reserva}.{h} GLOB '[0-9][0-9]:[0-5][0-9]:[0-5][0-9]') "
+        f"AND {_sql_minuto_do_dia(f'{reserva}.{h}')} <= 1440)"
+        for h in ('horario_inicio', 'horario_fim')
+    )
+    return f"date(julianday({reserva}.data)) IS {reserva}.data AND {horarios}" # date() sozinho aceita 02-30
+
+SQL_VALIDACAO_TEMPO = f'''
+    CREATE TRIGGER IF NOT EXISTS trg_tempo_reserva_valido_insert BEFORE INSERT ON reservas
+    WHEN NOT ({_sql_tempo_valido('NEW')})
+    BEGIN
+        SELECT RAISE(ABORT, 'Data ou horário inválido na reserva');
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_tempo_reserva_valido_update BEFORE UPDATE OF data, horario_inicio, horario_fim ON reservas
+    WHEN NOT ({_sql_tempo_valido('NEW')})
+    BEGIN
+        SELECT RAISE(ABORT, 'Data ou horário inválido na reserva');
+    END;
+'''
+
+# Tabela e triggers da antiga agenda em memória (migração 15), removidos na migração 17: a checagem
+# de conflitos consulta o banco pelo índice (laboratorio_id, dia, inicio_min, fim_min, status)
+SQL_REMOVER_VERSOES_AGENDA = '''
+    DROP TRIGGER IF EXISTS trg_versao_agenda_insert;
+    DROP TRIGGER IF EXISTS trg_versao_agenda_update;
+    DROP TRIGGER IF EXISTS trg_versao_agenda_delete;
+    DROP TABLE IF EXISTS versoes_agenda;
+'''
+
+def _sql_incrementar_versao_feed(tipo, alvo):
+    return f'''
+        INSERT INTO versoes_feed (tipo, alvo_id, versao, atualizado_em) VALUES ('{tipo}', {alvo}, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT (tipo, alvo_id) DO UPDATE SET versao = versao + 1, atualizado_em = CURRENT_TIMESTAMP;'''
+
+# Feeds ICS assinados por laboratório ou professor (só o hash do token fica no banco) e a versão de
+# cada feed: uma reserva alterada invalida apenas os feeds do seu laboratório e do seu professor.
+# O DELETE não é filtrado pelo arquivamento: o corte de arquivo pode ser menor que a janela do feed.
+_COLUNAS_FEED_RESERVA = ['professor_id', 'laboratorio_id', 'data', 'horario_inicio', 'horario_fim',
+                         'disciplina', 'turma', 'descricao_atividade', 'status']
+SQL_FEEDS_CALENDARIO = f'''
+    CREATE TABLE IF NOT EXISTS feeds_calendario (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        token_hash TEXT UNIQUE NOT NULL,
+        professor_id INTEGER NOT NULL,
+        tipo TEXT NOT NULL CHECK (tipo IN ('laboratorio', 'professor')),
+        alvo_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (professor_id) REFERENCES professores (id) ON DELETE CASCADE
+    );
+    CREATE INDEX IF NOT EXISTS idx_feeds_calendario_professor ON feeds_calendario (professor_id);
+    CREATE TABLE IF NOT EXISTS versoes_feed (
+        tipo TEXT NOT NULL,
+        alvo_id INTEGER NOT NULL,
+        versao INTEGER NOT NULL DEFAULT 0,
+        atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (tipo, alvo_id)
+    ) WITHOUT ROWID;
+    CREATE TRIGGER IF NOT EXISTS trg_versao_feed_insert AFTER INSERT ON reservas
+    BEGIN{_sql_incrementar_versao_feed('laboratorio', 'NEW.laboratorio_id')}{_sql_incrementar_versao_feed('professor', 'NEW.professor_id')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_versao_feed_update AFTER UPDATE OF {', '.join(_COLUNAS_FEED_RESERVA)} ON reservas
+    BEGIN{_sql_incrementar_versao_feed('laboratorio', 'OLD.laboratorio_id')}{_sql_incrementar_versao_feed('professor', 'OLD.professor_id')}
+        {_sql_incrementar_versao_feed('laboratorio', 'NEW.laboratorio_id')}{_sql_incrementar_versao_feed('professor', 'NEW.professor_id')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_versao_feed_delete AFTER DELETE ON reservas
+    BEGIN{_sql_incrementar_versao_feed('laboratorio', 'OLD.laboratorio_id')}{_sql_incrementar_versao_feed('professor', 'OLD.professor_id')}
+    END;
+'''
+
+# Sessões: status, tipo e geracao_token de professores (DELETE incluso) mudam versoes_dados['autenticacao'],
+# que os outros processos conferem para descartar o cache de autenticação
+SQL_VERSAO_AUTENTICACAO = f'''
+    CREATE TRIGGER IF NOT EXISTS trg_versao_autenticacao_update AFTER UPDATE OF status, tipo, geracao_token ON professores
+    BEGIN{_sql_incrementar_versao('autenticacao')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS trg_versao_autenticacao_delete AFTER DELETE ON professores
+    BEGIN{_sql_incrementar_versao('autenticacao')}
+    END;
+'''
+
+def versao_dados(conn, tabela):
+    row = conn.execute('SELECT versao FROM versoes_dados WHERE tabela = ?', (tabela,)).fetchone()
+    return row['versao'] if row else 0
+
+class CacheLaboratorios:
+    """Lista de laboratórios já serializada, válida enquanto versoes_dados['laboratorios'] não mudar.
+
+    As rotas de escrita chamam invalidar() para o próprio processo; os demais workers percebem
+    a mudança pela versão gravada no banco (incrementada por trigger na mesma transação).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versao = None
+        self._corpo = None
+
+    def obter(self, versao):
+        with self._lock:
+            return self._corpo if self._versao == versao else None
+
+    def guardar(self, versao, corpo):
+        with self._lock:
+            self._versao, self._corpo = versao, corpo
+
+    def invalidar(self):
+        with self._lock:
+            self._versao, self._corpo = None, None
+
+cache_laboratorios = CacheLaboratorios()
+
+def _reservas_historico(conn):
+    """Tabela/visão com todo o histórico de reservas: inclui o arquivo se ele estiver anexado à conexão"""
+    anexados = {row[1] for row in conn.execute('PRAGMA database_list')}
+    return 'reservas_com_arquivo' if 'arquivo' in anexados else 'reservas'
+
+def reconstruir_contadores(conn):
+    """Recalcula contadores_professor do zero a partir de reservas (e do arquivo, se anexado)"""
+    conn.execute('DELETE FROM contadores_professor')
+    conn.execute(f'''
+        INSERT INTO contadores_professor (professor_id, total, confirmadas, pendentes, canceladas)
+        SELECT professor_id, COUNT(*),
+               SUM(status IS 'confirmada'), SUM(status IS 'pendente'), SUM(status IS 'cancelada')
+        FROM {_reservas_historico(conn)} WHERE professor_id IN (SELECT id FROM professores)
+        GROUP BY professor_id
+    ''')
+
+def reconstruir_ocupacao(conn):
+    """Recalcula ocupacao_diaria do zero a partir de reservas (e do arquivo, se anexado)"""
+    conn.execute('DELETE FROM ocupacao_diaria')
+    conn.execute(f'''
+        INSERT INTO ocupacao_diaria (laboratorio_id, data, departamento, status, reservas, minutos)
+        SELECT r.laboratorio_id, r.data, IFNULL(p.departamento, ''), IFNULL(r.status, ''), COUNT(*),
+               SUM({_sql_minutos('r.horario_inicio', 'r.horario_fim')})
+        FROM {_reservas_historico(conn)} r JOIN professores p ON p.id = r.professor_id
+        WHERE r.laboratorio_id IN (SELECT id FROM laboratorios)
+        GROUP BY r.laboratorio_id, r.data, IFNULL(p.departamento, ''), IFNULL(r.status, '')
+    ''')
+
+def reconstruir_busca(conn):
+    """Recria o índice de texto a partir de reservas (e do arquivo, se anexado)"""
+    conn.execute('DELETE FROM reservas_busca')
+    conn.execute(f'''
+        INSERT INTO reservas_busca (rowid, disciplina, turma, descricao_atividade, professor, professor_id)
+        SELECT r.id, r.disciplina, r.turma, IFNULL(r.descricao_atividade, ''), p.nome_completo, r.professor_id
+        FROM {_reservas_historico(conn)} r LEFT JOIN professores p ON p.id = r.professor_id
+    ''')
+    conn.execute("INSERT INTO reservas_busca (reservas_busca) VALUES ('optimize')")
+
+def executar_script(conn, sql):
+    """Como conn.executescript, mas sem o COMMIT implícito: cada comando roda na transação corrente"""
+    comando = ''
+    for linha in sql.splitlines(keepends=True):
+        comando += linha
+        if sqlite3.complete_statement(comando):
+            conn.execute(comando)
+            comando = ''
+    if comando.strip():
+        conn.execute(comando)
+
+# --- MIGRAÇÕES DO BANCO ---
+# Cada migração roda uma única vez, em ordem, e a versão aplicada fica em PRAGMA user_version.
+# Para mudar o schema, acrescente uma nova função ao final de MIGRACOES (nunca altere as já publicadas).
+
+def _migracao_schema_base(conn):
+    # Bancos criados por versões antigas podem não ter as colunas 'status' e 'tipo' em professores
+    colunas = [column[1] for column in conn.execute("PRAGMA table_info(professores)").fetchall()]
+    if colunas and 'status' not in colunas:
+        conn.execute('ALTER TABLE professores ADD COLUMN status TEXT DEFAULT "ativo"')
+    if colunas and 'tipo' not in colunas:
+        conn.execute('ALTER TABLE professores ADD COLUMN tipo TEXT DEFAULT "professor"')
+
+    executar_script(conn, '''
         CREATE TABLE IF NOT EXISTS professores (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             nome_completo TEXT NOT NULL,
@@ -59,11 +1145,7 @@ def init_database():
             status TEXT DEFAULT 'ativo',
             tipo TEXT DEFAULT 'professor',
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Criação da tabela laboratórios
-    conn.execute('''
+        );
         CREATE TABLE IF NOT EXISTS laboratorios (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             nome TEXT NOT NULL,
@@ -72,11 +1154,7 @@ def init_database():
             recursos TEXT,
             status TEXT DEFAULT 'disponivel',
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Criação da tabela reservas
-    conn.execute('''
+        );
         CREATE TABLE IF NOT EXISTS reservas (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             professor_id INTEGER NOT NULL,
@@ -91,100 +1169,751 @@ def init_database():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (professor_id) REFERENCES professores (id) ON DELETE CASCADE,
             FOREIGN KEY (laboratorio_id) REFERENCES laboratorios (id) ON DELETE CASCADE
-        )
+        );
     ''')
-    conn.commit() # Commit após a criação das tabelas e alterações de schema
+    # Professores antigos que ficaram com valores NULL nas colunas adicionadas depois
+    conn.execute("UPDATE professores SET status = 'ativo' WHERE status IS NULL AND matricula != '999999'")
+    conn.execute("UPDATE professores SET tipo = 'professor' WHERE tipo IS NULL AND matricula != '999999'")
 
-    # --- INÍCIO DA LÓGICA AJUSTADA PARA ADMIN E PROFESSORES INICIAIS ---
-    
-    # Verificar e garantir que o admin exista e esteja correto
+def _migracao_dados_iniciais(conn):
+    """Admin, professores e laboratórios de exemplo; só calcula hashes bcrypt se for inserir algo"""
     admin_row = conn.execute("SELECT id, tipo, status FROM professores WHERE matricula = '999999'").fetchone()
-    senha_admin_hash = bcrypt.hashpw('admin123'.encode('utf-8'), bcrypt.gensalt())
-
     if admin_row is None:
         print("INFO: Admin '999999' não encontrado. Criando novo admin.")
         conn.execute('''
             INSERT INTO professores (nome_completo, matricula, email, telefone, departamento, senha_hash, tipo, status)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', ('Admin Geral', '999999', 'admin@uern.br', '', 'Administração', senha_admin_hash, 'admin', 'ativo'))
+        ''', ('Admin Geral', '999999', 'admin@uern.br', '', 'Administração', hash_senha('admin123'), 'admin', 'ativo'))
     elif admin_row['tipo'] != 'admin' or admin_row['status'] != 'ativo':
-        print("INFO: Admin '999999' encontrado, mas com tipo/status incorreto ou senha pode estar desatualizada. Atualizando.")
+        print("INFO: Admin '999999' encontrado, mas com tipo/status incorreto. Atualizando.")
         conn.execute('''
             UPDATE professores SET tipo = 'admin', status = 'ativo', senha_hash = ? 
             WHERE matricula = '999999'
-        ''', (senha_admin_hash,)) # Atualiza a senha também para garantir consistência
-    else:
-        print("INFO: Admin '999999' já existe e está correto.")
-    conn.commit()
+        ''', (hash_senha('admin123'),)) # Atualiza a senha também para garantir consistência
 
-    # Lógica para outros professores iniciais
-    # Insere apenas se a tabela tiver apenas o admin (ou estiver vazia antes do admin ser tratado)
     prof_count_outros = conn.execute("SELECT COUNT(*) as count FROM professores WHERE matricula != '999999'").fetchone()['count']
-    
     if prof_count_outros == 0:
         print("INFO: Nenhum outro professor encontrado. Inserindo professores iniciais padrão.")
-        senha_hash_prof = bcrypt.hashpw('123456'.encode('utf-8'), bcrypt.gensalt())
+        senha_hash_prof = hash_senha('123456')
         professores_iniciais = [
             # (nome_completo, matricula, email, telefone, departamento, senha_hash, tipo, status)
             ('Prof. André Gustavo', '123456', 'andre@uern.br', '(84) 99999-9999', 'Ciência da Computação', senha_hash_prof, 'professor', 'ativo'),
             ('Prof. Maria Silva', '123457', 'maria@uern.br', '(84) 98888-8888', 'Ciência da Computação', senha_hash_prof, 'professor', 'ativo'),
         ]
-        for prof_data in professores_iniciais:
-            # Usar INSERT OR IGNORE para o caso de alguma matricula já existir por um motivo inesperado
-            conn.execute('''
-                INSERT OR IGNORE INTO professores 
-                (nome_completo, matricula, email, telefone, departamento, senha_hash, tipo, status) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', prof_data)
-        conn.commit()
-    else:
-        print(f"INFO: {prof_count_outros} outros professor(es) já existem. Não inserindo professores iniciais padrão.")
-
-    # Atualizar status e tipo para professores existentes que não são o admin e podem ter valores NULL
-    conn.execute("UPDATE professores SET status = 'ativo' WHERE status IS NULL AND matricula != '999999'")
-    conn.execute("UPDATE professores SET tipo = 'professor' WHERE tipo IS NULL AND matricula != '999999'")
-    conn.commit()
+        conn.executemany('''
+            INSERT OR IGNORE INTO professores 
+            (nome_completo, matricula, email, telefone, departamento, senha_hash, tipo, status) 
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', professores_iniciais)
 
-    # Verificar e inserir laboratórios iniciais
-    existing_labs_row = conn.execute('SELECT COUNT(*) as count FROM laboratorios').fetchone()
-    if existing_labs_row and existing_labs_row['count'] == 0:
+    if conn.execute('SELECT COUNT(*) as count FROM laboratorios').fetchone()['count'] == 0:
         print("INFO: Nenhum laboratório encontrado. Inserindo laboratórios iniciais.")
         recursos_labcc = json.dumps(["30 Computadores", "Datashow", "Ar Condicionado", "Quadro Digital"])
         recursos_labcan = json.dumps(["25 Computadores", "Datashow", "Ar Condicionado"])
-        laboratorios_iniciais = [
+        conn.executemany('''
+            INSERT OR IGNORE INTO laboratorios 
+            (nome, localizacao, capacidade, recursos, status) 
+            VALUES (?, ?, ?, ?, 'disponivel')
+        ''', [
             ('LabCC', 'Bloco A - Sala 101', 30, recursos_labcc),
             ('LabCan', 'Campus Natal - Sala 201', 25, recursos_labcan)
-        ]
-        for lab_data in laboratorios_iniciais:
-            conn.execute('''
-                INSERT OR IGNORE INTO laboratorios 
-                (nome, localizacao, capacidade, recursos, status) 
-                VALUES (?, ?, ?, ?, 'disponivel')
-            ''', lab_data)
-        conn.commit()
+        ])
+
+def _migracao_indices_reservas(conn):
+    executar_script(conn, '''
+        -- Consultas por janela de datas (calendário), opcionalmente filtradas por laboratório
+        CREATE INDEX IF NOT EXISTS idx_reservas_data_lab ON reservas (data, laboratorio_id);
+        -- Na ordem das listagens paginadas (keyset em data, horario_inicio, id)
+        CREATE INDEX IF NOT EXISTS idx_reservas_data_horario ON reservas (data, horario_inicio);
+        CREATE INDEX IF NOT EXISTS idx_reservas_prof_data_horario ON reservas (professor_id, data, horario_inicio);
+        -- Próximas reservas do dashboard: professor + status + data, já na ordem de exibição
+        CREATE INDEX IF NOT EXISTS idx_reservas_prof_status_data ON reservas (professor_id, status, data, horario_inicio);
+    ''')
+
+def _migracao_contadores_professor(conn):
+    executar_script(conn, SQL_CONTADORES_PROFESSOR)
+    reconstruir_contadores(conn)
+
+def _migracao_versoes_dados(conn):
+    executar_script(conn, SQL_VERSOES_DADOS)
+
+def _migracao_ocupacao_diaria(conn):
+    executar_script(conn, SQL_OCUPACAO_DIARIA)
+    reconstruir_ocupacao(conn)
+
+def _migracao_alteracoes_reservas(conn):
+    executar_script(conn, SQL_ALTERACOES_RESERVAS)
+
+def _migracao_versao_professores(conn):
+    # A senha (regravada no login) não aparece em nenhuma listagem; não invalida os caches
+    executar_script(conn, sql_versao_tabela('professores', colunas=[
+        'nome_completo', 'matricula', 'email', 'telefone', 'departamento', 'status', 'tipo'
+    ]))
+    # Linhas iniciais: o Last-Modified das rotas condicionais já vale antes da primeira escrita
+    conn.execute("INSERT OR IGNORE INTO versoes_dados (tabela) VALUES ('laboratorios'), ('reservas'), ('professores')")
+
+def _migracao_gatilhos_arquivamento(conn):
+    executar_script(conn, SQL_GATILHOS_ARQUIVAMENTO)
+
+def _migracao_tempo_inteiro_reservas(conn):
+    colunas = [column[1] for column in conn.execute("PRAGMA table_info(reservas)").fetchall()]
+    for coluna in ('dia', 'inicio_min', 'fim_min'):
+        if coluna not in colunas:
+            conn.execute(f'ALTER TABLE reservas ADD COLUMN {coluna} INTEGER')
+    executar_script(conn, SQL_TEMPO_RESERVAS)
+    conn.execute(f'UPDATE reservas SET {_SQL_COLUNAS_TEMPO}') # Preenche as reservas já existentes
+
+def _migracao_diretorio_sincronizado(conn):
+    # Nos shards: versões de professores/laboratórios já copiadas do banco principal
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS diretorio_sincronizado (
+            tabela TEXT PRIMARY KEY,
+            versao INTEGER NOT NULL
+        )
+    ''')
+
+def _migracao_feeds_calendario(conn):
+    executar_script(conn, SQL_FEEDS_CALENDARIO)
+
+def _migracao_revogacao_sessoes(conn):
+    colunas = [column[1] for column in conn.execute("PRAGMA table_info(professores)").fetchall()]
+    if 'geracao_token' not in colunas:
+        # Incrementada para invalidar todos os tokens já emitidos do professor
+        conn.execute('ALTER TABLE professores ADD COLUMN geracao_token INTEGER NOT NULL DEFAULT 0')
+    executar_script(conn, SQL_VERSAO_AUTENTICACAO)
+    conn.execute("INSERT OR IGNORE INTO versoes_dados (tabela) VALUES ('autenticacao')")
+
+def _migracao_versoes_agenda(conn):
+    pass # Desfeita pela migração 17; mantida só para a numeração dos bancos que já a aplicaram
+
+def _migracao_remover_versoes_agenda(conn):
+    executar_script(conn, SQL_REMOVER_VERSOES_AGENDA)
+
+def _migracao_validacao_tempo(conn):
+    executar_script(conn, SQL_VALIDACAO_TEMPO)
+    invalidas = conn.execute('SELECT COUNT(*) FROM reservas WHERE dia IS NULL').fetchone()[0]
+    if invalidas:
+        print(f"AVISO: {invalidas} reserva(s) com data inválida ficam fora das verificações de conflito; corrija-as manualmente.")
+
+def _migracao_busca_reservas(conn):
+    executar_script(conn, SQL_BUSCA_RESERVAS)
+    reconstruir_busca(conn)
+
+MIGRACOES = [
+    (1, 'schema base', _migracao_schema_base),
+    (2, 'dados iniciais', _migracao_dados_iniciais),
+    (3, 'índices de reservas', _migracao_indices_reservas),
+    (4, 'contadores por professor', _migracao_contadores_professor),
+    (5, 'versões de dados', _migracao_versoes_dados),
+    (6, 'ocupação diária dos laboratórios', _migracao_ocupacao_diaria),
+    (7, 'feed de alterações de reservas', _migracao_alteracoes_reservas),
+    (8, 'versão de professores', _migracao_versao_professores),
+    (9, 'arquivamento de reservas', _migracao_gatilhos_arquivamento),
+    (10, 'busca textual de reservas', _migracao_busca_reservas),
+    (11, 'datas e horários inteiros em reservas', _migracao_tempo_inteiro_reservas),
+    (12, 'cópia do diretório nos shards', _migracao_diretorio_sincronizado),
+    (13, 'feeds ICS de calendário', _migracao_feeds_calendario),
+    (14, 'revogação de sessões', _migracao_revogacao_sessoes),
+    (15, 'versões da agenda por dia', _migracao_versoes_agenda),
+    (16, 'validação de data e horário das reservas', _migracao_validacao_tempo),
+    (17, 'remoção das versões da agenda', _migracao_remover_versoes_agenda),
+]
+
+MIGRACOES_SO_PRINCIPAL = {2} # Nos shards o diretório vem do principal (sincronizar_diretorio), não dos dados iniciais
+
+def migrar(conn, shard=False):
+    """Aplica as migrações pendentes numa única transação. Retorna a versão final do schema.
+    Com `shard`, pula as de MIGRACOES_SO_PRINCIPAL (só a numeração avança)."""
+    versao = conn.execute('PRAGMA user_version').fetchone()[0]
+    if versao >= MIGRACOES[-1][0]:
+        return versao # Caso comum: banco em dia, nenhum outro acesso
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None # Controle manual: DDL e DML na mesma transação
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        # Outro processo pode ter migrado enquanto esperávamos o lock
+        versao = conn.execute('PRAGMA user_version').fetchone()[0]
+        for numero, descricao, migracao in MIGRACOES:
+            if numero > versao:
+                if not (shard and numero in MIGRACOES_SO_PRINCIPAL):
+                    print(f"INFO: Aplicando migração {numero} ({descricao})...")
+                    migracao(conn)
+                versao = numero
+        conn.execute(f'PRAGMA user_version = {versao}')
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.isolation_level = isolation_level
+    return versao
+
+def init_database():
+    """Deixa o banco na versão mais recente do schema (ver MIGRACOES)"""
+    conn = _nova_conexao() # Conexão própria, fechada no fim: nunca a do pool, mesmo dentro de um contexto Flask
+    try:
+        versao = migrar(conn)
+    finally:
+        conn.close()
+    print(f"INFO: Schema do banco na versão {versao}.")
+    preparar_shards()
+
+# --- ARQUIVO DE RESERVAS ANTIGAS ---
+# Reservas anteriores ao corte saem de `reservas` (consultada a cada verificação de conflito e
+# listagem) para outro arquivo SQLite, anexado à conexão como `arquivo` só quando é preciso.
+# O histórico completo fica na visão temporária reservas_com_arquivo.
+
+COLUNAS_RESERVAS = (
+    'id, professor_id, laboratorio_id, data, horario_inicio, horario_fim, disciplina, turma, '
+    'descricao_atividade, status, created_at, versao_alteracao'
+)
+
+SQL_ARQUIVO = f'''
+    CREATE TABLE IF NOT EXISTS arquivo.reservas (
+        id INTEGER PRIMARY KEY,
+        professor_id INTEGER NOT NULL,
+        laboratorio_id INTEGER NOT NULL,
+        data DATE NOT NULL,
+        horario_inicio TIME NOT NULL,
+        horario_fim TIME NOT NULL,
+        disciplina TEXT NOT NULL,
+        turma TEXT NOT NULL,
+        descricao_atividade TEXT,
+        status TEXT DEFAULT 'confirmada',
+        created_at TIMESTAMP,
+        versao_alteracao INTEGER NOT NULL DEFAULT 0,
+        arquivado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS arquivo.idx_reservas_data_lab ON reservas (data, laboratorio_id);
+    CREATE INDEX IF NOT EXISTS arquivo.idx_reservas_prof_data ON reservas (professor_id, data);
+    CREATE TEMP VIEW IF NOT EXISTS reservas_com_arquivo AS
+        SELECT {COLUNAS_RESERVAS}, 0 AS arquivada FROM main.reservas
+        UNION ALL
+        SELECT {COLUNAS_RESERVAS}, 1 AS arquivada FROM arquivo.reservas;
+'''
+
+def caminho_arquivo():
+    return app.config['ARQUIVO_DATABASE'] or os.path.splitext(DATABASE)[0] + '_arquivo.db'
+
+def anexar_arquivo(conn, criar=True):
+    """Anexa o banco de arquivo como `arquivo` (se ainda não estiver). Com criar=False, só se ele já existir."""
+    if 'arquivo' in {row[1] for row in conn.execute('PRAGMA database_list')}:
+        return True
+    if not criar and not os.path.exists(caminho_arquivo()):
+        return False
+    conn.execute('ATTACH DATABASE ? AS arquivo', (caminho_arquivo(),))
+    executar_script(conn, SQL_ARQUIVO)
+    if has_app_context() and g.get('db') is conn:
+        g.arquivo_anexado = True # Conexão do pool: desanexado no fim da requisição
+    return True
+
+def data_corte_arquivo(dias=None):
+    dias = app.config['ARQUIVO_CORTE_DIAS'] if dias is None else dias
+    return (datetime.date.today() - datetime.timedelta(days=dias)).isoformat()
+
+def arquivar_reservas(conn, antes_de, lote=None):
+    """Move as reservas com data < antes_de para o arquivo, um lote por vez. Retorna quantas foram movidas.
+
+    Cada lote é copiado e confirmado no arquivo e só então apagado de `reservas`. Em WAL o
+    COMMIT não é atômico entre bancos anexados; se o processo cair entre os dois passos, a
+    próxima execução regrava as mesmas linhas (INSERT OR REPLACE) e termina a exclusão.
+    """
+    lote = lote or app.config['ARQUIVO_LOTE']
+    anexar_arquivo(conn)
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None # Uma transação curta por passo, controlada aqui
+    movidas = 0
+    try:
+        while True:
+            ids = [row[0] for row in conn.execute(
+                'SELECT id FROM main.reservas WHERE data < ? ORDER BY data, id LIMIT ?', (antes_de, lote)
+            )]
+            if not ids:
+                break
+            ids_json = json.dumps(ids)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(f'''
+                    INSERT OR REPLACE INTO arquivo.reservas ({COLUNAS_RESERVAS})
+                    SELECT {COLUNAS_RESERVAS} FROM main.reservas WHERE id IN (SELECT value FROM json_each(?))
+                ''', (ids_json,))
+                conn.execute('COMMIT')
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute('INSERT INTO arquivamento_ativo (ativo) VALUES (1)')
+                # Só o que foi copiado na mesma versão: uma reserva alterada no meio do caminho volta no próximo lote
+                cursor = conn.execute('''
+                    DELETE FROM main.reservas WHERE id IN (SELECT value FROM json_each(?)) AND versao_alteracao = (
+                        SELECT a.versao_alteracao FROM arquivo.reservas a WHERE a.id = main.reservas.id
+                    )
+                ''', (ids_json,))
+                conn.execute('DELETE FROM arquivamento_ativo')
+                conn.execute(_sql_incrementar_versao('reservas')) # Invalida ETags das listagens
+                conn.execute('COMMIT')
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+            movidas += cursor.rowcount
+    finally:
+        conn.isolation_level = isolation_level
+    return movidas
+
+def iniciar_arquivamento_agendado():
+    """Thread que arquiva a cada ARQUIVO_INTERVALO_HORAS (desligada com 0; o comando `flask arquivar` serve para cron)"""
+    horas = app.config['ARQUIVO_INTERVALO_HORAS']
+    if horas <= 0:
+        return None
+
+    def rodar():
+        while True:
+            try:
+                conn = _nova_conexao()
+                try:
+                    movidas = arquivar_reservas(conn, data_corte_arquivo())
+                finally:
+                    conn.close()
+                if movidas:
+                    print(f"INFO: {movidas} reservas anteriores a {data_corte_arquivo()} arquivadas.")
+            except Exception as e:
+                print(f"ERRO: Falha no arquivamento agendado: {e}")
+            time.sleep(horas * 3600)
+
+    thread = threading.Thread(target=rodar, name='arquivamento', daemon=True)
+    thread.start()
+    return thread
+
+# --- SHARDS POR CAMPUS ---
+# Com SHARDS configurado, as reservas dos laboratórios de cada campus ficam num arquivo próprio
+# (agendamento_<campus>.db), com escritor/trava próprios; os demais laboratórios continuam no banco
+# principal, que é também o diretório: professores e laboratórios são cadastrados só nele e copiados
+# para cada shard (sem as senhas) ao iniciar, logo após cada alteração feita pelas rotas e, para as feitas
+# por outros meios, quando a versão em versoes_dados muda (conferida a cada DIRETORIO_VERSAO_INTERVALO_S).
+# Cada shard reserva um bloco de
+# ids (índice do shard x SHARD_BLOCO_IDS), então o id de uma reserva nova já diz onde ela está.
+SHARD_BLOCO_IDS = 1_000_000_000
+_cache_shards = (None, {}, {}) # (texto de SHARDS, {campus: [laboratorio_id]}, {laboratorio_id: campus})
+_pools_shard = {}
+_versao_diretorio = (None, None, float('-inf')) # (banco principal, versões de professores/laboratorios, lidas em)
+_diretorio_nos_shards = {} # caminho do shard -> versões copiadas para ele por este processo
+_lock_diretorio = threading.Lock()
+executor_shards = ThreadPoolExecutor(max_workers=8, thread_name_prefix='shards')
+
+def mapa_shards():
+    """{campus: [laboratorio_id, ...]} de app.config['SHARDS'], na ordem configurada (que não deve mudar)"""
+    global _cache_shards
+    texto = app.config['SHARDS'] or ''
+    if _cache_shards[0] != texto:
+        mapa, por_laboratorio = {}, {}
+        for parte in texto.split(';'):
+            if not parte.strip():
+                continue
+            nome, _, laboratorios = parte.partition(':')
+            nome = nome.strip()
+            if not nome.isidentifier():
+                raise ValueError(f'Nome de shard inválido em SHARDS: {nome!r}')
+            mapa[nome] = [int(lab) for lab in laboratorios.split(',') if lab.strip()]
+            for lab in mapa[nome]:
+                por_laboratorio[lab] = nome
+        _cache_shards = (texto, mapa, por_laboratorio)
+    return _cache_shards[1]
+
+def shards_ativos():
+    return bool(mapa_shards())
+
+def caminho_shard(nome):
+    return f'{os.path.splitext(DATABASE)[0]}_{nome}.db'
+
+def shard_do_laboratorio(laboratorio_id):
+    """Campus cujo banco guarda as reservas do laboratório; None = banco principal"""
+    mapa_shards()
+    try:
+        return _cache_shards[2].get(int(laboratorio_id))
+    except (TypeError, ValueError):
+        return None
+
+def localizar_reserva(reserva_id):
+    """Campus onde a reserva está. Ids abaixo de SHARD_BLOCO_IDS são do principal ou foram movidos
+    por `flask distribuir-shards`: esses são procurados pela chave primária em cada banco."""
+    nomes = list(mapa_shards())
+    if not nomes:
+        return None
+    bloco = int(reserva_id) // SHARD_BLOCO_IDS
+    if 1 <= bloco <= len(nomes):
+        return nomes[bloco - 1]
+    for shard in [None] + nomes:
+        if get_db_connection(shard).execute('SELECT 1 FROM reservas WHERE id = ?', (reserva_id,)).fetchone():
+            return shard
+    return None
+
+def pool_do_shard(shard):
+    if shard is None:
+        return pool
+    caminho = caminho_shard(shard)
+    with _lock_shards:
+        if caminho not in _pools_shard:
+            _pools_shard[caminho] = PoolConexoes(caminho)
+        return _pools_shard[caminho]
+
+def obter_conexao_shard(shard):
+    conn = pool_do_shard(shard).obter()
+    try:
+        conferir_diretorio(shard, conn)
+    except Exception:
+        pool_do_shard(shard).devolver(conn)
+        raise
+    return conn
+
+def _versoes_diretorio(principal):
+    return {row['tabela']: row['versao'] for row in principal.execute(
+        "SELECT tabela, versao FROM versoes_dados WHERE tabela IN ('professores', 'laboratorios')")}
+
+def conferir_diretorio(shard, conn_shard):
+    """Sincroniza o diretório do shard só se a versão do principal mudou desde a última cópia deste processo.
+    A versão é lida do principal no máximo a cada DIRETORIO_VERSAO_INTERVALO_S."""
+    global _versao_diretorio
+    agora = time.monotonic()
+    banco, versoes, lidas_em = _versao_diretorio
+    if banco != DATABASE or agora - lidas_em >= app.config['DIRETORIO_VERSAO_INTERVALO_S']:
+        principal = pool.obter()
+        try:
+            versoes = _versoes_diretorio(principal)
+        finally:
+            pool.devolver(principal)
+        with _lock_diretorio:
+            _versao_diretorio = (DATABASE, versoes, agora)
+    caminho = caminho_shard(shard)
+    if _diretorio_nos_shards.get(caminho) != versoes:
+        copiadas = sincronizar_diretorio(conn_shard)
+        with _lock_diretorio:
+            _diretorio_nos_shards[caminho] = copiadas
+
+def diretorio_alterado():
+    """Chamada pelas rotas que alteram professores/laboratórios: copia o diretório para os shards já,
+    para que uma reserva feita logo em seguida (em qualquer processo) encontre as chaves estrangeiras."""
+    global _versao_diretorio
+    with _lock_diretorio:
+        _versao_diretorio = (None, None, float('-inf'))
+    for shard in mapa_shards():
+        conn = pool_do_shard(shard).obter()
+        try:
+            conferir_diretorio(shard, conn)
+        except sqlite3.Error as e: # Ex.: shard ocupado; a próxima conferência de versão tenta de novo
+            print(f"AVISO: Diretório não copiado para o shard '{shard}': {e}")
+        finally:
+            pool_do_shard(shard).devolver(conn)
+
+def sincronizar_diretorio(conn_shard):
+    """Copia professores e laboratórios do banco principal para o shard, se mudaram desde a última cópia.
+    Retorna as versões do diretório que o shard tem agora.
+
+    Removidos no principal são apagados no shard (ON DELETE CASCADE leva as reservas, como no principal).
+    """
+    principal = pool.obter()
+    try:
+        versoes = _versoes_diretorio(principal)
+        copiadas = {row['tabela']: row['versao'] for row in conn_shard.execute('SELECT tabela, versao FROM diretorio_sincronizado')}
+        if all(copiadas.get(tabela) == versao for tabela, versao in versoes.items()):
+            return versoes
+        # Lidas depois das versões: no pior caso a cópia é mais nova que a versão anotada e se repete
+        professores = principal.execute(
+            'SELECT id, nome_completo, matricula, email, telefone, departamento, status, tipo, created_at FROM professores'
+        ).fetchall()
+        laboratorios = principal.execute(
+            'SELECT id, nome, localizacao, capacidade, recursos, status, created_at FROM laboratorios'
+        ).fetchall()
+    finally:
+        pool.devolver(principal)
+
+    conn_shard.execute('BEGIN IMMEDIATE')
+    try:
+        conn_shard.execute('DELETE FROM professores WHERE id NOT IN (SELECT value FROM json_each(?))',
+                           (json.dumps([row['id'] for row in professores]),))
+        # Matrícula/email provisórios, só em quem vai trocá-los: uma troca entre dois professores não esbarra no UNIQUE
+        atuais = {row['id']: (row['matricula'], row['email'])
+                  for row in conn_shard.execute('SELECT id, matricula, email FROM professores')}
+        trocados = [row['id'] for row in professores
+                    if atuais.get(row['id'], (row['matricula'], row['email'])) != (row['matricula'], row['email'])]
+        conn_shard.execute("UPDATE professores SET matricula = '#' || id, email = NULL WHERE id IN (SELECT value FROM json_each(?))",
+                           (json.dumps(trocados),))
+        # O WHERE deixa intactas as linhas iguais: sem ele, os triggers de UPDATE OF (busca, ocupação por
+        # departamento, versões) disparariam para todo o diretório a cada sincronização
+        conn_shard.executemany('''
+            INSERT INTO professores (id, nome_completo, matricula, email, telefone, departamento, senha_hash, status, tipo, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, '', ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                nome_completo = excluded.nome_completo, matricula = excluded.matricula, email = excluded.email,
+                telefone = excluded.telefone, departamento = excluded.departamento, senha_hash = '',
+                status = excluded.status, tipo = excluded.tipo
+            WHERE (professores.nome_completo, professores.matricula, professores.email, professores.telefone,
+                   professores.departamento, professores.senha_hash, professores.status, professores.tipo)
+               IS NOT (excluded.nome_completo, excluded.matricula, excluded.email, excluded.telefone,
+                       excluded.departamento, '', excluded.status, excluded.tipo)
+        ''', [tuple(row) for row in professores])
+        conn_shard.execute('DELETE FROM laboratorios WHERE id NOT IN (SELECT value FROM json_each(?))',
+                           (json.dumps([row['id'] for row in laboratorios]),))
+        conn_shard.executemany('''
+            INSERT INTO laboratorios (id, nome, localizacao, capacidade, recursos, status, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                nome = excluded.nome, localizacao = excluded.localizacao, capacidade = excluded.capacidade,
+                recursos = excluded.recursos, status = excluded.status
+            WHERE (laboratorios.nome, laboratorios.localizacao, laboratorios.capacidade, laboratorios.recursos, laboratorios.status)
+               IS NOT (excluded.nome, excluded.localizacao, excluded.capacidade, excluded.recursos, excluded.status)
+        ''', [tuple(row) for row in laboratorios])
+        conn_shard.executemany('INSERT OR REPLACE INTO diretorio_sincronizado (tabela, versao) VALUES (?, ?)',
+                               list(versoes.items()))
+        conn_shard.commit()
+    except Exception:
+        conn_shard.rollback()
+        raise
+    return versoes
+
+def preparar_shards():
+    """Cria/migra o banco de cada campus, reserva o bloco de ids e copia o diretório"""
+    for indice, nome in enumerate(mapa_shards(), start=1):
+        conn = _nova_conexao(caminho_shard(nome))
+        try:
+            versao = migrar(conn, shard=True)
+            inicio_ids = indice * SHARD_BLOCO_IDS
+            with conn:
+                row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'reservas'").fetchone()
+                if row is None:
+                    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('reservas', ?)", (inicio_ids,))
+                elif row[0] < inicio_ids:
+                    conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'reservas'", (inicio_ids,))
+            copiadas = sincronizar_diretorio(conn)
+            with _lock_diretorio:
+                _diretorio_nos_shards[caminho_shard(nome)] = copiadas
+        finally:
+            conn.close()
+        print(f"INFO: Shard '{nome}' ({caminho_shard(nome)}) na versão {versao}.")
+
+def mover_para_shard(conn, nome, lote=None):
+    """Move do banco principal para o shard as reservas dos laboratórios do campus, mantendo os ids.
+
+    Como no arquivamento, cada lote é confirmado no shard antes de sair do principal; uma
+    execução interrompida é retomada sem duplicar (INSERT OR IGNORE pelo id).
+    """
+    lote = lote or app.config['ARQUIVO_LOTE']
+    laboratorios = json.dumps(mapa_shards()[nome])
+    conn.execute('ATTACH DATABASE ? AS shard', (caminho_shard(nome),))
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    movidas = 0
+    try:
+        while True:
+            ids = [row[0] for row in conn.execute(
+                'SELECT id FROM main.reservas WHERE laboratorio_id IN (SELECT value FROM json_each(?)) ORDER BY id LIMIT ?',
+                (laboratorios, lote)
+            )]
+            if not ids:
+                break
+            ids_json = json.dumps(ids)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(f'''
+                    INSERT OR IGNORE INTO shard.reservas ({COLUNAS_RESERVAS})
+                    SELECT {COLUNAS_RESERVAS} FROM main.reservas WHERE id IN (SELECT value FROM json_each(?))
+                ''', (ids_json,))
+                conn.execute('COMMIT')
+                conn.execute('BEGIN IMMEDIATE')
+                cursor = conn.execute('''
+                    DELETE FROM main.reservas WHERE id IN (SELECT value FROM json_each(?))
+                    AND id IN (SELECT id FROM shard.reservas)
+                ''', (ids_json,))
+                conn.execute('COMMIT')
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+            movidas += cursor.rowcount
+    finally:
+        conn.isolation_level = isolation_level
+        conn.execute('DETACH DATABASE shard')
+    return movidas
+
+def consultar_bancos(consulta, avulsa=False):
+    """consulta(conn, shard) no banco principal e em cada shard, em paralelo; lista de resultados
+    na ordem [principal] + mapa_shards(). Usa as conexões da requisição (get_db_connection), então o
+    que foi anexado a elas vale aqui; com `avulsa`, conexões do pool devolvidas logo em seguida
+    (streams, que não seguram conexão entre uma leitura e outra)."""
+    bancos = [None] + list(mapa_shards())
+    if avulsa:
+        def rodar(shard):
+            conn = obter_conexao_shard(shard) if shard else pool.obter()
+            try:
+                return consulta(conn, shard)
+            finally:
+                pool_do_shard(shard).devolver(conn)
     else:
-        print("INFO: Laboratórios já existem ou não foi possível verificar. Não inserindo laboratórios iniciais.")
-    # --- FIM DA LÓGICA AJUSTADA ---
-    
-    conn.close()
+        conexoes = {shard: get_db_connection(shard) for shard in bancos}
+        def rodar(shard):
+            return consulta(conexoes[shard], shard)
+    if len(bancos) == 1:
+        return [rodar(None)]
+    return list(executor_shards.map(rodar, bancos))
+
+class CacheAutenticacao:
+    """Status, tipo e geracao_token por professor, para o token_required não consultar o banco a cada requisição.
+
+    Cada entrada vale AUTH_CACHE_TTL_S (LRU limitado a AUTH_CACHE_MAX). As rotas de administração
+    invalidam o professor alterado neste processo; os demais processos percebem pela versão
+    'autenticacao' em versoes_dados, lida no máximo a cada AUTH_VERSAO_INTERVALO_S, e descartam tudo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # professor_id -> (expira_em, linha ou None se removido)
+        self._versao = None
+        self._versao_lida_em = float('-inf')
+        self.acertos = self.consultas = 0
+
+    def _conferir_versao(self, conn, agora):
+        if agora - self._versao_lida_em < app.config['AUTH_VERSAO_INTERVALO_S']:
+            return
+        versao = versao_dados(conn, 'autenticacao')
+        with self._lock:
+            if versao != self._versao:
+                self._entradas.clear()
+                self._versao = versao
+            self._versao_lida_em = agora
+
+    def obter(self, professor_id):
+        """{'status', 'tipo', 'geracao_token'} do professor, ou None se ele não existe mais"""
+        agora = time.monotonic()
+        conn = get_db_connection()
+        self._conferir_versao(conn, agora)
+        with self._lock:
+            entrada = self._entradas.get(professor_id)
+            if entrada is not None and entrada[0] > agora:
+                self._entradas.move_to_end(professor_id)
+                self.acertos += 1
+                return entrada[1]
+        row = conn.execute('SELECT status, tipo, geracao_token FROM professores WHERE id = ?', (professor_id,)).fetchone()
+        estado = dict(row) if row else None
+        with self._lock:
+            self.consultas += 1
+            self._entradas[professor_id] = (agora + app.config['AUTH_CACHE_TTL_S'], estado)
+            self._entradas.move_to_end(professor_id)
+            while len(self._entradas) > app.config['AUTH_CACHE_MAX']:
+                self._entradas.popitem(last=False)
+        return estado
+
+    def invalidar(self, professor_id=None):
+        with self._lock:
+            if professor_id is None:
+                self._entradas.clear()
+            else:
+                self._entradas.pop(professor_id, None)
+
+    def estatisticas(self):
+        with self._lock:
+            return {'entradas': len(self._entradas), 'acertos': self.acertos, 'consultas': self.consultas,
+                    'versao': self._versao}
 
-# --- O RESTANTE DO ARQUIVO app.py (decorators, rotas, if __name__ == '__main__':) PERMANECE O MESMO ---
-# Copie as suas funções token_required, admin_required e todas as suas rotas (@app.route(...)) aqui.
+cache_autenticacao = CacheAutenticacao()
+
+def validar_sessao(dados):
+    """Confere o token já decodificado contra o estado atual do professor (via cache).
+    Retorna (current_user, None) ou (None, mensagem de erro)."""
+    estado = cache_autenticacao.obter(dados.get('id'))
+    if estado is None or estado['status'] != 'ativo':
+        return None, 'Usuário inativo ou removido'
+    if dados.get('ger', 0) != estado['geracao_token']: # Tokens anteriores à geração não têm 'ger'
+        return None, 'Sessão revogada, faça login novamente'
+    return dict(dados, tipo=estado['tipo']), None # O tipo atual vale mesmo que o token diga outro
 
 def token_required(f):
+    aceita_token_na_query = getattr(f, 'token_na_query', False)
     @wraps(f)
     def decorated(*args, **kwargs):
         token = request.headers.get('Authorization')
+        na_query = not token and aceita_token_na_query
+        if na_query: token = request.args.get('token')
         if not token: return jsonify({'error': 'Token de acesso requerido'}), 401
         try:
             if token.startswith('Bearer '): token = token[7:]
             data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            current_user = data
         except jwt.ExpiredSignatureError: return jsonify({'error': 'Token expirado'}), 401
         except jwt.InvalidTokenError: return jsonify({'error': 'Token inválido'}), 401
+        # Na URL só vale o token curto de stream; ele, por sua vez, não serve no header como sessão
+        if data.get('uso') != ('stream' if na_query else None): return jsonify({'error': 'Token inválido'}), 401
+        current_user, erro = validar_sessao(data)
+        if erro: return jsonify({'error': erro}), 401
         return f(current_user, *args, **kwargs)
     return decorated
 
+def token_na_query(f):
+    """Aceita em ?token= o token curto de stream (o EventSource do navegador não envia o header
+    Authorization); o token de sessão nunca vai na URL. Use abaixo de @token_required."""
+    f.token_na_query = True
+    return f
+
+def resposta_condicional(*tabelas, por_usuario=True):
+    """GET condicional a partir das versões de `tabelas` em versoes_dados.
+
+    Antes da rota rodar, lê só as linhas de versoes_dados: se o ETag (versões + endpoint + query
+    + usuário) bater com If-None-Match, ou nada mudou desde If-Modified-Since, responde 304 sem
+    executar a consulta principal. Respostas 200 grandes saem com gzip. Use abaixo de @token_required.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(current_user, *args, **kwargs):
+            conn = get_db_connection()
+            rows = conn.execute(
+                f"SELECT tabela, versao, atualizado_em FROM versoes_dados WHERE tabela IN ({', '.join('?' * len(tabelas))})",
+                tabelas
+            ).fetchall()
+            versoes = {row['tabela']: row['versao'] for row in rows}
+            alteracoes = [row['atualizado_em'] for row in rows]
+            versoes_shards = []
+            if 'reservas' in tabelas: # Professores/laboratórios vêm do principal; as reservas, de cada shard
+                for shard in mapa_shards():
+                    row = get_db_connection(shard).execute(
+                        "SELECT versao, atualizado_em FROM versoes_dados WHERE tabela = 'reservas'"
+                    ).fetchone()
+                    versoes_shards.append(row['versao'] if row else 0)
+                    alteracoes.append(row['atualizado_em'] if row else None)
+            assinatura = json.dumps([
+                request.endpoint, request.full_path, current_user.get('id') if por_usuario else None,
+                [versoes.get(tabela, 0) for tabela in tabelas], versoes_shards,
+            ])
+            etag = hashlib.sha1(assinatura.encode('utf-8')).hexdigest()[:20]
+            ultima_alteracao = max((datetime.datetime.fromisoformat(valor).replace(tzinfo=datetime.timezone.utc)
+                                    for valor in alteracoes if valor), default=None)
+            # No mesmo segundo de uma escrita o Last-Modified não é confiável: outra pode vir logo depois
+            agora = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+            if ultima_alteracao is not None and ultima_alteracao >= agora:
+                ultima_alteracao = None
+
+            if request.if_none_match:
+                nao_modificado = request.if_none_match.contains_weak(etag)
+            else:
+                nao_modificado = (ultima_alteracao is not None and request.if_modified_since is not None
+                                  and ultima_alteracao <= request.if_modified_since)
+            if nao_modificado:
+                response = Response(status=304)
+            else:
+                response = make_response(f(current_user, *args, **kwargs))
+            if response.status_code not in (200, 304):
+                return response
+
+            comprimido = False
+            if (response.status_code == 200 and not response.is_streamed and 'gzip' in request.accept_encodings
+                    and response.content_length and response.content_length >= app.config['GZIP_MIN_BYTES']):
+                response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+                response.headers['Content-Encoding'] = 'gzip'
+                comprimido = True
+            response.set_etag(etag, weak=True)
+            if ultima_alteracao is not None:
+                response.last_modified = ultima_alteracao
+            response.headers['Cache-Control'] = 'private, no-cache' # O navegador guarda, mas sempre revalida
+            response.vary.update(['Authorization', 'Accept-Encoding'])
+            metricas.registrar_condicional(request.endpoint, nao_modificado, comprimido)
+            return response
+        return decorated
+    return decorator
+
 def admin_required(f):
     @wraps(f)
     def decorated(current_user, *args, **kwargs):
@@ -197,6 +1926,10 @@ def admin_required(f):
 def index():
     return render_template('index.html')
 
+def _cmd_regravar_hash(tx, professor_id, hash_antigo, novo_hash):
+    tx.conn.execute('UPDATE professores SET senha_hash = ? WHERE id = ? AND senha_hash = ?',
+                    (novo_hash, professor_id, hash_antigo))
+
 @app.route('/api/login', methods=['POST'])
 def login():
     data = request.get_json()
@@ -206,15 +1939,26 @@ def login():
     user_row = conn.execute(
         'SELECT * FROM professores WHERE matricula = ? AND status = "ativo"', (data['matricula'],)
     ).fetchone()
-    conn.close()
     if not user_row:
         return jsonify({'error': 'Credenciais inválidas ou usuário inativo'}), 401
     user = dict(user_row) # Convertido para dict
     user_type = user.get('tipo', 'professor')
-    if bcrypt.checkpw(data['senha'].encode('utf-8'), user['senha_hash']):
+    try:
+        senha_correta = executor_senhas.verificar(data['senha'], user['senha_hash'])
+    except FilaSenhasCheia:
+        return resposta_fila_cheia()
+    if senha_correta:
+        if custo_hash(user['senha_hash']) != app.config['BCRYPT_ROUNDS']:
+            # Hash gravado com outro custo: aproveita a senha em mãos para regravar com o custo atual
+            try:
+                novo_hash = executor_senhas.gerar_hash(data['senha'])
+                executar_escrita(_cmd_regravar_hash, user['id'], user['senha_hash'], novo_hash)
+            except FilaSenhasCheia:
+                pass # Fica para o próximo login
         token = jwt.encode({
             'id': user['id'], 'matricula': user['matricula'], 'nome': user['nome_completo'],
             'email': user.get('email'), 'departamento': user.get('departamento', ''), 'tipo': user_type,
+            'ger': user.get('geracao_token', 0),
             'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
         }, app.config['SECRET_KEY'], algorithm='HS256')
         return jsonify({
@@ -227,21 +1971,26 @@ def login():
 
 @app.route('/api/laboratorios', methods=['GET'])
 @token_required
+@resposta_condicional('laboratorios', por_usuario=False)
 def get_laboratorios(current_user):
     conn = get_db_connection()
-    laboratorios = conn.execute(
-        'SELECT * FROM laboratorios WHERE status = "disponivel" ORDER BY nome'
-    ).fetchall()
-    conn.close()
-    result = []
-    for lab_row in laboratorios:
-        lab_dict = dict(lab_row)
-        try:
-            lab_dict['recursos'] = json.loads(lab_dict['recursos'] or '[]')
-        except json.JSONDecodeError:
-            lab_dict['recursos'] = [] # Trata caso o JSON seja inválido
-        result.append(lab_dict)
-    return jsonify(result)
+    versao = versao_dados(conn, 'laboratorios')
+    corpo = cache_laboratorios.obter(versao)
+    if corpo is None:
+        laboratorios = conn.execute(
+            'SELECT * FROM laboratorios WHERE status = "disponivel" ORDER BY nome'
+        ).fetchall()
+        result = []
+        for lab_row in laboratorios:
+            lab_dict = dict(lab_row)
+            try:
+                lab_dict['recursos'] = json.loads(lab_dict['recursos'] or '[]')
+            except json.JSONDecodeError:
+                lab_dict['recursos'] = [] # Trata caso o JSON seja inválido
+            result.append(lab_dict)
+        corpo = app.json.dumps(result)
+        cache_laboratorios.guardar(versao, corpo)
+    return Response(corpo, mimetype='application/json')
 
 @app.route('/api/verificar-disponibilidade', methods=['POST'])
 @token_required
@@ -250,31 +1999,112 @@ def verificar_disponibilidade(current_user):
     required_fields = ['laboratorio_id', 'data', 'horario_inicio', 'horario_fim']
     if not all(field in data for field in required_fields):
         return jsonify({'error': 'Dados incompletos'}), 400
+    erro = erro_data_horario(data['data'], data['horario_inicio'], data['horario_fim'])
+    if erro:
+        return jsonify({'error': erro}), 400
     
     # NOVO: Pega o ID da reserva a ser excluída da verificação, se fornecido (para edição)
     reserva_id_excluir = data.get('reserva_id_excluir', 0) # 0 não deve colidir com IDs reais
 
-    conn = get_db_connection()
-    # ALTERADO: Adiciona `AND id != ?` à query de conflitos
-    query = '''
-        SELECT * FROM reservas 
-        WHERE laboratorio_id = ? AND data = ? AND status != 'cancelada' AND id != ?
-        AND (
-            (horario_inicio < ? AND horario_fim > ?) OR
-            (horario_inicio < ? AND horario_fim > ?) OR
-            (horario_inicio >= ? AND horario_fim <= ?)
-        )
-    '''
-    params = (
-        data['laboratorio_id'], data['data'], reserva_id_excluir,
-        data['horario_fim'], data['horario_inicio'],
-        data['horario_inicio'], data['horario_fim'],
-        data['horario_inicio'], data['horario_fim']
+    conn = get_db_connection(shard_do_laboratorio(data['laboratorio_id']))
+    conflitos = contar_conflitos(
+        conn, data['laboratorio_id'], data['data'], data['horario_inicio'], data['horario_fim'],
+        ignorar_id=reserva_id_excluir
     )
-    conflitos = conn.execute(query, params).fetchall()
-    conn.close()
-    return jsonify({'disponivel': len(conflitos) == 0, 'conflitos': len(conflitos)})
+    return jsonify({'disponivel': conflitos == 0, 'conflitos': conflitos})
+
+
+MAX_DIAS_BUSCA_HORARIOS = 200 # Um semestre com folga
+MAX_HORARIOS_LIVRES = 5000
+
+def formatar_minutos(minutos):
+    return f'{minutos // 60:02d}:{minutos % 60:02d}'
+
+@app.route('/api/horarios-livres', methods=['GET'])
+@token_required
+def buscar_horarios_livres(current_user):
+    """Janelas livres de pelo menos `duracao` minutos, por laboratório e dia de funcionamento, dentro do horário permitido.
+
+    Uma única query traz as reservas ativas do período, já ordenadas por laboratório, dia e início;
+    cada dia é varrido uma vez, acumulando os intervalos entre reservas consecutivas.
+    """
+    args = request.args
+    duracao = args.get('duracao', type=int)
+    abertura = minutos_horario_valido(args.get('hora_inicio', app.config['HORARIO_ABERTURA']))
+    fechamento = minutos_horario_valido(args.get('hora_fim', app.config['HORARIO_FECHAMENTO']))
+    try:
+        data_inicio = datetime.date.fromisoformat(args.get('data_inicio', ''))
+        data_fim = datetime.date.fromisoformat(args.get('data_fim', '') or args.get('data_inicio', ''))
+    except ValueError:
+        return jsonify({'error': 'data_inicio/data_fim devem estar no formato AAAA-MM-DD'}), 400
+    if not duracao or duracao <= 0 or abertura is None or fechamento is None or abertura >= fechamento:
+        return jsonify({'error': 'Informe duracao (minutos) e um intervalo hora_inicio/hora_fim válido'}), 400
+    if data_fim < data_inicio or (data_fim - data_inicio).days >= MAX_DIAS_BUSCA_HORARIOS:
+        return jsonify({'error': f'O período deve ter entre 1 e {MAX_DIAS_BUSCA_HORARIOS} dias'}), 400
+    laboratorio_ids = args.getlist('laboratorio_id', type=int)
+
+    conn = get_db_connection()
+    query_labs = 'SELECT id, nome FROM laboratorios WHERE status = "disponivel"'
+    if laboratorio_ids:
+        query_labs += f" AND id IN ({', '.join('?' * len(laboratorio_ids))})"
+    laboratorios = conn.execute(query_labs + ' ORDER BY nome', laboratorio_ids).fetchall()
+    if not laboratorios:
+        return jsonify({'horarios': [], 'truncado': False})
+    # Sempre com a lista de laboratórios: o índice (laboratorio_id, dia, inicio_min, fim_min, status) cobre a consulta
+    def reservas_do_periodo(conn, shard):
+        ids = [lab['id'] for lab in laboratorios if shard_do_laboratorio(lab['id']) == shard]
+        if not ids:
+            return []
+        return conn.execute(f'''
+            SELECT laboratorio_id, dia, inicio_min, fim_min FROM reservas
+            WHERE laboratorio_id IN ({', '.join('?' * len(ids))}) AND dia >= ? AND dia <= ? AND status != 'cancelada'
+            ORDER BY laboratorio_id, dia, inicio_min
+        ''', ids + [numero_dia(data_inicio), numero_dia(data_fim)]).fetchall()
+
+    ocupados = {} # (laboratorio_id, dia) -> [(inicio, fim)] em ordem de início
+    for rows in consultar_bancos(reservas_do_periodo):
+        for row in rows:
+            inicio, fim = row['inicio_min'], row['fim_min']
+            if inicio is not None and fim is not None and inicio < fim:
+                ocupados.setdefault((row['laboratorio_id'], row['dia']), []).append((inicio, fim))
 
+    livres = []
+    # Só dias de funcionamento, como nos relatórios de ocupação
+    dias = [data_inicio + datetime.timedelta(days=n) for n in range((data_fim - data_inicio).days + 1)]
+    dias = [dia for dia in dias if dia.weekday() in app.config['DIAS_FUNCIONAMENTO']]
+    for lab in laboratorios:
+        for dia in dias:
+            cursor = abertura
+            for inicio, fim in ocupados.get((lab['id'], numero_dia(dia)), []) + [(fechamento, fechamento)]:
+                inicio = min(inicio, fechamento)
+                if inicio - cursor >= duracao:
+                    livres.append({
+                        'laboratorio_id': lab['id'], 'laboratorio_nome': lab['nome'], 'data': dia.isoformat(),
+                        'horario_inicio': formatar_minutos(cursor), 'horario_fim': formatar_minutos(inicio),
+                    })
+                cursor = max(cursor, fim)
+                if cursor >= fechamento:
+                    break
+            if len(livres) >= MAX_HORARIOS_LIVRES:
+                return jsonify({'horarios': livres[:MAX_HORARIOS_LIVRES], 'truncado': True})
+    return jsonify({'horarios': livres, 'truncado': False})
+
+def _cmd_criar_reserva(tx, professor_id, data):
+    conflitos = tx.contar_conflitos(data['laboratorio_id'], data['data'], data['horario_inicio'], data['horario_fim'])
+    if conflitos:
+        return {'error': 'Horário não disponível, há conflito com outra reserva.'}, 409 # Usar 409 Conflict
+    cursor = tx.conn.execute('''
+        INSERT INTO reservas 
+        (professor_id, laboratorio_id, data, horario_inicio, horario_fim, 
+         disciplina, turma, descricao_atividade, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'confirmada')
+    ''', (
+        professor_id, data['laboratorio_id'], data['data'],
+        data['horario_inicio'], data['horario_fim'], data['disciplina'],
+        data['turma'], data.get('descricao_atividade', '')
+    ))
+    reserva_id = cursor.lastrowid
+    return {'message': 'Reserva criada com sucesso', 'reserva_id': reserva_id}, 201
 
 @app.route('/api/reservas', methods=['POST'])
 @token_required
@@ -283,66 +2113,272 @@ def criar_reserva(current_user):
     required_fields = ['laboratorio_id', 'data', 'horario_inicio', 'horario_fim', 'disciplina', 'turma']
     if not all(field in data for field in required_fields):
         return jsonify({'error': 'Dados incompletos'}), 400
-    conn = get_db_connection()
-    conflitos = conn.execute('''
-        SELECT * FROM reservas 
-        WHERE laboratorio_id = ? AND data = ? AND status != 'cancelada'
+    erro = erro_data_horario(data['data'], data['horario_inicio'], data['horario_fim'])
+    if erro:
+        return jsonify({'error': erro}), 400
+    try:
+        corpo, status_code = executar_escrita(_cmd_criar_reserva, current_user['id'], data,
+                                              shard=shard_do_laboratorio(data['laboratorio_id']))
+    except Exception as e:
+        return jsonify({'error': f'Erro ao criar reserva: {str(e)}'}), 500
+    return jsonify(corpo), status_code
+
+MAX_OCORRENCIAS_LOTE = 200 # Um ano letivo inteiro de aulas semanais cabe com folga
+
+def _gerar_ocorrencias(data):
+    """Lista (data, horario_inicio, horario_fim) a partir de `recorrencia` ou de `ocorrencias` explícitas.
+    Levanta ValueError com a mensagem para o cliente se a entrada for inválida."""
+    if data.get('ocorrencias'):
+        ocorrencias = []
+        for item in data['ocorrencias']:
+            if not isinstance(item, dict) or not item.get('data'):
+                raise ValueError('Cada ocorrência precisa de uma data.')
+            inicio = item.get('horario_inicio', data.get('horario_inicio'))
+            fim = item.get('horario_fim', data.get('horario_fim'))
+            if not inicio or not fim:
+                raise ValueError(f"Ocorrência {item['data']} sem horário de início/fim.")
+            erro = erro_data_horario(item['data'], inicio, fim)
+            if erro:
+                raise ValueError(f"Ocorrência {item['data']}: {erro}")
+            ocorrencias.append((str(item['data']), inicio, fim))
+    else:
+        regra = data.get('recorrencia') or {}
+        if not all(regra.get(campo) is not None for campo in ['dia_semana', 'data_inicio', 'data_fim']):
+            raise ValueError('Informe `ocorrencias` ou `recorrencia` com dia_semana, data_inicio e data_fim.')
+        if not data.get('horario_inicio') or not data.get('horario_fim'):
+            raise ValueError('Horário de início e fim são obrigatórios.')
+        erro = erro_data_horario(regra['data_inicio'], data['horario_inicio'], data['horario_fim'])
+        if erro:
+            raise ValueError(erro)
+        try:
+            dia_semana = int(regra['dia_semana']) # 0 = domingo ... 6 = sábado, como no JavaScript
+            data_atual = datetime.date.fromisoformat(regra['data_inicio'])
+            data_fim = datetime.date.fromisoformat(regra['data_fim'])
+            excluir = {datetime.date.fromisoformat(d) for d in regra.get('excluir_datas', [])}
+        except (TypeError, ValueError):
+            raise ValueError('Datas devem estar no formato AAAA-MM-DD e dia_semana entre 0 e 6.')
+        if not 0 <= dia_semana <= 6:
+            raise ValueError('dia_semana deve estar entre 0 (domingo) e 6 (sábado).')
+        # date.weekday() usa 0 = segunda; converte para a convenção do JavaScript
+        data_atual += datetime.timedelta(days=(dia_semana - (data_atual.weekday() + 1) % 7) % 7)
+        ocorrencias = []
+        while data_atual <= data_fim and len(ocorrencias) <= MAX_OCORRENCIAS_LOTE:
+            if data_atual not in excluir:
+                ocorrencias.append((data_atual.isoformat(), data['horario_inicio'], data['horario_fim']))
+            data_atual += datetime.timedelta(days=7)
+    if not ocorrencias:
+        raise ValueError('Nenhuma ocorrência a reservar.')
+    if len(ocorrencias) > MAX_OCORRENCIAS_LOTE:
+        raise ValueError(f'No máximo {MAX_OCORRENCIAS_LOTE} ocorrências por requisição.')
+    return ocorrencias
+
+def _conflitos_ocorrencias(conn, laboratorio_id, ocorrencias):
+    """Uma única query para todas as ocorrências: {indice: [ids das reservas em conflito]}"""
+    valores = ', '.join(['(?, ?, ?, ?)'] * len(ocorrencias))
+    params = [valor for indice, (dia, inicio, fim) in enumerate(ocorrencias)
+              for valor in (indice, dia, minutos_do_dia(inicio), minutos_do_dia(fim))]
+    rows = conn.execute(f'''
+        WITH ocorrencias(indice, data, inicio, fim) AS (VALUES {valores})
+        SELECT o.indice, r.id FROM ocorrencias o
+        JOIN reservas r ON r.laboratorio_id = ? AND r.dia = {_sql_dia('o.data')} AND r.status != 'cancelada'
         AND (
-            (horario_inicio < ? AND horario_fim > ?) OR
-            (horario_inicio < ? AND horario_fim > ?) OR
-            (horario_inicio >= ? AND horario_fim <= ?)
+            (r.inicio_min < o.fim AND r.fim_min > o.inicio) OR
+            (r.inicio_min < o.inicio AND r.fim_min > o.fim) OR
+            (r.inicio_min >= o.inicio AND r.fim_min <= o.fim)
         )
-    ''', (
-        data['laboratorio_id'], data['data'],
-        data['horario_fim'], data['horario_inicio'],
-        data['horario_inicio'], data['horario_fim'],
-        data['horario_inicio'], data['horario_fim']
-    )).fetchall()
-    if conflitos:
-        conn.close()
-        return jsonify({'error': 'Horário não disponível, há conflito com outra reserva.'}), 409 # Usar 409 Conflict
-    try:
-        cursor = conn.execute('''
-            INSERT INTO reservas 
-            (professor_id, laboratorio_id, data, horario_inicio, horario_fim, 
+        ORDER BY o.indice, r.id
+    ''', params + [laboratorio_id]).fetchall()
+    conflitos = {}
+    for row in rows:
+        conflitos.setdefault(row[0], []).append(row[1])
+    return conflitos
+
+def _cmd_criar_reservas_recorrentes(tx, professor_id, data, ocorrencias, tudo_ou_nada):
+    conflitos_banco = _conflitos_ocorrencias(tx.conn, data['laboratorio_id'], ocorrencias)
+    aceitas, conflitos = [], []
+    for indice, (dia, inicio, fim) in enumerate(ocorrencias):
+        ocorrencia = {'data': dia, 'horario_inicio': inicio, 'horario_fim': fim}
+        if indice in conflitos_banco:
+            conflitos.append(dict(ocorrencia, reservas_conflitantes=conflitos_banco[indice]))
+        elif any(d == dia and horarios_sobrepostos(i, f, inicio, fim) for d, i, f in aceitas):
+            conflitos.append(dict(ocorrencia, reservas_conflitantes=[], motivo='Sobrepõe outra ocorrência do mesmo pedido'))
+        else:
+            aceitas.append((dia, inicio, fim))
+    if tudo_ou_nada and conflitos:
+        aceitas = []
+
+    criadas = []
+    for dia, inicio, fim in aceitas:
+        cursor = tx.conn.execute('''
+            INSERT INTO reservas
+            (professor_id, laboratorio_id, data, horario_inicio, horario_fim,
              disciplina, turma, descricao_atividade, status)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'confirmada')
         ''', (
-            current_user['id'], data['laboratorio_id'], data['data'],
-            data['horario_inicio'], data['horario_fim'], data['disciplina'],
-            data['turma'], data.get('descricao_atividade', '')
+            professor_id, data['laboratorio_id'], dia, inicio, fim,
+            data['disciplina'], data['turma'], data.get('descricao_atividade', '')
         ))
-        conn.commit()
-        reserva_id = cursor.lastrowid
-        conn.close()
-        return jsonify({'message': 'Reserva criada com sucesso', 'reserva_id': reserva_id}), 201
+        criadas.append({'reserva_id': cursor.lastrowid, 'data': dia, 'horario_inicio': inicio, 'horario_fim': fim})
+    status_code = 201 if criadas else 409
+    return {
+        'message': f'{len(criadas)} de {len(ocorrencias)} reservas criadas',
+        'criadas': criadas, 'conflitos': conflitos
+    }, status_code
+
+@app.route('/api/reservas/recorrentes', methods=['POST'])
+@token_required
+def criar_reservas_recorrentes(current_user):
+    """Reserva várias datas de uma vez (ex.: a mesma aula toda semana do semestre) em uma transação"""
+    data = request.get_json()
+    if not data or not all(data.get(field) for field in ['laboratorio_id', 'disciplina', 'turma']):
+        return jsonify({'error': 'Dados incompletos'}), 400
+    try:
+        ocorrencias = _gerar_ocorrencias(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    tudo_ou_nada = bool(data.get('tudo_ou_nada', False))
+    try:
+        corpo, status_code = executar_escrita(
+            _cmd_criar_reservas_recorrentes, current_user['id'], data, ocorrencias, tudo_ou_nada,
+            shard=shard_do_laboratorio(data['laboratorio_id'])
+        )
     except Exception as e:
-        conn.close()
-        return jsonify({'error': f'Erro ao criar reserva: {str(e)}'}), 500
+        return jsonify({'error': f'Erro ao criar reservas: {str(e)}'}), 500
+    return jsonify(corpo), status_code
+
+LIMITE_MAX_PAGINA = 500
+
+# Colunas de reservas que a API devolve; dia, inicio_min, fim_min e versao_alteracao são de uso interno
+COLUNAS_RESERVA_API = ', '.join(f'r.{coluna}' for coluna in (
+    'id', 'professor_id', 'laboratorio_id', 'data', 'horario_inicio', 'horario_fim',
+    'disciplina', 'turma', 'descricao_atividade', 'status', 'created_at'))
+
+def _codificar_cursor(reserva):
+    chave = json.dumps([reserva['data'], reserva['horario_inicio'], reserva['id']])
+    return base64.urlsafe_b64encode(chave.encode('utf-8')).decode('ascii').rstrip('=')
+
+def _decodificar_cursor(cursor):
+    try:
+        chave = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        chave = None
+    if not isinstance(chave, list) or len(chave) != 3:
+        raise ValueError('Cursor inválido')
+    return chave
+
+def _chave_listagem(reserva):
+    return (reserva['data'], reserva['horario_inicio'], reserva['id'])
+
+def _listar_reservas(query, condicoes, params, query_shards=None):
+    """Listagem de reservas com filtros, paginação por cursor (keyset) e modo streaming.
+
+    A ordem é sempre (data, horario_inicio, id) decrescente. Com `limit`, a resposta continua
+    sendo uma lista JSON e, se houver mais linhas, o header X-Proximo-Cursor traz o valor a
+    enviar em `cursor` na próxima chamada. Com `stream=1`, as linhas são escritas conforme
+    saem do banco, sem montar a lista inteira em memória.
+
+    Com shards, a mesma query (ou `query_shards`, nos bancos dos campus) roda em cada banco (em
+    paralelo, cada um com o seu LIMIT) e as listas já ordenadas são intercaladas; no streaming, os
+    cursores são intercalados sob demanda.
+    """
+    args = request.args
+    condicoes, params = list(condicoes), list(params)
+    if args.get('status'):
+        condicoes.append('r.status = ?'); params.append(args['status'])
+    if args.get('laboratorio_id', type=int) is not None:
+        condicoes.append('r.laboratorio_id = ?'); params.append(args.get('laboratorio_id', type=int))
+    if args.get('data_inicio'):
+        condicoes.append('r.data >= ?'); params.append(args['data_inicio'])
+    if args.get('data_fim'):
+        condicoes.append('r.data <= ?'); params.append(args['data_fim'])
+    if args.get('cursor'):
+        try:
+            params.extend(_decodificar_cursor(args['cursor']))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        condicoes.append('(r.data, r.horario_inicio, r.id) < (?, ?, ?)')
+    sufixo = ' WHERE ' + ' AND '.join(condicoes) if condicoes else ''
+    sufixo += ' ORDER BY r.data DESC, r.horario_inicio DESC, r.id DESC'
+    limite = args.get('limit', type=int)
+    if limite is not None:
+        limite = max(1, min(limite, LIMITE_MAX_PAGINA))
+        sufixo += ' LIMIT ?'
+        params.append(limite + 1) # Uma linha a mais só para saber se há próxima página
+    query_shards = (query_shards or query) + sufixo
+    query += sufixo
+
+    if args.get('stream') == '1':
+        if shards_ativos(): # Conexões da requisição, mantidas até o fim da resposta por stream_with_context
+            bancos = [None] + list(mapa_shards())
+            cursor = heapq.merge(*[get_db_connection(shard).execute(query_shards if shard else query, params)
+                                   for shard in bancos], key=_chave_listagem, reverse=True)
+        else:
+            cursor = get_db_connection().execute(query, params)
+
+        def gerar():
+            yield '['
+            for indice, reserva in enumerate(cursor):
+                if limite is not None and indice == limite:
+                    break
+                yield (',' if indice else '') + json.dumps(dict(reserva), ensure_ascii=False)
+            yield ']'
+        return Response(stream_with_context(gerar()), mimetype='application/json')
+
+    resultados = consultar_bancos(lambda conn, shard: conn.execute(query_shards if shard else query, params).fetchall())
+    reservas = list(heapq.merge(*resultados, key=_chave_listagem, reverse=True))
+    if limite is not None:
+        reservas = reservas[:limite + 1]
+    response = jsonify([dict(reserva) for reserva in reservas[:limite]])
+    if limite is not None and len(reservas) > limite:
+        response.headers['X-Proximo-Cursor'] = _codificar_cursor(reservas[limite - 1])
+    return response
 
 @app.route('/api/minhas-reservas', methods=['GET'])
 @token_required
+@resposta_condicional('reservas', 'laboratorios')
 def get_minhas_reservas(current_user):
-    conn = get_db_connection()
-    reservas = conn.execute('''
-        SELECT r.*, l.nome as laboratorio_nome, l.localizacao
+    return _listar_reservas(f'''
+        SELECT {COLUNAS_RESERVA_API}, l.nome as laboratorio_nome, l.localizacao
         FROM reservas r JOIN laboratorios l ON r.laboratorio_id = l.id
-        WHERE r.professor_id = ? ORDER BY r.data DESC, r.horario_inicio DESC
-    ''', (current_user['id'],)).fetchall()
-    conn.close()
-    return jsonify([dict(reserva) for reserva in reservas])
+    ''', ['r.professor_id = ?'], [current_user['id']])
 
 @app.route('/api/reservas/<int:reserva_id>', methods=['GET']) # ROTA PARA BUSCAR UMA RESERVA (para edição)
 @token_required
 def get_reserva_by_id(current_user, reserva_id):
-    conn = get_db_connection()
-    reserva = conn.execute('SELECT * FROM reservas WHERE id = ?', (reserva_id,)).fetchone()
-    conn.close()
+    conn = get_db_connection(localizar_reserva(reserva_id))
+    reserva = conn.execute(f'SELECT {COLUNAS_RESERVA_API} FROM reservas r WHERE r.id = ?', (reserva_id,)).fetchone()
     if not reserva: return jsonify({'error': 'Reserva não encontrada'}), 404
     if reserva['professor_id'] != current_user['id'] and current_user.get('tipo') != 'admin':
         return jsonify({'error': 'Acesso não autorizado'}), 403
     return jsonify(dict(reserva))
 
+def _cmd_atualizar_reserva(tx, usuario, reserva_id, data):
+    reserva_original = tx.conn.execute('SELECT * FROM reservas WHERE id = ?', (reserva_id,)).fetchone()
+    if not reserva_original:
+        return {'error': 'Reserva não encontrada para atualizar'}, 404
+    if reserva_original['professor_id'] != usuario['id'] and usuario.get('tipo') != 'admin': # Admin também pode editar
+        return {'error': 'Acesso não autorizado para editar esta reserva'}, 403
+    
+    # Verifica conflitos, ignorando a própria reserva que está sendo editada
+    conflitos = tx.contar_conflitos(
+        data['laboratorio_id'], data['data'], data['horario_inicio'], data['horario_fim'], ignorar_id=reserva_id
+    )
+    if conflitos:
+        return {'error': 'Horário não disponível, conflito com outra reserva.'}, 409
+
+    novo_status = data.get('status', reserva_original['status']) # Permite atualizar status se enviado, senão mantém o original
+    tx.conn.execute('''
+        UPDATE reservas SET
+            laboratorio_id = ?, data = ?, horario_inicio = ?, horario_fim = ?,
+            disciplina = ?, turma = ?, descricao_atividade = ?, status = ?
+        WHERE id = ?
+    ''', (
+        data['laboratorio_id'], data['data'], data['horario_inicio'], data['horario_fim'],
+        data['disciplina'], data['turma'], data.get('descricao_atividade', ''),
+        novo_status, reserva_id
+    ))
+    return {'message': 'Reserva atualizada com sucesso'}, 200
+
 @app.route('/api/reservas/<int:reserva_id>', methods=['PUT']) # ROTA PARA ATUALIZAR RESERVA
 @token_required
 def update_reserva(current_user, reserva_id):
@@ -350,126 +2386,506 @@ def update_reserva(current_user, reserva_id):
     required_fields = ['laboratorio_id', 'data', 'horario_inicio', 'horario_fim', 'disciplina', 'turma']
     if not all(field in data for field in required_fields):
         return jsonify({'error': 'Dados incompletos para atualização'}), 400
-    conn = get_db_connection()
-    reserva_original = conn.execute('SELECT * FROM reservas WHERE id = ?', (reserva_id,)).fetchone()
-    if not reserva_original:
-        conn.close(); return jsonify({'error': 'Reserva não encontrada para atualizar'}), 404
-    if reserva_original['professor_id'] != current_user['id'] and current_user.get('tipo') != 'admin': # Admin também pode editar
-        conn.close(); return jsonify({'error': 'Acesso não autorizado para editar esta reserva'}), 403
-    
-    # Verifica conflitos, ignorando a própria reserva que está sendo editada
-    conflitos = conn.execute('''
-        SELECT * FROM reservas 
-        WHERE laboratorio_id = ? AND data = ? AND status != 'cancelada' AND id != ? 
-        AND (
-            (horario_inicio < ? AND horario_fim > ?) OR
-            (horario_inicio < ? AND horario_fim > ?) OR
-            (horario_inicio >= ? AND horario_fim <= ?)
-        )
-    ''', (
-        data['laboratorio_id'], data['data'], reserva_id,
-        data['horario_fim'], data['horario_inicio'],
-        data['horario_inicio'], data['horario_fim'],
-        data['horario_inicio'], data['horario_fim']
-    )).fetchall()
-    if conflitos:
-        conn.close(); return jsonify({'error': 'Horário não disponível, conflito com outra reserva.'}), 409
-
+    erro = erro_data_horario(data['data'], data['horario_inicio'], data['horario_fim'])
+    if erro:
+        return jsonify({'error': erro}), 400
+    shard = localizar_reserva(reserva_id)
+    if shards_ativos() and shard_do_laboratorio(data['laboratorio_id']) != shard:
+        return jsonify({'error': 'O laboratório é de outro campus; cancele e crie a reserva no novo laboratório.'}), 400
     try:
-        conn.execute('''
-            UPDATE reservas SET
-                laboratorio_id = ?, data = ?, horario_inicio = ?, horario_fim = ?,
-                disciplina = ?, turma = ?, descricao_atividade = ?, status = ?
-            WHERE id = ?
-        ''', (
-            data['laboratorio_id'], data['data'], data['horario_inicio'], data['horario_fim'],
-            data['disciplina'], data['turma'], data.get('descricao_atividade', ''),
-            data.get('status', reserva_original['status']), # Permite atualizar status se enviado, senão mantém o original
-            reserva_id
-        ))
-        conn.commit()
-        conn.close()
-        return jsonify({'message': 'Reserva atualizada com sucesso'}), 200
+        corpo, status_code = executar_escrita(_cmd_atualizar_reserva, current_user, reserva_id, data, shard=shard)
     except Exception as e:
-        conn.close(); return jsonify({'error': f'Erro ao atualizar reserva: {str(e)}'}), 500
+        return jsonify({'error': f'Erro ao atualizar reserva: {str(e)}'}), 500
+    return jsonify(corpo), status_code
 
-@app.route('/api/reservas/<int:reserva_id>/cancelar', methods=['PUT'])
-@token_required
-def cancelar_reserva(current_user, reserva_id):
-    conn = get_db_connection()
+def _cmd_cancelar_reserva(tx, usuario, reserva_id):
     # Verifica se o usuário é o dono ou admin
-    reserva = conn.execute('SELECT professor_id FROM reservas WHERE id = ?', (reserva_id,)).fetchone()
+    reserva = tx.conn.execute(
+        'SELECT professor_id FROM reservas WHERE id = ?', (reserva_id,)
+    ).fetchone()
     if not reserva:
-        conn.close(); return jsonify({'error': 'Reserva não encontrada'}), 404
+        return {'error': 'Reserva não encontrada'}, 404
     
     can_cancel = False
-    if current_user.get('tipo') == 'admin':
+    if usuario.get('tipo') == 'admin':
         can_cancel = True
-    elif reserva['professor_id'] == current_user['id']:
+    elif reserva['professor_id'] == usuario['id']:
         can_cancel = True
         
     if not can_cancel:
-        conn.close(); return jsonify({'error': 'Você não tem permissão para cancelar esta reserva'}), 403
+        return {'error': 'Você não tem permissão para cancelar esta reserva'}, 403
 
-    cursor = conn.execute("UPDATE reservas SET status = 'cancelada' WHERE id = ?", (reserva_id,))
-    conn.commit()
+    cursor = tx.conn.execute("UPDATE reservas SET status = 'cancelada' WHERE id = ?", (reserva_id,))
     if cursor.rowcount == 0: # Já verificado acima, mas uma dupla checagem
-        conn.close(); return jsonify({'error': 'Reserva não encontrada ou já estava no estado desejado'}), 404
-    conn.close()
-    return jsonify({'message': 'Reserva cancelada com sucesso'})
+        return {'error': 'Reserva não encontrada ou já estava no estado desejado'}, 404
+    return {'message': 'Reserva cancelada com sucesso'}, 200
 
-@app.route('/api/dashboard', methods=['GET'])
+@app.route('/api/reservas/<int:reserva_id>/cancelar', methods=['PUT'])
 @token_required
-def get_dashboard(current_user):
-    conn = get_db_connection()
-    total_reservas = conn.execute(
-        'SELECT COUNT(*) as total FROM reservas WHERE professor_id = ?', (current_user['id'],)
-    ).fetchone()['total']
-    reservas_confirmadas = conn.execute(
-        'SELECT COUNT(*) as total FROM reservas WHERE professor_id = ? AND status = "confirmada"', (current_user['id'],)
-    ).fetchone()['total']
-    proximas_reservas = conn.execute('''
-        SELECT r.*, l.nome as laboratorio_nome, l.localizacao
-        FROM reservas r JOIN laboratorios l ON r.laboratorio_id = l.id
-        WHERE r.professor_id = ? AND r.data >= date('now') AND r.status = 'confirmada'
-        ORDER BY r.data ASC, r.horario_inicio ASC LIMIT 5
-    ''', (current_user['id'],)).fetchall()
-    conn.close()
+def cancelar_reserva(current_user, reserva_id):
+    try:
+        corpo, status_code = executar_escrita(_cmd_cancelar_reserva, current_user, reserva_id,
+                                              shard=localizar_reserva(reserva_id))
+    except Exception as e:
+        return jsonify({'error': f'Erro ao cancelar reserva: {str(e)}'}), 500
+    return jsonify(corpo), status_code
+
+@app.route('/api/dashboard', methods=['GET'])
+@token_required
+def get_dashboard(current_user):
+    def consultar(conn, shard):
+        contadores = conn.execute(
+            'SELECT total, confirmadas, pendentes, canceladas FROM contadores_professor WHERE professor_id = ?',
+            (current_user['id'],)
+        ).fetchone()
+        proximas = conn.execute(f'''
+            SELECT {COLUNAS_RESERVA_API}, l.nome as laboratorio_nome, l.localizacao
+            FROM reservas r JOIN laboratorios l ON r.laboratorio_id = l.id
+            WHERE r.professor_id = ? AND r.status = 'confirmada' AND r.dia >= {_sql_dia("date('now')")}
+            ORDER BY r.dia ASC, r.inicio_min ASC LIMIT 5
+        ''', (current_user['id'],)).fetchall()
+        return tuple(contadores) if contadores else (0, 0, 0, 0), proximas
+
+    resultados = consultar_bancos(consultar)
+    total, confirmadas, pendentes, canceladas = (sum(valores) for valores in zip(*[contadores for contadores, _ in resultados]))
+    proximas_reservas = list(heapq.merge(*[proximas for _, proximas in resultados],
+                                         key=lambda reserva: (reserva['data'], reserva['horario_inicio'])))[:5]
     return jsonify({
-        'totalReservas': total_reservas, 'reservasConfirmadas': reservas_confirmadas,
+        'totalReservas': total, 'reservasConfirmadas': confirmadas,
+        'reservasPendentes': pendentes, 'reservasCanceladas': canceladas,
         'proximasReservas': [dict(reserva) for reserva in proximas_reservas]
     })
 
 @app.route('/api/reservas-calendario', methods=['GET'])
 @token_required
+@resposta_condicional('reservas', 'laboratorios', 'professores')
 def get_reservas_for_calendar(current_user):
-    conn = get_db_connection()
-    reservas = conn.execute('''
+    # O FullCalendar envia a janela visível em `start`/`end` (ISO 8601, `end` exclusivo).
+    # Só os 10 primeiros caracteres (yyyy-mm-dd) interessam, pois `data` é guardada assim.
+    inicio = (request.args.get('start') or '')[:10]
+    fim = (request.args.get('end') or '')[:10]
+    laboratorio_id = request.args.get('laboratorio_id', type=int)
+
+    query = '''
         SELECT r.id, r.data, r.horario_inicio, r.horario_fim, r.status, r.disciplina, r.turma,
                l.nome as laboratorio_nome, p.nome_completo as professor_nome
         FROM reservas r
         JOIN laboratorios l ON r.laboratorio_id = l.id
         JOIN professores p ON r.professor_id = p.id
-        WHERE r.status != 'cancelada' ORDER BY r.data, r.horario_inicio
-    ''').fetchall()
-    conn.close()
+        WHERE r.status != 'cancelada'
+    '''
+    params = []
+    if inicio:
+        query += ' AND r.data >= ?'; params.append(inicio)
+    if fim:
+        query += ' AND r.data < ?'; params.append(fim)
+    if laboratorio_id is not None:
+        query += ' AND r.laboratorio_id = ?'; params.append(laboratorio_id)
+    query += ' ORDER BY r.data, r.horario_inicio'
+
+    # Versão lida antes das reservas, em cada banco: o que mudar depois chega pelo feed de alterações
+    resultados = consultar_bancos(lambda conn, shard: (versao_dados(conn, 'reservas'), conn.execute(query, params).fetchall()))
+    reservas = heapq.merge(*[rows for _, rows in resultados], key=lambda res: (res['data'], res['horario_inicio']))
     # Não há necessidade de mapear para `events` aqui; o frontend pode fazer isso.
     # Apenas retorna a lista de reservas como dicionários.
-    return jsonify([dict(res) for res in reservas])
+    response = jsonify([dict(res) for res in reservas])
+    response.headers['X-Versao-Alteracoes'] = str(_texto_versao_alteracoes([versao for versao, _ in resultados]))
+    return response
+
+MAX_ALTERACOES_POR_RESPOSTA = 1000
+
+def _alteracoes_reservas(conn, desde, laboratorio_id=None):
+    """Reservas alteradas (inclusive canceladas) e ids removidos com versão em (desde, versao].
+
+    Se houver mais de MAX_ALTERACOES_POR_RESPOSTA, devolve as primeiras com `mais` = True e
+    `versao` = a da última enviada, para o cliente pedir o restante a partir dela.
+    """
+    versao = versao_dados(conn, 'reservas')
+    filtro_lab, params_lab = '', []
+    if laboratorio_id is not None:
+        filtro_lab, params_lab = ' AND laboratorio_id = ?', [laboratorio_id]
+    alteracoes = conn.execute(f'''
+        SELECT r.id, r.laboratorio_id, r.data, r.horario_inicio, r.horario_fim, r.status, r.disciplina, r.turma,
+               r.versao_alteracao, l.nome as laboratorio_nome, p.nome_completo as professor_nome
+        FROM reservas r
+        JOIN laboratorios l ON r.laboratorio_id = l.id
+        JOIN professores p ON r.professor_id = p.id
+        WHERE r.versao_alteracao > ? AND r.versao_alteracao <= ?{filtro_lab.replace('laboratorio_id', 'r.laboratorio_id')}
+        ORDER BY r.versao_alteracao LIMIT ?
+    ''', [desde, versao] + params_lab + [MAX_ALTERACOES_POR_RESPOSTA + 1]).fetchall()
+    mais = len(alteracoes) > MAX_ALTERACOES_POR_RESPOSTA
+    if mais:
+        alteracoes = alteracoes[:MAX_ALTERACOES_POR_RESPOSTA]
+        versao = alteracoes[-1]['versao_alteracao']
+    removidas = conn.execute(f'''
+        SELECT reserva_id FROM reservas_removidas
+        WHERE versao_alteracao > ? AND versao_alteracao <= ?{filtro_lab}
+    ''', [desde, versao] + params_lab).fetchall()
+    return {
+        'versao': versao, 'mais': mais,
+        'alteracoes': [dict(row) for row in alteracoes],
+        'removidas': [row['reserva_id'] for row in removidas],
+    }
+
+# Com shards, cada banco tem a sua versão de reservas: a versão do feed é a lista delas, na ordem
+# [principal] + mapa_shards(), escrita como 'principal.campus1.campus2'. Sem shards, é um inteiro.
+def _texto_versao_alteracoes(versoes):
+    return versoes[0] if len(versoes) == 1 else '.'.join(map(str, versoes))
+
+def _ler_versao_alteracoes(texto):
+    """Lista de versões (uma por banco) a partir do `desde`/Last-Event-ID recebido; None se inválido"""
+    try:
+        versoes = [int(parte) for parte in str(texto).split('.')]
+    except ValueError:
+        return None
+    return versoes if len(versoes) == 1 + len(mapa_shards()) else None
+
+def alteracoes_nos_bancos(desde, laboratorio_id=None, so_se_mudou=False, avulsa=False):
+    """_alteracoes_reservas de cada banco a partir da sua versão em `desde`, juntas numa resposta.
+    Com `so_se_mudou`, None se nenhum banco passou da sua versão (sem ler as reservas)."""
+    bancos = [None] + list(mapa_shards())
+
+    def consultar(conn, shard):
+        ultima = desde[bancos.index(shard)]
+        if so_se_mudou and versao_dados(conn, 'reservas') <= ultima:
+            return {'versao': ultima, 'mais': False, 'alteracoes': [], 'removidas': [], 'mudou': False}
+        return dict(_alteracoes_reservas(conn, ultima, laboratorio_id), mudou=True)
+
+    resultados = consultar_bancos(consultar, avulsa=avulsa)
+    if not any(resultado['mudou'] for resultado in resultados):
+        return None
+    return {
+        'versao': _texto_versao_alteracoes([resultado['versao'] for resultado in resultados]),
+        'mais': any(resultado['mais'] for resultado in resultados),
+        'alteracoes': [alteracao for resultado in resultados for alteracao in resultado['alteracoes']],
+        'removidas': [reserva_id for resultado in resultados for reserva_id in resultado['removidas']],
+    }
+
+@app.route('/api/reservas/alteracoes', methods=['GET'])
+@token_required
+def get_alteracoes_reservas(current_user):
+    """Alterações de reservas desde a versão `desde` (a do header X-Versao-Alteracoes do calendário)"""
+    desde = _ler_versao_alteracoes(request.args.get('desde', ''))
+    if desde is None:
+        return jsonify({'error': 'Informe desde (versão a partir da qual buscar alterações, a do header X-Versao-Alteracoes)'}), 400
+    return jsonify(alteracoes_nos_bancos(desde, request.args.get('laboratorio_id', type=int)))
+
+@app.route('/api/reservas/alteracoes/stream-token', methods=['POST'])
+@token_required
+def token_stream_alteracoes(current_user):
+    """Token de STREAM_TOKEN_VALIDADE_S segundos que só abre /api/reservas/alteracoes/stream.
+
+    É ele que vai na URL do EventSource (e portanto em logs e no histórico), no lugar do token de sessão.
+    """
+    validade = app.config['STREAM_TOKEN_VALIDADE_S']
+    token = jwt.encode({
+        'id': current_user['id'], 'matricula': current_user.get('matricula'), 'nome': current_user.get('nome'),
+        'tipo': current_user['tipo'], 'ger': current_user.get('ger', 0), 'uso': 'stream',
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(seconds=validade)
+    }, app.config['SECRET_KEY'], algorithm='HS256')
+    return jsonify({'token': token, 'expira_em_s': validade})
+
+@app.route('/api/reservas/alteracoes/stream', methods=['GET'])
+@token_required
+@token_na_query
+def stream_alteracoes_reservas(current_user):
+    """Server-Sent Events com as alterações de reservas a partir de `desde` (ou do Last-Event-ID).
+
+    Consulta versoes_dados a cada ALTERACOES_INTERVALO_S e envia um evento `alteracoes` quando a
+    versão muda. Cada verificação pega uma conexão do pool e a devolve em seguida, então o stream
+    não segura conexão entre uma e outra. O stream é encerrado após ALTERACOES_DURACAO_MAX_S; o cliente
+    reabre com um novo token de stream a partir do último id recebido.
+    """
+    desde = _ler_versao_alteracoes(request.headers.get('Last-Event-ID') or request.args.get('desde', ''))
+    if desde is None:
+        return jsonify({'error': 'Informe desde (versão a partir da qual buscar alterações, a do header X-Versao-Alteracoes)'}), 400
+    laboratorio_id = request.args.get('laboratorio_id', type=int)
+    intervalo = app.config['ALTERACOES_INTERVALO_S']
+    liberar_conexao() # A da autenticação: o contexto da requisição dura o stream inteiro
+
+    def alteracoes_desde(ultima):
+        return alteracoes_nos_bancos(ultima, laboratorio_id, so_se_mudou=True, avulsa=True)
+
+    def gerar():
+        ultima = desde
+        inicio = ultimo_envio = time.monotonic()
+        yield 'retry: 3000\n\n'
+        while time.monotonic() - inicio < app.config['ALTERACOES_DURACAO_MAX_S']:
+            corpo = alteracoes_desde(ultima)
+            if corpo is not None:
+                ultima = _ler_versao_alteracoes(corpo['versao'])
+                ultimo_envio = time.monotonic()
+                yield f"id: {corpo['versao']}\nevent: alteracoes\ndata: {json.dumps(corpo, ensure_ascii=False)}\n\n"
+                if corpo['mais']:
+                    continue
+            elif time.monotonic() - ultimo_envio >= 15:
+                ultimo_envio = time.monotonic()
+                yield ': ping\n\n' # Mantém proxies e o navegador com a conexão aberta
+            time.sleep(intervalo)
+
+    return Response(stream_with_context(gerar()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 # --- ROTAS ADMINISTRATIVAS ---
+# --- FEEDS ICS (ASSINATURA DE CALENDÁRIO) ---
+# Calendários de desktop/celular assinam /api/calendario/<token>.ics e sincronizam sozinhos. Sem JWT
+# (os clientes não enviam headers): o token, aleatório e revogável, é a credencial do feed.
+
+class CacheFeeds:
+    """Feeds ICS já gerados, por (tipo, alvo_id), válidos enquanto a chave de versões não mudar (LRU)"""
+
+    def __init__(self, maximo):
+        self._lock = threading.Lock()
+        self._maximo = maximo
+        self._feeds = OrderedDict()  # (tipo, alvo_id) -> (chave, corpo, corpo_gzip)
+
+    def obter(self, feed, chave):
+        with self._lock:
+            item = self._feeds.get(feed)
+            if item is None or item[0] != chave:
+                return None
+            self._feeds.move_to_end(feed)
+            return item
+
+    def guardar(self, feed, chave, corpo, corpo_gzip):
+        with self._lock:
+            self._feeds[feed] = (chave, corpo, corpo_gzip)
+            self._feeds.move_to_end(feed)
+            while len(self._feeds) > self._maximo:
+                self._feeds.popitem(last=False)
+
+cache_feeds = CacheFeeds(app.config['ICS_CACHE_MAX'])
+
+def hash_token_feed(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def _bancos_do_feed(tipo, alvo_id):
+    """Bancos com as reservas do feed: o do campus do laboratório, ou todos para um professor"""
+    if tipo == 'laboratorio':
+        return [shard_do_laboratorio(alvo_id)]
+    return [None] + list(mapa_shards())
+
+def _chave_feed(tipo, alvo_id, janela_inicio):
+    """(chave de cache, última alteração): versões do feed em cada banco + nomes de laboratórios/professores"""
+    versoes, alteracoes = [], []
+    for shard in _bancos_do_feed(tipo, alvo_id):
+        row = get_db_connection(shard).execute(
+            'SELECT versao, atualizado_em FROM versoes_feed WHERE tipo = ? AND alvo_id = ?', (tipo, alvo_id)
+        ).fetchone()
+        versoes.append(row['versao'] if row else 0)
+        alteracoes.append(row['atualizado_em'] if row else None)
+    for row in get_db_connection().execute(
+            "SELECT versao, atualizado_em FROM versoes_dados WHERE tabela IN ('laboratorios', 'professores') ORDER BY tabela"):
+        versoes.append(row['versao'])
+        alteracoes.append(row['atualizado_em'])
+    return (janela_inicio, tuple(versoes)), max((valor for valor in alteracoes if valor), default=None)
+
+def _texto_ics(valor):
+    return (str(valor or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r', '').replace('\n', '\\n'))
+
+def _dobrar_linha_ics(linha):
+    """Quebra linhas com mais de 75 octetos (RFC 5545, 3.1) sem partir caracteres UTF-8"""
+    partes, atual, tamanho = [], '', 0
+    for caractere in linha:
+        octetos = len(caractere.encode('utf-8'))
+        if tamanho + octetos > 75:
+            partes.append(atual)
+            atual, tamanho = ' ', 1
+        atual += caractere
+        tamanho += octetos
+    partes.append(atual)
+    return '\r\n'.join(partes)
+
+def _data_hora_ics(data, horario):
+    """'AAAA-MM-DD' + 'HH:MM' -> AAAAMMDDTHHMMSS local ('24:00' vira 00:00 do dia seguinte)"""
+    momento = datetime.datetime.fromisoformat(data) + datetime.timedelta(minutes=minutos_do_dia(horario) or 0)
+    return momento.strftime('%Y%m%dT%H%M%S')
+
+STATUS_ICS = {'confirmada': 'CONFIRMED', 'pendente': 'TENTATIVE', 'cancelada': 'CANCELLED'}
+
+def gerar_ics(nome_calendario, reservas):
+    """Corpo text/calendar com um VEVENT por reserva, no fuso ICS_FUSO"""
+    fuso = app.config['ICS_FUSO']
+    agora = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    linhas = [
+        'BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//UERN//Agendamento LabCC e LabCan//PT-BR',
+        'CALSCALE:GREGORIAN', 'METHOD:PUBLISH', f'X-WR-CALNAME:{_texto_ics(nome_calendario)}', f'X-WR-TIMEZONE:{fuso}',
+        'BEGIN:VTIMEZONE', f'TZID:{fuso}', 'BEGIN:STANDARD', 'DTSTART:19700101T000000',
+        'TZOFFSETFROM:-0300', 'TZOFFSETTO:-0300', 'TZNAME:-03', 'END:STANDARD', 'END:VTIMEZONE',
+    ]
+    for reserva in reservas:
+        criada = (reserva['created_at'] or '').replace('-', '').replace(':', '').replace(' ', 'T')[:15]
+        resumo = f"{reserva['disciplina']} ({reserva['turma']})"
+        local = f"{reserva['laboratorio_nome']} - {reserva['localizacao']}"
+        descricao = f"Professor(a): {reserva['professor_nome']}\nTurma: {reserva['turma']}"
+        if reserva['descricao_atividade']:
+            descricao += f"\n{reserva['descricao_atividade']}"
+        linhas += [
+            'BEGIN:VEVENT',
+            f"UID:reserva-{reserva['id']}@agendamento-labs-uern",
+            f"DTSTAMP:{criada + 'Z' if len(criada) == 15 else agora}",
+            f"DTSTART;TZID={fuso}:{_data_hora_ics(reserva['data'], reserva['horario_inicio'])}",
+            f"DTEND;TZID={fuso}:{_data_hora_ics(reserva['data'], reserva['horario_fim'])}",
+            f"SUMMARY:{_texto_ics(resumo)}",
+            f"LOCATION:{_texto_ics(local)}",
+            f"DESCRIPTION:{_texto_ics(descricao)}",
+            f"STATUS:{STATUS_ICS.get(reserva['status'], 'CONFIRMED')}",
+            'END:VEVENT',
+        ]
+    linhas.append('END:VCALENDAR')
+    return ('\r\n'.join(_dobrar_linha_ics(linha) for linha in linhas) + '\r\n').encode('utf-8')
+
+def _gerar_feed(tipo, alvo_id, janela_inicio):
+    conn = get_db_connection()
+    if tipo == 'laboratorio':
+        alvo = conn.execute('SELECT nome FROM laboratorios WHERE id = ?', (alvo_id,)).fetchone()
+        nome = f"{alvo['nome']} - reservas" if alvo else 'Laboratório removido'
+    else:
+        alvo = conn.execute('SELECT nome_completo FROM professores WHERE id = ?', (alvo_id,)).fetchone()
+        nome = f"Reservas de {alvo['nome_completo']}" if alvo else 'Professor removido'
+    coluna = 'r.laboratorio_id' if tipo == 'laboratorio' else 'r.professor_id'
+    reservas = []
+    for shard in _bancos_do_feed(tipo, alvo_id):
+        reservas += get_db_connection(shard).execute(f'''
+            SELECT r.id, r.data, r.horario_inicio, r.horario_fim, r.disciplina, r.turma, r.descricao_atividade,
+                   r.status, r.created_at, r.dia, r.inicio_min, l.nome AS laboratorio_nome, l.localizacao,
+                   p.nome_completo AS professor_nome
+            FROM reservas r
+            JOIN laboratorios l ON r.laboratorio_id = l.id
+            JOIN professores p ON r.professor_id = p.id
+            WHERE {coluna} = ? AND r.dia >= ?
+            ORDER BY r.dia, r.inicio_min
+        ''', (alvo_id, janela_inicio)).fetchall()
+    reservas.sort(key=lambda reserva: (reserva['dia'], reserva['inicio_min'] or 0))
+    return gerar_ics(nome, reservas)
+
+@app.route('/api/calendario/<token>.ics', methods=['GET'])
+def feed_ics(token):
+    """Feed ICS assinável. O corpo é gerado uma vez por versão do feed e servido da memória; com
+    If-None-Match igual, a resposta é 304 depois de ler só o token e as versões."""
+    feed = get_db_connection().execute('''
+        SELECT f.tipo, f.alvo_id FROM feeds_calendario f JOIN professores p ON p.id = f.professor_id
+        WHERE f.token_hash = ? AND p.status = 'ativo'
+    ''', (hash_token_feed(token),)).fetchone() # Dono inativo: o feed para junto com o login
+    if feed is None:
+        return jsonify({'error': 'Feed não encontrado ou revogado'}), 404
+    tipo, alvo_id = feed['tipo'], feed['alvo_id']
+    janela_inicio = numero_dia(datetime.date.today()) - app.config['ICS_DIAS_PASSADOS']
+    chave, ultima_alteracao = _chave_feed(tipo, alvo_id, janela_inicio)
+    etag = hashlib.sha1(json.dumps([tipo, alvo_id, chave]).encode('utf-8')).hexdigest()[:20]
+
+    nao_modificado = request.if_none_match.contains_weak(etag)
+    comprimido = False
+    if nao_modificado:
+        response = Response(status=304)
+    else:
+        item = cache_feeds.obter((tipo, alvo_id), chave)
+        if item is None:
+            corpo = _gerar_feed(tipo, alvo_id, janela_inicio)
+            item = (chave, corpo, gzip.compress(corpo, compresslevel=6) if len(corpo) >= app.config['GZIP_MIN_BYTES'] else None)
+            cache_feeds.guardar((tipo, alvo_id), *item)
+        _, corpo, corpo_gzip = item
+        comprimido = corpo_gzip is not None and 'gzip' in request.accept_encodings
+        response = Response(corpo_gzip if comprimido else corpo, mimetype='text/calendar')
+        if comprimido:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag, weak=True)
+    if ultima_alteracao:
+        response.last_modified = datetime.datetime.fromisoformat(ultima_alteracao).replace(tzinfo=datetime.timezone.utc)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Accept-Encoding')
+    metricas.registrar_condicional(request.endpoint, nao_modificado, comprimido)
+    return response
+
+def _cmd_criar_feed(tx, professor_id, tipo, alvo_id, token_hash):
+    cursor = tx.conn.execute(
+        'INSERT INTO feeds_calendario (token_hash, professor_id, tipo, alvo_id) VALUES (?, ?, ?, ?)',
+        (token_hash, professor_id, tipo, alvo_id)
+    )
+    return {'feed_id': cursor.lastrowid}, 201
+
+def _cmd_revogar_feed(tx, usuario, feed_id):
+    feed = tx.conn.execute('SELECT professor_id FROM feeds_calendario WHERE id = ?', (feed_id,)).fetchone()
+    if not feed:
+        return {'error': 'Feed não encontrado'}, 404
+    if feed['professor_id'] != usuario['id'] and usuario.get('tipo') != 'admin':
+        return {'error': 'Você não tem permissão para revogar este feed'}, 403
+    tx.conn.execute('DELETE FROM feeds_calendario WHERE id = ?', (feed_id,))
+    return {'message': 'Feed revogado com sucesso'}, 200
+
+@app.route('/api/feeds', methods=['POST'])
+@token_required
+def criar_feed(current_user):
+    """Cria um feed ICS: {"tipo": "laboratorio", "alvo_id": 1} ou {"tipo": "professor"} (o próprio;
+    admin pode informar alvo_id). O token só aparece nesta resposta."""
+    data = request.get_json() or {}
+    tipo = data.get('tipo')
+    alvo_id = data.get('alvo_id', current_user['id'] if tipo == 'professor' else None)
+    if tipo not in ('laboratorio', 'professor') or not isinstance(alvo_id, int):
+        return jsonify({'error': 'Informe tipo (laboratorio ou professor) e alvo_id'}), 400
+    if tipo == 'professor' and alvo_id != current_user['id'] and current_user.get('tipo') != 'admin':
+        return jsonify({'error': 'Só é possível assinar as próprias reservas'}), 403
+    tabela = 'laboratorios' if tipo == 'laboratorio' else 'professores'
+    if not get_db_connection().execute(f'SELECT 1 FROM {tabela} WHERE id = ?', (alvo_id,)).fetchone():
+        return jsonify({'error': 'Laboratório ou professor não encontrado'}), 404
+    token = secrets.token_urlsafe(24)
+    try:
+        corpo, status_code = executar_escrita(_cmd_criar_feed, current_user['id'], tipo, alvo_id, hash_token_feed(token))
+    except Exception as e:
+        return jsonify({'error': f'Erro ao criar feed: {str(e)}'}), 500
+    corpo.update({'tipo': tipo, 'alvo_id': alvo_id, 'token': token,
+                  'url': f"{request.host_url}api/calendario/{token}.ics"})
+    return jsonify(corpo), status_code
+
+@app.route('/api/feeds', methods=['GET'])
+@token_required
+def listar_feeds(current_user):
+    """Feeds do usuário (admin: todos). Os tokens não são guardados, só o hash."""
+    conn = get_db_connection()
+    query = 'SELECT id, professor_id, tipo, alvo_id, created_at FROM feeds_calendario'
+    if current_user.get('tipo') == 'admin':
+        feeds = conn.execute(query + ' ORDER BY id').fetchall()
+    else:
+        feeds = conn.execute(query + ' WHERE professor_id = ? ORDER BY id', (current_user['id'],)).fetchall()
+    return jsonify([dict(feed) for feed in feeds])
+
+@app.route('/api/feeds/<int:feed_id>', methods=['DELETE'])
+@token_required
+def revogar_feed(current_user, feed_id):
+    try:
+        corpo, status_code = executar_escrita(_cmd_revogar_feed, current_user, feed_id)
+    except Exception as e:
+        return jsonify({'error': f'Erro ao revogar feed: {str(e)}'}), 500
+    return jsonify(corpo), status_code
+
 @app.route('/api/professores', methods=['GET'])
 @token_required
 @admin_required
+@resposta_condicional('professores')
 def listar_todos_professores(current_user):
     conn = get_db_connection()
     professores = conn.execute(
         'SELECT id, nome_completo, matricula, email, telefone, departamento, status, tipo, created_at FROM professores ORDER BY nome_completo'
     ).fetchall()
-    conn.close()
     return jsonify([dict(prof) for prof in professores])
 
+def _cmd_criar_professor(tx, data, senha_hash):
+    try:
+        cursor = tx.conn.execute('''
+            INSERT INTO professores (nome_completo, matricula, email, telefone, departamento, senha_hash, status, tipo)
+            VALUES (?, ?, ?, ?, ?, ?, 'ativo', 'professor') 
+        ''', (
+            data['nome_completo'], data['matricula'], data.get('email'), 
+            data.get('telefone', ''), data.get('departamento', ''), senha_hash
+        ))
+    except sqlite3.IntegrityError as e:
+        if 'matricula' in str(e).lower(): return {'error': 'Matrícula já existe'}, 409
+        if 'email' in str(e).lower() and data.get('email'): return {'error': 'Email já existe'}, 409
+        return {'error': f'Erro de integridade: {e}'}, 409
+    return {'message': 'Professor criado com sucesso', 'professor_id': cursor.lastrowid}, 201
+
 @app.route('/api/professores', methods=['POST'])
 @token_required
 @admin_required
@@ -478,39 +2894,274 @@ def criar_professor(current_user):
     required_fields = ['nome_completo', 'matricula', 'senha'] # Email é opcional no DB schema
     if not all(data.get(field) for field in required_fields):
         return jsonify({'error': 'Nome, matrícula e senha são obrigatórios.'}), 400
-    senha_hash = bcrypt.hashpw(data['senha'].encode('utf-8'), bcrypt.gensalt())
+    try:
+        senha_hash = executor_senhas.gerar_hash(data['senha'])
+    except FilaSenhasCheia:
+        return resposta_fila_cheia()
+    try:
+        corpo, status_code = executar_escrita(_cmd_criar_professor, data, senha_hash)
+    except Exception as e:
+        return jsonify({'error': f'Erro interno: {e}'}), 500
+    diretorio_alterado()
+    return jsonify(corpo), status_code
+
+# --- IMPORTAÇÃO DE PROFESSORES EM MASSA (CSV / JSONL) ---
+CAMPOS_IMPORTACAO_PROFESSOR = ['nome_completo', 'matricula', 'senha', 'email', 'telefone', 'departamento']
+MAX_IMPORTACAO_PROFESSORES = 5000 # Limite da rota; o script importar_professores.py não tem limite
+LOTE_IMPORTACAO_PROFESSORES = 500 # Linhas por transação
+
+def ler_professores(conteudo, formato):
+    """Lê o arquivo de importação e devolve [(numero_linha, dados, erro)], um item por linha de dados"""
+    linhas = []
+    if formato == 'jsonl':
+        for numero, texto in enumerate(conteudo.splitlines(), start=1):
+            if not texto.strip(): continue
+            try:
+                dados = json.loads(texto)
+            except ValueError as e:
+                linhas.append((numero, None, f'JSON inválido: {e}'))
+                continue
+            if not isinstance(dados, dict):
+                linhas.append((numero, None, 'Cada linha deve ser um objeto JSON'))
+                continue
+            linhas.append((numero, dados, None))
+    elif formato == 'csv':
+        leitor = csv.DictReader(io.StringIO(conteudo))
+        if not leitor.fieldnames or 'matricula' not in leitor.fieldnames:
+            raise ValueError(f'Cabeçalho do CSV deve conter as colunas: {", ".join(CAMPOS_IMPORTACAO_PROFESSOR)}')
+        for dados in leitor:
+            linhas.append((leitor.line_num, dados, None)) # line_num conta o cabeçalho, como num editor
+    else:
+        raise ValueError('Formato deve ser csv ou jsonl.')
+    return linhas
+
+_executor_importacao = None
+_executor_importacao_lock = threading.Lock()
+
+def executor_importacao():
+    """Pool de threads da importação, criado uma vez e reaproveitado entre requisições.
+    Separado de executor_senhas para que uma importação grande não ocupe a fila dos logins."""
+    global _executor_importacao
+    with _executor_importacao_lock:
+        if _executor_importacao is None:
+            _executor_importacao = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='importacao')
+        return _executor_importacao
+
+def _hashes_senhas(senhas, rounds):
+    return [bcrypt.hashpw(senha.encode('utf-8'), bcrypt.gensalt(rounds=rounds)) for senha in senhas]
+
+def gerar_hashes_em_paralelo(senhas, threads=None):
+    """bcrypt em até `threads` threads (padrão: nº de CPUs). O bcrypt libera o GIL, então elas rodam em paralelo."""
+    rounds = app.config['BCRYPT_ROUNDS']
+    threads = min(threads or os.cpu_count() or 1, len(senhas))
+    if threads <= 1:
+        return _hashes_senhas(senhas, rounds)
+    # Uma fatia por thread: a importação usa no máximo `threads` workers do pool compartilhado
+    fatias = [senhas[i::threads] for i in range(threads)]
+    resultados = [executor_importacao().submit(_hashes_senhas, fatia, rounds) for fatia in fatias]
+    hashes = [None] * len(senhas)
+    for i, future in enumerate(resultados):
+        hashes[i::threads] = future.result()
+    return hashes
+
+def _cmd_inserir_professores(tx, registros):
+    # OR IGNORE: uma matrícula/email que surgiu desde a checagem não derruba o lote inteiro
+    tx.conn.executemany('''
+        INSERT OR IGNORE INTO professores (nome_completo, matricula, email, telefone, departamento, senha_hash, status, tipo)
+        VALUES (?, ?, ?, ?, ?, ?, 'ativo', 'professor')
+    ''', registros)
+    hashes = {r[1]: r[5] for r in registros}
+    rows = tx.conn.execute(
+        'SELECT id, matricula, senha_hash FROM professores WHERE matricula IN (SELECT value FROM json_each(?))',
+        (json.dumps(list(hashes)),)
+    ).fetchall()
+    # O sal do bcrypt é único: o hash só confere se a linha foi inserida agora
+    return {row['matricula']: row['id'] for row in rows if row['senha_hash'] == hashes[row['matricula']]}
+
+def importar_professores(linhas, threads=None):
+    """Valida, gera os hashes em paralelo e insere em lotes; conflitos são reportados por linha"""
+    resultados = []
+    validas = []
+    matriculas_vistas, emails_vistos = {}, {}
+    for numero, dados, erro in linhas:
+        if erro is None:
+            dados = {campo: str(dados.get(campo) or '').strip() for campo in CAMPOS_IMPORTACAO_PROFESSOR}
+            if not all(dados[campo] for campo in ('nome_completo', 'matricula', 'senha')):
+                erro = 'Nome, matrícula e senha são obrigatórios.'
+            elif dados['email'] and '@' not in dados['email']:
+                erro = 'Email inválido.'
+        if erro is not None:
+            resultados.append({'linha': numero, 'matricula': (dados or {}).get('matricula'), 'resultado': 'invalido', 'error': erro})
+            continue
+        repetida = matriculas_vistas.get(dados['matricula']) or (dados['email'] and emails_vistos.get(dados['email']))
+        if repetida:
+            resultados.append({'linha': numero, 'matricula': dados['matricula'], 'resultado': 'duplicado_no_arquivo',
+                               'error': f'Matrícula ou email repetido da linha {repetida}'})
+            continue
+        matriculas_vistas[dados['matricula']] = numero
+        if dados['email']: emails_vistos[dados['email']] = numero
+        validas.append((numero, dados))
+
+    # Conflitos com o banco antes do bcrypt: não gasta CPU com linhas que seriam recusadas
     conn = get_db_connection()
+    matriculas_existentes = {row[0] for row in conn.execute(
+        'SELECT matricula FROM professores WHERE matricula IN (SELECT value FROM json_each(?))',
+        (json.dumps(list(matriculas_vistas)),)
+    )}
+    emails_existentes = {row[0] for row in conn.execute(
+        'SELECT email FROM professores WHERE email IN (SELECT value FROM json_each(?))',
+        (json.dumps(list(emails_vistos)),)
+    )}
+    a_criar = []
+    for numero, dados in validas:
+        if dados['matricula'] in matriculas_existentes:
+            resultados.append({'linha': numero, 'matricula': dados['matricula'], 'resultado': 'conflito', 'error': 'Matrícula já existe'})
+        elif dados['email'] in emails_existentes:
+            resultados.append({'linha': numero, 'matricula': dados['matricula'], 'resultado': 'conflito', 'error': 'Email já existe'})
+        else:
+            a_criar.append((numero, dados))
+
+    hashes = gerar_hashes_em_paralelo([dados['senha'] for _, dados in a_criar], threads)
+    for inicio in range(0, len(a_criar), LOTE_IMPORTACAO_PROFESSORES):
+        lote = a_criar[inicio:inicio + LOTE_IMPORTACAO_PROFESSORES]
+        registros = [
+            (d['nome_completo'], d['matricula'], d['email'] or None, d['telefone'], d['departamento'], senha_hash)
+            for (_, d), senha_hash in zip(lote, hashes[inicio:inicio + LOTE_IMPORTACAO_PROFESSORES])
+        ]
+        criados = executar_escrita(_cmd_inserir_professores, registros)
+        for numero, dados in lote:
+            if dados['matricula'] in criados:
+                resultados.append({'linha': numero, 'matricula': dados['matricula'], 'resultado': 'criado',
+                                   'professor_id': criados[dados['matricula']]})
+            else:
+                resultados.append({'linha': numero, 'matricula': dados['matricula'], 'resultado': 'conflito',
+                                   'error': 'Matrícula ou email cadastrado durante a importação'})
+
+    if a_criar:
+        diretorio_alterado()
+    resultados.sort(key=lambda r: r['linha'])
+    return {
+        'total': len(resultados),
+        'criados': sum(1 for r in resultados if r['resultado'] == 'criado'),
+        'recusados': sum(1 for r in resultados if r['resultado'] != 'criado'),
+        'resultados': resultados,
+    }
+
+@app.route('/api/professores/importar', methods=['POST'])
+@token_required
+@admin_required
+def importar_professores_rota(current_user):
+    arquivo = request.files.get('arquivo')
     try:
-        cursor = conn.execute('''
-            INSERT INTO professores (nome_completo, matricula, email, telefone, departamento, senha_hash, status, tipo)
-            VALUES (?, ?, ?, ?, ?, ?, 'ativo', 'professor') 
-        ''', (
-            data['nome_completo'], data['matricula'], data.get('email'), 
-            data.get('telefone', ''), data.get('departamento', ''), senha_hash
-        ))
-        conn.commit()
-        professor_id = cursor.lastrowid
-        conn.close()
-        return jsonify({'message': 'Professor criado com sucesso', 'professor_id': professor_id}), 201
-    except sqlite3.IntegrityError as e:
-        conn.close()
-        if 'matricula' in str(e).lower(): return jsonify({'error': 'Matrícula já existe'}), 409
-        if 'email' in str(e).lower() and data.get('email'): return jsonify({'error': 'Email já existe'}), 409
-        return jsonify({'error': f'Erro de integridade: {e}'}), 409
+        if arquivo:
+            conteudo, nome = arquivo.read().decode('utf-8-sig'), arquivo.filename or ''
+        else:
+            conteudo, nome = request.get_data().decode('utf-8-sig'), ''
+    except UnicodeDecodeError:
+        return jsonify({'error': 'O arquivo deve estar em UTF-8.'}), 400
+    formato = request.args.get('formato')
+    if not formato:
+        jsonl = nome.lower().endswith(('.jsonl', '.ndjson')) or (not arquivo and 'json' in (request.mimetype or ''))
+        formato = 'jsonl' if jsonl else 'csv'
+    try:
+        linhas = ler_professores(conteudo, formato)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except csv.Error as e:
+        return jsonify({'error': f'CSV inválido: {e}'}), 400
+    if not linhas:
+        return jsonify({'error': 'Arquivo sem linhas de dados.'}), 400
+    if len(linhas) > MAX_IMPORTACAO_PROFESSORES:
+        return jsonify({'error': f'No máximo {MAX_IMPORTACAO_PROFESSORES} linhas por requisição; use o importar_professores.py.'}), 400
+    try:
+        return jsonify(importar_professores(linhas)), 200
     except Exception as e:
-        conn.close(); return jsonify({'error': f'Erro interno: {e}'}), 500
+        return jsonify({'error': f'Erro interno: {e}'}), 500
+
+def _cmd_deletar_professor(tx, professor_id):
+    # ON DELETE CASCADE cuidará das reservas
+    cursor = tx.conn.execute('DELETE FROM professores WHERE id = ?', (professor_id,))
+    if cursor.rowcount == 0: return {'error': 'Professor não encontrado'}, 404
+    return {'message': 'Professor deletado com sucesso'}, 200
 
 @app.route('/api/professores/<int:professor_id>', methods=['DELETE'])
 @token_required
 @admin_required
 def deletar_professor(current_user, professor_id):
-    conn = get_db_connection()
-    # ON DELETE CASCADE cuidará das reservas
-    cursor = conn.execute('DELETE FROM professores WHERE id = ?', (professor_id,))
-    conn.commit()
-    conn.close()
-    if cursor.rowcount == 0: return jsonify({'error': 'Professor não encontrado'}), 404
-    return jsonify({'message': 'Professor deletado com sucesso'})
+    try:
+        corpo, status_code = executar_escrita(_cmd_deletar_professor, professor_id)
+    except Exception as e:
+        return jsonify({'error': f'Erro interno: {e}'}), 500
+    cache_autenticacao.invalidar(professor_id)
+    diretorio_alterado()
+    return jsonify(corpo), status_code
+
+def _cmd_alterar_acesso_professor(tx, professor_id, campo, valor):
+    """campo: 'status', 'tipo' ou 'geracao_token' (valor ignorado: incrementa, revogando os tokens emitidos)"""
+    if campo == 'geracao_token':
+        cursor = tx.conn.execute('UPDATE professores SET geracao_token = geracao_token + 1 WHERE id = ?', (professor_id,))
+    else:
+        cursor = tx.conn.execute(f'UPDATE professores SET {campo} = ? WHERE id = ?', (valor, professor_id))
+    if cursor.rowcount == 0:
+        return {'error': 'Professor não encontrado'}, 404
+    return {'message': 'Acesso do professor atualizado'}, 200
+
+def _alterar_acesso_professor(current_user, professor_id, campo, valor=None):
+    if professor_id == current_user['id'] and campo != 'geracao_token':
+        return jsonify({'error': 'Não é possível alterar o próprio status ou tipo'}), 400
+    try:
+        corpo, status_code = executar_escrita(_cmd_alterar_acesso_professor, professor_id, campo, valor)
+    except Exception as e:
+        return jsonify({'error': f'Erro interno: {e}'}), 500
+    cache_autenticacao.invalidar(professor_id) # Os outros processos percebem pela versão 'autenticacao'
+    diretorio_alterado()
+    return jsonify(corpo), status_code
+
+@app.route('/api/professores/<int:professor_id>/status', methods=['PUT'])
+@token_required
+@admin_required
+def alterar_status_professor(current_user, professor_id):
+    """{"status": "ativo" | "inativo"}; inativo perde o acesso na hora, mesmo com token válido"""
+    status = (request.get_json() or {}).get('status')
+    if status not in ('ativo', 'inativo'):
+        return jsonify({'error': 'Status inválido'}), 400
+    return _alterar_acesso_professor(current_user, professor_id, 'status', status)
+
+@app.route('/api/professores/<int:professor_id>/tipo', methods=['PUT'])
+@token_required
+@admin_required
+def alterar_tipo_professor(current_user, professor_id):
+    """{"tipo": "professor" | "admin"}; vale a partir da próxima requisição"""
+    tipo = (request.get_json() or {}).get('tipo')
+    if tipo not in ('professor', 'admin'):
+        return jsonify({'error': 'Tipo inválido'}), 400
+    return _alterar_acesso_professor(current_user, professor_id, 'tipo', tipo)
+
+@app.route('/api/professores/<int:professor_id>/revogar-sessoes', methods=['POST'])
+@token_required
+@admin_required
+def revogar_sessoes_professor(current_user, professor_id):
+    """Invalida todos os tokens já emitidos do professor (ele precisa fazer login de novo)"""
+    return _alterar_acesso_professor(current_user, professor_id, 'geracao_token')
+
+@app.route('/api/admin/cache-autenticacao', methods=['GET'])
+@token_required
+@admin_required
+def estatisticas_cache_autenticacao(current_user):
+    return jsonify(cache_autenticacao.estatisticas())
+
+def _cmd_criar_laboratorio(tx, data, capacidade):
+    try:
+        cursor = tx.conn.execute('''
+            INSERT INTO laboratorios (nome, localizacao, capacidade, recursos, status)
+            VALUES (?, ?, ?, ?, 'disponivel')
+        ''', (
+            data['nome'], data['localizacao'], capacidade, 
+            json.dumps(data.get('recursos', []) or [])
+        ))
+    except sqlite3.IntegrityError as e: # Ex. nome do lab único, se definido no DB
+        return {'error': f'Erro de integridade: {e}'}, 409
+    return {'message': 'Laboratório criado com sucesso', 'laboratorio_id': cursor.lastrowid}, 201
 
 @app.route('/api/laboratorios', methods=['POST'])
 @token_required
@@ -525,50 +3176,310 @@ def criar_laboratorio(current_user):
         if capacidade <= 0: raise ValueError("Capacidade deve ser positiva.")
     except (ValueError, TypeError):
         return jsonify({'error': 'Capacidade deve ser um número inteiro positivo.'}), 400
-    conn = get_db_connection()
     try:
-        cursor = conn.execute('''
-            INSERT INTO laboratorios (nome, localizacao, capacidade, recursos, status)
-            VALUES (?, ?, ?, ?, 'disponivel')
-        ''', (
-            data['nome'], data['localizacao'], capacidade, 
-            json.dumps(data.get('recursos', []) or [])
-        ))
-        conn.commit()
-        lab_id = cursor.lastrowid
-        conn.close()
-        return jsonify({'message': 'Laboratório criado com sucesso', 'laboratorio_id': lab_id}), 201
-    except sqlite3.IntegrityError as e: # Ex. nome do lab único, se definido no DB
-        conn.close(); return jsonify({'error': f'Erro de integridade: {e}'}), 409
+        corpo, status_code = executar_escrita(_cmd_criar_laboratorio, data, capacidade)
     except Exception as e:
-        conn.close(); return jsonify({'error': f'Erro interno: {e}'}), 500
+        return jsonify({'error': f'Erro interno: {e}'}), 500
+    cache_laboratorios.invalidar()
+    diretorio_alterado()
+    return jsonify(corpo), status_code
+
+def _cmd_deletar_laboratorio(tx, laboratorio_id):
+    # ON DELETE CASCADE cuidará das reservas
+    cursor = tx.conn.execute('DELETE FROM laboratorios WHERE id = ?', (laboratorio_id,))
+    if cursor.rowcount == 0: return {'error': 'Laboratório não encontrado'}, 404
+    return {'message': 'Laboratório deletado com sucesso'}, 200
 
 @app.route('/api/laboratorios/<int:laboratorio_id>', methods=['DELETE'])
 @token_required
 @admin_required
 def deletar_laboratorio(current_user, laboratorio_id):
-    conn = get_db_connection()
-    # ON DELETE CASCADE cuidará das reservas
-    cursor = conn.execute('DELETE FROM laboratorios WHERE id = ?', (laboratorio_id,))
-    conn.commit()
-    conn.close()
-    if cursor.rowcount == 0: return jsonify({'error': 'Laboratório não encontrado'}), 404
-    return jsonify({'message': 'Laboratório deletado com sucesso'})
+    try:
+        corpo, status_code = executar_escrita(_cmd_deletar_laboratorio, laboratorio_id)
+    except Exception as e:
+        return jsonify({'error': f'Erro interno: {e}'}), 500
+    cache_laboratorios.invalidar()
+    diretorio_alterado()
+    return jsonify(corpo), status_code
 
 @app.route('/api/reservas-admin', methods=['GET'])
 @token_required
 @admin_required
+@resposta_condicional('reservas', 'laboratorios', 'professores')
 def get_all_reservas_admin(current_user):
-    conn = get_db_connection()
-    reservas = conn.execute('''
-        SELECT r.*, l.nome as laboratorio_nome, l.localizacao, p.nome_completo as professor_nome
-        FROM reservas r 
+    consulta = '''
+        SELECT {colunas}, l.nome as laboratorio_nome, l.localizacao, p.nome_completo as professor_nome
+        FROM {tabela} r 
         JOIN laboratorios l ON r.laboratorio_id = l.id
         JOIN professores p ON r.professor_id = p.id
-        ORDER BY r.data DESC, r.horario_inicio DESC
-    ''').fetchall()
-    conn.close()
-    return jsonify([dict(reserva) for reserva in reservas])
+    '''
+    if request.args.get('incluir_arquivo') != '1':
+        return _listar_reservas(consulta.format(colunas=COLUNAS_RESERVA_API, tabela='reservas'), [], [])
+    # Histórico completo, inclusive reservas arquivadas. O arquivamento só roda no banco principal:
+    # nos shards todas as reservas ainda estão em `reservas`
+    anexar_arquivo(get_db_connection())
+    return _listar_reservas(
+        consulta.format(colunas=f'{COLUNAS_RESERVA_API}, r.arquivada', tabela='reservas_com_arquivo'), [], [],
+        query_shards=consulta.format(colunas=f'{COLUNAS_RESERVA_API}, 0 AS arquivada', tabela='reservas'))
+
+LIMITE_PADRAO_BUSCA = 20
+LIMITE_MAX_BUSCA = 100
+MAX_TERMOS_BUSCA = 10
+# Pesos do bm25 por coluna do índice: disciplina, turma, descrição, professor (professor_id não é indexado)
+PESOS_BUSCA = (10.0, 5.0, 1.0, 3.0, 0.0)
+
+def consulta_fts(texto):
+    """Texto livre -> consulta FTS5: cada palavra entre aspas (sem operadores), todas obrigatórias, com prefixo"""
+    termos = texto.split()[:MAX_TERMOS_BUSCA]
+    return ' '.join('"' + termo.replace('"', '""') + '"*' for termo in termos)
+
+@app.route('/api/reservas/busca', methods=['GET'])
+@token_required
+@admin_required
+@resposta_condicional('reservas', 'laboratorios', 'professores')
+def buscar_reservas(current_user):
+    """Busca por disciplina, turma, descrição ou professor, ordenada por relevância (bm25).
+
+    Paginação por offset (a ordem é a da relevância, não há chave estável para cursor):
+    X-Total-Resultados traz o total e X-Proximo-Offset, se houver, o offset da próxima página.
+    Com shards, cada banco devolve as offset + limit primeiras e os totais são somados; o bm25 de
+    cada banco usa as estatísticas do próprio índice, então a intercalação é aproximada.
+    """
+    args = request.args
+    consulta = consulta_fts(args.get('q', ''))
+    if not consulta:
+        return jsonify({'error': 'Informe o texto da busca em q.'}), 400
+    limite = max(1, min(args.get('limit', LIMITE_PADRAO_BUSCA, type=int), LIMITE_MAX_BUSCA))
+    offset = max(0, args.get('offset', 0, type=int))
+
+    incluir_arquivo = args.get('incluir_arquivo') == '1'
+    if incluir_arquivo:
+        anexar_arquivo(get_db_connection()) # Só o principal tem arquivo (ver get_all_reservas_admin)
+    condicoes, params = ['reservas_busca MATCH ?'], [consulta]
+    if args.get('laboratorio_id', type=int) is not None:
+        condicoes.append('r.laboratorio_id = ?'); params.append(args.get('laboratorio_id', type=int))
+    if args.get('status'):
+        condicoes.append('r.status = ?'); params.append(args['status'])
+    if args.get('data_inicio'):
+        condicoes.append('r.data >= ?'); params.append(args['data_inicio'])
+    if args.get('data_fim'):
+        condicoes.append('r.data <= ?'); params.append(args['data_fim'])
+    # Sem shards, o OFFSET fica no SQL; com shards, cada banco devolve desde o início e o corte é feito aqui
+    limite_banco, offset_banco = (offset + limite, 0) if shards_ativos() else (limite, offset)
+
+    def buscar(conn, shard):
+        tabela, colunas = 'reservas', COLUNAS_RESERVA_API
+        if incluir_arquivo:
+            tabela, colunas = ('reservas', f'{COLUNAS_RESERVA_API}, 0 AS arquivada') if shard else \
+                              ('reservas_com_arquivo', f'{COLUNAS_RESERVA_API}, r.arquivada')
+        base = f'''
+            FROM reservas_busca
+            JOIN {tabela} r ON r.id = reservas_busca.rowid
+            JOIN laboratorios l ON r.laboratorio_id = l.id
+            JOIN professores p ON r.professor_id = p.id
+            WHERE {' AND '.join(condicoes)}
+        '''
+        total = conn.execute(f'SELECT COUNT(*) {base}', params).fetchone()[0]
+        rows = conn.execute(f'''
+            SELECT {colunas}, l.nome as laboratorio_nome, l.localizacao, p.nome_completo as professor_nome,
+                   bm25(reservas_busca, {', '.join(map(str, PESOS_BUSCA))}) AS relevancia,
+                   snippet(reservas_busca, -1, '[', ']', '…', 12) AS trecho
+            {base}
+            ORDER BY relevancia, r.data DESC, r.id DESC
+            LIMIT ? OFFSET ?
+        ''', params + [limite_banco, offset_banco]).fetchall()
+        return total, rows
+
+    try:
+        resultados = consultar_bancos(buscar)
+    except sqlite3.OperationalError as e:
+        return jsonify({'error': f'Busca inválida: {e}'}), 400
+    total = sum(total_banco for total_banco, _ in resultados)
+    rows = [row for _, rows_banco in resultados for row in rows_banco]
+    if len(resultados) > 1: # Mesma ordem do ORDER BY, com ordenações estáveis da última chave para a primeira
+        rows.sort(key=lambda row: row['id'], reverse=True)
+        rows.sort(key=lambda row: row['data'], reverse=True)
+        rows.sort(key=lambda row: row['relevancia'])
+        rows = rows[offset:offset + limite]
+
+    response = jsonify([dict(row) for row in rows])
+    response.headers['X-Total-Resultados'] = str(total)
+    if offset + limite < total:
+        response.headers['X-Proximo-Offset'] = str(offset + limite)
+    return response
+
+# Período do relatório -> (expressão SQL sobre ocupacao_diaria.data, mesma chave calculada em Python)
+PERIODOS_RELATORIO = {
+    'dia': ('data', lambda dia: dia.isoformat()),
+    'semana': ("strftime('%Y-W%W', data)", lambda dia: dia.strftime('%Y-W%W')),
+    'mes': ("strftime('%Y-%m', data)", lambda dia: dia.strftime('%Y-%m')),
+    'semestre': ("strftime('%Y', data) || '.' || ((CAST(strftime('%m', data) AS INTEGER) > 6) + 1)",
+                 lambda dia: f'{dia.year}.{1 if dia.month <= 6 else 2}'),
+}
+COLUNAS_RELATORIO_OCUPACAO = [
+    'laboratorio_id', 'laboratorio_nome', 'periodo', 'departamento', 'status',
+    'reservas', 'horas_reservadas', 'horas_abertas', 'taxa_ocupacao',
+]
+MAX_DIAS_RELATORIO = 3660
+
+def _relatorio_ocupacao(args):
+    """Linhas do relatório de utilização, lidas só de ocupacao_diaria. ValueError se os filtros forem inválidos.
+
+    horas_abertas conta os dias de funcionamento do período (dentro de data_inicio..data_fim)
+    vezes a janela HORARIO_ABERTURA..HORARIO_FECHAMENTO. Com shards, as linhas de cada banco com a
+    mesma chave são somadas (o mesmo laboratório pode ter reservas no principal e no campus).
+    """
+    periodo = args.get('periodo', 'mes')
+    if periodo not in PERIODOS_RELATORIO:
+        raise ValueError(f"periodo deve ser um de: {', '.join(PERIODOS_RELATORIO)}")
+    try:
+        data_inicio = datetime.date.fromisoformat(args.get('data_inicio', ''))
+        data_fim = datetime.date.fromisoformat(args.get('data_fim', ''))
+    except ValueError:
+        raise ValueError('data_inicio/data_fim devem estar no formato AAAA-MM-DD')
+    if data_fim < data_inicio or (data_fim - data_inicio).days >= MAX_DIAS_RELATORIO:
+        raise ValueError(f'O período deve ter entre 1 e {MAX_DIAS_RELATORIO} dias')
+    expressao, chave_periodo = PERIODOS_RELATORIO[periodo]
+
+    minutos_por_dia = minutos_do_dia(app.config['HORARIO_FECHAMENTO']) - minutos_do_dia(app.config['HORARIO_ABERTURA'])
+    minutos_abertos = {}
+    for n in range((data_fim - data_inicio).days + 1):
+        dia = data_inicio + datetime.timedelta(days=n)
+        if dia.weekday() in app.config['DIAS_FUNCIONAMENTO']:
+            minutos_abertos[chave_periodo(dia)] = minutos_abertos.get(chave_periodo(dia), 0) + minutos_por_dia
+
+    condicoes, params = ['data >= ?', 'data <= ?'], [data_inicio.isoformat(), data_fim.isoformat()]
+    laboratorio_ids = args.getlist('laboratorio_id', type=int)
+    if laboratorio_ids:
+        condicoes.append(f"laboratorio_id IN ({', '.join('?' * len(laboratorio_ids))})"); params += laboratorio_ids
+    for filtro in ('departamento', 'status'):
+        if args.get(filtro):
+            condicoes.append(f'{filtro} = ?'); params.append(args[filtro])
+
+    nomes = {row['id']: row['nome'] for row in get_db_connection().execute('SELECT id, nome FROM laboratorios')}
+    cursores = consultar_bancos(lambda conn, shard: conn.execute(f'''
+        SELECT laboratorio_id, {expressao} AS periodo, departamento, status,
+               SUM(reservas) AS reservas, SUM(minutos) AS minutos
+        FROM ocupacao_diaria WHERE {' AND '.join(condicoes)}
+        GROUP BY laboratorio_id, periodo, departamento, status
+        ORDER BY laboratorio_id, periodo, departamento, status
+    ''', params))
+    if len(cursores) == 1:
+        cursor = cursores[0] # Lido conforme a resposta é escrita
+    else:
+        somas = {}
+        for row in (row for cursor_banco in cursores for row in cursor_banco):
+            chave = (row['laboratorio_id'], row['periodo'], row['departamento'], row['status'])
+            reservas, minutos = somas.get(chave, (0, 0))
+            somas[chave] = (reservas + row['reservas'], minutos + row['minutos'])
+        # Mesma ordem do ORDER BY, com NULL (departamento) antes dos demais valores
+        cursor = [dict(zip(('laboratorio_id', 'periodo', 'departamento', 'status', 'reservas', 'minutos'), chave + soma))
+                  for chave, soma in sorted(somas.items(), key=lambda item: [(v is not None, v or 0) for v in item[0]])]
+
+    def linhas():
+        for row in cursor:
+            abertos = minutos_abertos.get(row['periodo'], 0)
+            yield {
+                'laboratorio_id': row['laboratorio_id'], 'laboratorio_nome': nomes.get(row['laboratorio_id']),
+                'periodo': row['periodo'], 'departamento': row['departamento'], 'status': row['status'],
+                'reservas': row['reservas'], 'horas_reservadas': round(row['minutos'] / 60, 2),
+                'horas_abertas': round(abertos / 60, 2),
+                'taxa_ocupacao': round(row['minutos'] / abertos, 4) if abertos else None,
+            }
+    return linhas()
+
+@app.route('/api/relatorios/ocupacao', methods=['GET'])
+@token_required
+@admin_required
+def relatorio_ocupacao(current_user):
+    try:
+        return jsonify(list(_relatorio_ocupacao(request.args)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/relatorios/ocupacao.csv', methods=['GET'])
+@token_required
+@admin_required
+def relatorio_ocupacao_csv(current_user):
+    """Mesmo relatório em CSV, escrito linha a linha conforme sai do banco"""
+    try:
+        linhas = _relatorio_ocupacao(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def gerar():
+        buffer = io.StringIO()
+        escritor = csv.DictWriter(buffer, fieldnames=COLUNAS_RELATORIO_OCUPACAO)
+        escritor.writeheader()
+        for linha in linhas:
+            escritor.writerow(linha)
+            yield buffer.getvalue()
+            buffer.seek(0); buffer.truncate()
+        yield buffer.getvalue()
+
+    nome_arquivo = f"ocupacao_{request.args.get('periodo', 'mes')}_{request.args['data_inicio']}_{request.args['data_fim']}.csv"
+    return Response(stream_with_context(gerar()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={nome_arquivo}'})
+
+@app.route('/api/metrics', methods=['GET'])
+@token_required
+@admin_required
+def get_metrics(current_user):
+    return Response(metricas.prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/admin/pool', methods=['GET'])
+@token_required
+@admin_required
+def estatisticas_pool(current_user):
+    return jsonify(pool.estatisticas())
+
+@app.route('/api/admin/cache-http', methods=['GET'])
+@token_required
+@admin_required
+def estatisticas_cache_http(current_user):
+    """Taxa de respostas 304 (e de gzip) por rota com GET condicional"""
+    return jsonify(metricas.condicionais())
+
+@app.route('/api/admin/perfis', methods=['GET'])
+@token_required
+@admin_required
+def listar_perfis(current_user):
+    """Perfis guardados pelo PerfilamentoWSGI (vazio se PERFIL_REQUISICOES/PERFIL_AMOSTRAGEM estiverem desligados)"""
+    return jsonify({
+        'ativo': isinstance(app.wsgi_app, PerfilamentoWSGI),
+        'amostragem': app.config['PERFIL_AMOSTRAGEM'],
+        'perfis': perfis.listar(),
+    })
+
+@app.route('/api/admin/perfis/<int:perfil_id>', methods=['GET'])
+@token_required
+@admin_required
+def baixar_perfil(current_user, perfil_id):
+    """?formato=texto: resumo por tempo acumulado; padrão: arquivo .prof (pstats/snakeviz)"""
+    perfil = perfis.obter(perfil_id)
+    if perfil is None:
+        return jsonify({'error': 'Perfil não encontrado (o buffer guarda só os mais recentes)'}), 404
+    if request.args.get('formato') == 'texto':
+        cabecalho = f"{perfil['metodo']} {perfil['caminho']} -> {perfil.get('status')} em {perfil['duracao_ms']} ms ({perfil['motivo']})\n"
+        return Response(cabecalho + perfil['texto'], mimetype='text/plain')
+    response = Response(marshal.dumps(perfil['estatisticas']), mimetype='application/octet-stream')
+    response.headers['Content-Disposition'] = f'attachment; filename=perfil-{perfil_id}.prof'
+    return response
+
+MAX_RESERVAS_LOTE_STATUS = 5000
+STATUS_RESERVA = ['confirmada', 'pendente', 'cancelada']
+
+def _cmd_atualizar_status(tx, reserva_id, new_status):
+    reserva = tx.conn.execute(
+        'SELECT laboratorio_id, data, horario_inicio, horario_fim, status FROM reservas WHERE id = ?', (reserva_id,)
+    ).fetchone()
+    if reserva is None: return {'error': 'Reserva não encontrada'}, 404
+    # Reativar uma cancelada volta a ocupar o horário: mesma checagem do status em lote
+    if reserva['status'] == 'cancelada' and new_status != 'cancelada' and tx.contar_conflitos(
+            reserva['laboratorio_id'], reserva['data'], reserva['horario_inicio'], reserva['horario_fim'], ignorar_id=reserva_id):
+        return {'error': 'Horário não disponível, conflito com outra reserva.'}, 409
+    tx.conn.execute('UPDATE reservas SET status = ? WHERE id = ?', (new_status, reserva_id))
+    return {'message': f'Status da reserva atualizado para {new_status}'}, 200
 
 @app.route('/api/reservas/<int:reserva_id>/status', methods=['PUT'])
 @token_required
@@ -576,14 +3487,332 @@ def get_all_reservas_admin(current_user):
 def update_reserva_status(current_user, reserva_id):
     data = request.get_json()
     new_status = data.get('status')
-    if new_status not in ['confirmada', 'pendente', 'cancelada']:
+    if new_status not in STATUS_RESERVA:
         return jsonify({'error': 'Status inválido'}), 400
-    conn = get_db_connection()
-    cursor = conn.execute('UPDATE reservas SET status = ? WHERE id = ?', (new_status, reserva_id))
-    conn.commit()
+    try:
+        corpo, status_code = executar_escrita(_cmd_atualizar_status, reserva_id, new_status,
+                                              shard=localizar_reserva(reserva_id))
+    except Exception as e:
+        return jsonify({'error': f'Erro ao atualizar status: {str(e)}'}), 500
+    return jsonify(corpo), status_code
+
+def _condicoes_filtro_lote(filtro):
+    condicoes, params = [], []
+    for campo, condicao in (('laboratorio_id', 'laboratorio_id = ?'), ('professor_id', 'professor_id = ?'),
+                            ('status_atual', 'status = ?'), ('data_inicio', f"dia >= {_sql_dia('?')}"),
+                            ('data_fim', f"dia <= {_sql_dia('?')}")):
+        if filtro.get(campo) not in (None, ''):
+            condicoes.append(condicao); params.append(filtro[campo])
+    return condicoes, params
+
+def _cmd_status_em_lote(tx, novo_status, ids, filtro):
+    """Aplica novo_status às reservas de `ids` ou do `filtro` numa única transação; resultado por reserva.
+
+    Mudanças que não reativam reservas saem num único UPDATE. Reativar uma reserva cancelada
+    pode gerar conflito, então essas são verificadas (e gravadas) uma a uma, em ordem de horário.
+    """
+    colunas = 'SELECT id, laboratorio_id, data, horario_inicio, horario_fim, status FROM reservas'
+    if ids is not None:
+        rows = tx.conn.execute(f'{colunas} WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(ids),)).fetchall()
+    else:
+        condicoes, params = _condicoes_filtro_lote(filtro)
+        rows = tx.conn.execute(
+            f"{colunas} WHERE {' AND '.join(condicoes)} ORDER BY dia, inicio_min, id LIMIT ?",
+            params + [MAX_RESERVAS_LOTE_STATUS + 1]
+        ).fetchall()
+    if len(rows) > MAX_RESERVAS_LOTE_STATUS:
+        return {'error': f'O filtro seleciona mais de {MAX_RESERVAS_LOTE_STATUS} reservas; restrinja o período ou o laboratório.'}, 400
+
+    encontradas = {row['id'] for row in rows}
+    resultados = {reserva_id: 'nao_encontrada' for reserva_id in (ids or []) if reserva_id not in encontradas}
+    diretas, reativacoes = [], []
+    for row in rows:
+        if row['status'] == novo_status:
+            resultados[row['id']] = 'inalterada'
+        elif row['status'] == 'cancelada':
+            reativacoes.append(row)
+        else:
+            diretas.append(row)
+
+    if diretas:
+        tx.conn.execute('UPDATE reservas SET status = ? WHERE id IN (SELECT value FROM json_each(?))',
+                        (novo_status, json.dumps([row['id'] for row in diretas])))
+        for row in diretas:
+            resultados[row['id']] = 'atualizada'
+    for row in sorted(reativacoes, key=lambda r: (str(r['data']), str(r['horario_inicio']), r['id'])):
+        if tx.contar_conflitos(row['laboratorio_id'], row['data'], row['horario_inicio'], row['horario_fim'], ignorar_id=row['id']):
+            resultados[row['id']] = 'conflito'
+            continue
+        tx.conn.execute('UPDATE reservas SET status = ? WHERE id = ?', (novo_status, row['id']))
+        resultados[row['id']] = 'atualizada'
+
+    anteriores = {row['id']: row['status'] for row in rows}
+    atualizadas = sum(1 for resultado in resultados.values() if resultado == 'atualizada')
+    return {
+        'message': f'{atualizadas} de {len(resultados)} reservas atualizadas para {novo_status}',
+        'atualizadas': atualizadas,
+        'resultados': [{'id': reserva_id, 'resultado': resultados[reserva_id], 'status_anterior': anteriores.get(reserva_id)}
+                       for reserva_id in (ids if ids is not None else [row['id'] for row in rows])],
+    }, 200
+
+def _status_em_lote_nos_shards(novo_status, ids, filtro):
+    """_cmd_status_em_lote em cada banco envolvido, um após o outro, cada um na sua transação (o lote
+    não é atômico entre campus). Os ids são separados pelo banco onde estão; o filtro vai a todos os
+    bancos (ou só ao do laboratório filtrado), depois de conferir que o total cabe no limite."""
+    if ids is not None:
+        por_banco = {}
+        for reserva_id in ids:
+            por_banco.setdefault(localizar_reserva(reserva_id), []).append(reserva_id)
+    else:
+        condicoes, params = _condicoes_filtro_lote(filtro)
+        if filtro.get('laboratorio_id') not in (None, ''):
+            bancos = [shard_do_laboratorio(filtro['laboratorio_id'])]
+        else:
+            contagens = consultar_bancos(lambda conn, shard: conn.execute(
+                f"SELECT COUNT(*) FROM (SELECT 1 FROM reservas WHERE {' AND '.join(condicoes)} LIMIT ?)",
+                params + [MAX_RESERVAS_LOTE_STATUS + 1]).fetchone()[0])
+            if sum(contagens) > MAX_RESERVAS_LOTE_STATUS:
+                return {'error': f'O filtro seleciona mais de {MAX_RESERVAS_LOTE_STATUS} reservas; restrinja o período ou o laboratório.'}, 400
+            bancos = [banco for banco, contagem in zip([None] + list(mapa_shards()), contagens) if contagem]
+        por_banco = {banco: None for banco in bancos}
+
+    resultados = {}
+    for banco, ids_banco in por_banco.items():
+        corpo, status_code = executar_escrita(_cmd_status_em_lote, novo_status, ids_banco, filtro, shard=banco)
+        if status_code != 200:
+            return corpo, status_code
+        for resultado in corpo['resultados']:
+            resultados[resultado['id']] = resultado
+    ordem = ids if ids is not None else list(resultados)
+    atualizadas = sum(1 for resultado in resultados.values() if resultado['resultado'] == 'atualizada')
+    return {
+        'message': f'{atualizadas} de {len(ordem)} reservas atualizadas para {novo_status}',
+        'atualizadas': atualizadas,
+        'resultados': [resultados[reserva_id] for reserva_id in ordem],
+    }, 200
+
+@app.route('/api/reservas/status-em-lote', methods=['PUT'])
+@token_required
+@admin_required
+def update_reservas_status_em_lote(current_user):
+    """Muda o status (ou cancela) de várias reservas de uma vez: por `ids` ou por `filtro`
+    (laboratorio_id, professor_id, status_atual, data_inicio, data_fim)"""
+    data = request.get_json() or {}
+    novo_status = data.get('status')
+    if novo_status not in STATUS_RESERVA:
+        return jsonify({'error': 'Status inválido'}), 400
+    ids, filtro = data.get('ids'), data.get('filtro')
+    if (ids is None) == (filtro is None):
+        return jsonify({'error': 'Informe `ids` ou `filtro` (um dos dois).'}), 400
+    if ids is not None:
+        if not isinstance(ids, list) or not ids or not all(isinstance(i, int) for i in ids):
+            return jsonify({'error': '`ids` deve ser uma lista de ids de reserva.'}), 400
+        if len(ids) > MAX_RESERVAS_LOTE_STATUS:
+            return jsonify({'error': f'No máximo {MAX_RESERVAS_LOTE_STATUS} reservas por requisição.'}), 400
+        ids = list(dict.fromkeys(ids))
+    elif not isinstance(filtro, dict) or not any(filtro.get(campo) not in (None, '') for campo in
+                                                 ['laboratorio_id', 'professor_id', 'status_atual', 'data_inicio', 'data_fim']):
+        return jsonify({'error': 'O filtro precisa de pelo menos um critério.'}), 400
+    try:
+        if shards_ativos():
+            corpo, status_code = _status_em_lote_nos_shards(novo_status, ids, filtro)
+        else:
+            corpo, status_code = executar_escrita(_cmd_status_em_lote, novo_status, ids, filtro)
+    except Exception as e:
+        return jsonify({'error': f'Erro ao atualizar reservas: {str(e)}'}), 500
+    return jsonify(corpo), status_code
+
+@app.cli.command('migrar')
+def comando_migrar():
+    """Aplica as migrações pendentes do banco: flask --app app migrar"""
+    init_database()
+
+@app.cli.command('reconstruir-contadores')
+def comando_reconstruir_contadores():
+    """Recalcula os contadores do dashboard: flask --app app reconstruir-contadores"""
+    conn = _nova_conexao()
+    anexar_arquivo(conn, criar=False)
+    with conn:
+        reconstruir_contadores(conn)
+    conn.close()
+    print("✅ Contadores de reservas por professor recalculados.")
+
+@app.cli.command('reconstruir-ocupacao')
+def comando_reconstruir_ocupacao():
+    """Recalcula a ocupação diária usada nos relatórios: flask --app app reconstruir-ocupacao"""
+    conn = _nova_conexao()
+    anexar_arquivo(conn, criar=False)
+    with conn:
+        reconstruir_ocupacao(conn)
     conn.close()
-    if cursor.rowcount == 0: return jsonify({'error': 'Reserva não encontrada'}), 404
-    return jsonify({'message': f'Status da reserva atualizado para {new_status}'})
+    print("✅ Ocupação diária dos laboratórios recalculada.")
+
+@app.cli.command('reconstruir-busca')
+def comando_reconstruir_busca():
+    """Recria o índice de busca textual das reservas: flask --app app reconstruir-busca"""
+    conn = _nova_conexao()
+    anexar_arquivo(conn, criar=False)
+    with conn:
+        reconstruir_busca(conn)
+    conn.close()
+    print("✅ Índice de busca das reservas recriado.")
+
+@app.cli.command('arquivar')
+@click.option('--dias', type=int, default=None, help='Arquiva reservas com mais de DIAS dias (padrão: ARQUIVO_CORTE_DIAS)')
+@click.option('--lote', type=int, default=None, help='Reservas por transação (padrão: ARQUIVO_LOTE)')
+def comando_arquivar(dias, lote):
+    """Move reservas antigas para o banco de arquivo: flask --app app arquivar [--dias 180]"""
+    corte = data_corte_arquivo(dias)
+    conn = _nova_conexao()
+    try:
+        movidas = arquivar_reservas(conn, corte, lote)
+    finally:
+        conn.close()
+    print(f"✅ {movidas} reservas anteriores a {corte} movidas para {caminho_arquivo()}.")
+
+@app.cli.command('distribuir-shards')
+@click.option('--lote', type=int, default=None, help='Reservas por transação (padrão: ARQUIVO_LOTE)')
+def comando_distribuir_shards(lote):
+    """Move as reservas dos laboratórios de cada campus em SHARDS para o banco do campus"""
+    if not shards_ativos():
+        raise click.ClickException('SHARDS não configurado (ex.: SHARDS="natal:1,2;mossoro:3").')
+    preparar_shards()
+    conn = _nova_conexao()
+    try:
+        for nome in mapa_shards():
+            movidas = mover_para_shard(conn, nome, lote)
+            print(f"✅ {movidas} reservas movidas para {caminho_shard(nome)}.")
+    finally:
+        conn.close()
+
+def _requisicoes_verificacao_planos(cliente):
+    """Percorre as rotas que leem/gravam reservas, com e sem filtros, como professor e como admin"""
+    def entrar(matricula, senha):
+        token = cliente.post('/api/login', json={'matricula': matricula, 'senha': senha}).get_json()['token']
+        return {'Authorization': f'Bearer {token}'}
+    prof, admin = entrar('123456', '123456'), entrar('999999', 'admin123')
+    hoje = datetime.date.today()
+    amanha, fim_mes = (hoje + datetime.timedelta(days=1)).isoformat(), (hoje + datetime.timedelta(days=30)).isoformat()
+    periodo = f'data_inicio={hoje.isoformat()}&data_fim={fim_mes}'
+    reserva = {'laboratorio_id': 1, 'data': amanha, 'horario_inicio': '08:00', 'horario_fim': '09:00',
+               'disciplina': 'Cálculo I', 'turma': 'T1', 'descricao_atividade': 'Aula prática'}
+    respostas = [
+        cliente.post('/api/verificar-disponibilidade', json=reserva, headers=prof),
+        cliente.post('/api/reservas', json=reserva, headers=prof),
+        cliente.post('/api/reservas/recorrentes', headers=prof, json=dict(
+            reserva, horario_inicio='10:00', horario_fim='11:00',
+            recorrencia={'dia_semana': 1, 'data_inicio': amanha, 'data_fim': fim_mes})),
+        # Mais uma no mesmo dia: reativá-las em lote passa pela contagem de conflitos no SQL
+        cliente.post('/api/reservas/recorrentes', headers=prof, json=dict(
+            reserva, horario_inicio='14:00', horario_fim='15:00', ocorrencias=[{'data': amanha}])),
+    ]
+    reserva_id = respostas[1].get_json()['reserva_id']
+    respostas += [
+        cliente.put(f'/api/reservas/{reserva_id}', json=dict(reserva, horario_fim='09:30'), headers=prof),
+        cliente.get(f'/api/reservas/{reserva_id}', headers=prof),
+        cliente.get('/api/dashboard', headers=prof),
+        cliente.get('/api/minhas-reservas?limit=5', headers=prof),
+        cliente.get(f'/api/minhas-reservas?status=confirmada&laboratorio_id=1&{periodo}', headers=prof),
+        cliente.get(f'/api/reservas-calendario?start={hoje.isoformat()}&end={fim_mes}', headers=prof),
+        cliente.get(f'/api/reservas-calendario?start={hoje.isoformat()}&end={fim_mes}&laboratorio_id=1', headers=prof),
+        cliente.get('/api/reservas/alteracoes?desde=0&laboratorio_id=1', headers=prof),
+        cliente.get(f'/api/horarios-livres?duracao=60&{periodo}', headers=prof),
+        cliente.get(f'/api/horarios-livres?duracao=60&{periodo}&laboratorio_id=1', headers=prof),
+        cliente.put(f'/api/reservas/{reserva_id}/cancelar', headers=prof),
+    ]
+    for feed in ({'tipo': 'laboratorio', 'alvo_id': 1}, {'tipo': 'professor'}):
+        criado = cliente.post('/api/feeds', json=feed, headers=prof)
+        respostas += [criado, cliente.get(f"/api/calendario/{criado.get_json()['token']}.ics")]
+    respostas += [
+        cliente.get('/api/reservas-admin?limit=10', headers=admin),
+        cliente.get(f'/api/reservas-admin?status=cancelada&{periodo}', headers=admin),
+        cliente.get('/api/reservas/busca?q=calc&laboratorio_id=1', headers=admin),
+        cliente.get(f'/api/relatorios/ocupacao?periodo=mes&{periodo}', headers=admin),
+        cliente.put(f'/api/reservas/{reserva_id}/status', json={'status': 'confirmada'}, headers=admin),
+        cliente.put('/api/reservas/status-em-lote', headers=admin,
+                    json={'status': 'pendente', 'filtro': {'status_atual': 'confirmada', 'data_inicio': amanha, 'data_fim': fim_mes}}),
+        cliente.put('/api/reservas/status-em-lote', headers=admin,
+                    json={'status': 'cancelada', 'filtro': {'laboratorio_id': 1, 'data_inicio': amanha}}),
+        cliente.put('/api/reservas/status-em-lote', headers=admin,
+                    json={'status': 'confirmada', 'filtro': {'professor_id': 2, 'status_atual': 'cancelada'}}),
+    ]
+    return [r for r in respostas if r.status_code >= 500]
+
+def _varre_reservas(detalhe):
+    # 'SCAN r' / 'SCAN reservas' sem USING = leitura da tabela inteira
+    partes = detalhe.split()
+    return len(partes) >= 2 and partes[0] == 'SCAN' and partes[1] in ('r', 'reservas') and 'USING' not in partes
+
+def planos_das_rotas(cliente):
+    """Roda _requisicoes_verificacao_planos no banco configurado e devolve (planos, erros).
+
+    `planos` tem um (sql, detalhes do EXPLAIN QUERY PLAN) por consulta distinta sobre reservas;
+    `erros` são as respostas 5xx. Usado pelo verificar-planos e pelos testes, com as mesmas rotas.
+    """
+    comandos = []
+    conn = pool.obter()
+    conn.set_trace_callback(comandos.append) # Mesma conexão (reaproveitada pelo pool) em todas as requisições
+    pool.devolver(conn)
+    try:
+        erros = _requisicoes_verificacao_planos(cliente)
+    finally:
+        conn.set_trace_callback(None)
+
+    conn = _nova_conexao()
+    try:
+        vistos, planos = set(), []
+        for sql in comandos:
+            sql = sql.strip()
+            forma = re.sub(r"'[^']*'|\b\d+\b", '?', sql) # A mesma consulta com outros valores conta uma vez
+            if forma in vistos or not re.match(r'(SELECT|WITH|UPDATE|DELETE)\b', sql) or not re.search(r'\breservas\b', sql):
+                continue
+            vistos.add(forma)
+            planos.append((sql, [row['detail'] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]))
+    finally:
+        conn.close()
+    return planos, erros
+
+@app.cli.command('verificar-planos')
+def comando_verificar_planos():
+    """Confere com EXPLAIN QUERY PLAN que nenhuma consulta das rotas varre reservas: flask --app app verificar-planos
+
+    Roda as rotas num banco temporário (o banco configurado não é tocado), registra cada comando
+    SQL executado e termina com código 1 se algum deles ler a tabela reservas inteira.
+    """
+    global DATABASE
+    banco_original, diretorio = DATABASE, tempfile.mkdtemp(prefix='planos_agendamento_')
+    DATABASE = os.path.join(diretorio, 'agendamento.db')
+    pool.limpar()
+    try:
+        init_database()
+        planos, erros = planos_das_rotas(app.test_client())
+        falhas = 0
+        for sql, detalhes in planos:
+            resumo = ' '.join(sql.split())[:110]
+            if any(_varre_reservas(detalhe) for detalhe in detalhes):
+                falhas += 1
+                print(f"❌ {resumo}")
+                for detalhe in detalhes:
+                    print(f"     {detalhe}")
+            else:
+                indices = sorted({m for d in detalhes for m in re.findall(r'USING (?:COVERING )?INDEX (\w+)', d)}
+                                 | {'rowid' for d in detalhes if 'PRIMARY KEY' in d}
+                                 | {'virtual' for d in detalhes if 'VIRTUAL TABLE' in d})
+                print(f"✅ {resumo}\n     {', '.join(indices)}")
+    finally:
+        # As requisições do test client reaproveitam o contexto do comando (e a conexão em g)
+        conn = g.pop('db', None)
+        if conn is not None:
+            conn.close()
+        pool.limpar()
+        DATABASE = banco_original
+        shutil.rmtree(diretorio, ignore_errors=True)
+    for resposta in erros:
+        print(f"❌ {resposta.request.method} {resposta.request.path}: {resposta.status_code} {resposta.get_data(as_text=True)[:200]}")
+    print(f"\n{len(planos)} consultas verificadas, {falhas} varrendo a tabela reservas.")
+    if falhas or erros:
+        raise SystemExit(1)
+
 
 if __name__ == '__main__':
     print("🚀 Inicializando Sistema de Agendamento - UERN")
@@ -591,6 +3820,7 @@ if __name__ == '__main__':
     print("📊 Inicializando banco de dados...")
     init_database() # Chama a função ajustada
     print("✅ Banco de dados inicializado!")
+    iniciar_arquivamento_agendado()
     print("\n🔐 Credenciais de teste:")
     print("👤 Professor: Matrícula: 123456, Senha: 123456")
     print("👑 Admin: Matrícula: 999999, Senha: admin123")
@@ -0,0 +1,284 @@
+# benchmark.py
+# Execute: python benchmark.py            (Flask test client, banco sintético em diretório temporário)
+#          python benchmark.py --servidor  (mesmo teste, mas via HTTP contra um servidor local)
+#          python benchmark.py --escritor  (escritas pela thread escritora, ESCRITOR_RESERVAS=1)
+#
+# Gera um agendamento.db sintético (laboratórios, professores e anos de reservas), dispara as rotas
+# reais do app.py com vários workers simultâneos e mostra vazão e latência p50/p95/p99 por endpoint.
+# No fim, verifica se reservas simultâneas para o mesmo horário geraram dupla reserva.
+
+import argparse
+import datetime
+import http.client
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app as aplicacao
+
+SENHA_PADRAO = 'bench123'
+HORARIOS = [('07:00', '08:40'), ('08:50', '10:30'), ('10:40', '12:20'), ('13:00', '14:40'),
+            ('14:50', '16:30'), ('16:40', '18:20'), ('18:30', '20:10'), ('20:20', '22:00')]
+
+
+def popular_banco(conn, laboratorios, professores, anos, ocupacao, semente):
+    """Insere dados sintéticos; retorna (ids dos laboratórios, matrículas dos professores)"""
+    rng = random.Random(semente)
+    senha_hash = aplicacao.hash_senha(SENHA_PADRAO) # Um hash só: o custo do bcrypt não interessa aqui
+    departamentos = ['Ciência da Computação', 'Matemática', 'Física', 'Letras', 'Administração']
+
+    conn.executemany(
+        "INSERT INTO laboratorios (nome, localizacao, capacidade, recursos, status) VALUES (?, ?, ?, '[]', 'disponivel')",
+        [(f'Lab Bench {i}', f'Bloco {i % 5} - Sala {100 + i}', 20 + i % 20) for i in range(laboratorios)]
+    )
+    conn.executemany(
+        '''INSERT INTO professores (nome_completo, matricula, email, departamento, senha_hash, status, tipo)
+           VALUES (?, ?, ?, ?, ?, 'ativo', 'professor')''',
+        [(f'Professor Bench {i}', f'B{i:06d}', f'bench{i}@uern.br', rng.choice(departamentos), senha_hash)
+         for i in range(professores)]
+    )
+    lab_ids = [row[0] for row in conn.execute("SELECT id FROM laboratorios WHERE nome LIKE 'Lab Bench %'")]
+    prof_ids = [row[0] for row in conn.execute("SELECT id FROM professores WHERE matricula LIKE 'B%'")]
+
+    hoje = datetime.date.today()
+    dia = hoje - datetime.timedelta(days=365 * anos)
+    fim = hoje + datetime.timedelta(days=120)
+    lote = []
+    total = 0
+    while dia <= fim:
+        if dia.weekday() < 6:
+            for lab_id in lab_ids:
+                for inicio, termino in HORARIOS:
+                    if rng.random() < ocupacao:
+                        status = rng.choices(['confirmada', 'pendente', 'cancelada'], [85, 5, 10])[0]
+                        lote.append((rng.choice(prof_ids), lab_id, dia.isoformat(), inicio, termino,
+                                     f'Disciplina {rng.randrange(60)}', f'T{rng.randrange(9)}', 'Aula', status))
+        if len(lote) >= 5000:
+            conn.executemany('''INSERT INTO reservas (professor_id, laboratorio_id, data, horario_inicio, horario_fim,
+                                disciplina, turma, descricao_atividade, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', lote)
+            total += len(lote)
+            lote = []
+        dia += datetime.timedelta(days=1)
+    conn.executemany('''INSERT INTO reservas (professor_id, laboratorio_id, data, horario_inicio, horario_fim,
+                        disciplina, turma, descricao_atividade, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', lote)
+    total += len(lote)
+    conn.commit()
+    print(f"📦 Banco sintético: {laboratorios} laboratórios, {professores} professores, {total} reservas")
+    return lab_ids, [f'B{i:06d}' for i in range(professores)]
+
+
+class ClienteTeste:
+    """Requisições pelo Flask test client (sem rede)"""
+
+    def __init__(self):
+        self._client = aplicacao.app.test_client()
+
+    def requisitar(self, metodo, caminho, corpo=None, headers=None):
+        response = self._client.open(caminho, method=metodo, json=corpo, headers=headers or {})
+        return response.status_code, response.get_json(silent=True)
+
+
+class ClienteHTTP:
+    """Requisições HTTP reais contra o servidor local"""
+
+    def __init__(self, porta):
+        self._conn = http.client.HTTPConnection('127.0.0.1', porta, timeout=60)
+
+    def requisitar(self, metodo, caminho, corpo=None, headers=None):
+        headers = dict(headers or {})
+        dados = None
+        if corpo is not None:
+            dados = json.dumps(corpo)
+            headers['Content-Type'] = 'application/json'
+        self._conn.request(metodo, caminho, body=dados, headers=headers)
+        response = self._conn.getresponse()
+        conteudo = response.read()
+        try:
+            return response.status, json.loads(conteudo) if conteudo else None
+        except ValueError:
+            return response.status, None
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))]
+
+
+def executar_cenario(nome, novo_cliente, gerar_requisicao, total, workers):
+    """Dispara `total` requisições com `workers` threads; retorna as métricas do endpoint"""
+    latencias, erros = [], 0
+    lock = threading.Lock()
+    contador = iter(range(total))
+
+    def worker():
+        nonlocal erros
+        cliente = novo_cliente()
+        while True:
+            with lock:
+                indice = next(contador, None)
+            if indice is None:
+                return
+            metodo, caminho, corpo, headers = gerar_requisicao(indice)
+            inicio = time.perf_counter()
+            status, _ = cliente.requisitar(metodo, caminho, corpo, headers)
+            duracao = time.perf_counter() - inicio
+            with lock:
+                latencias.append(duracao)
+                if status >= 500:
+                    erros += 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in range(workers):
+            executor.submit(worker)
+    duracao_total = time.perf_counter() - inicio
+    return {
+        'endpoint': nome, 'requisicoes': len(latencias), 'erros_5xx': erros,
+        'vazao_rps': round(len(latencias) / duracao_total, 1) if duracao_total else 0.0,
+        'p50_ms': round(percentil(latencias, 50) * 1000, 2),
+        'p95_ms': round(percentil(latencias, 95) * 1000, 2),
+        'p99_ms': round(percentil(latencias, 99) * 1000, 2),
+        'media_ms': round(statistics.fmean(latencias) * 1000, 2) if latencias else 0.0,
+    }
+
+
+def verificar_dupla_reserva(novo_cliente, headers_por_worker, lab_id, workers, rodadas):
+    """Vários workers tentam, ao mesmo tempo, o mesmo horário livre; no máximo um pode conseguir"""
+    falhas = 0
+    base = datetime.date.today() + datetime.timedelta(days=400)
+    for rodada in range(rodadas):
+        corpo = {'laboratorio_id': lab_id, 'data': (base + datetime.timedelta(days=rodada)).isoformat(),
+                 'horario_inicio': '23:00', 'horario_fim': '23:50', 'disciplina': 'Corrida', 'turma': 'R'}
+        barreira = threading.Barrier(workers)
+        clientes = [novo_cliente() for _ in range(workers)]
+
+        def tentar(indice):
+            barreira.wait()
+            return clientes[indice].requisitar('POST', '/api/reservas', corpo, headers_por_worker[indice])[0]
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            status = list(executor.map(tentar, range(workers)))
+        if status.count(201) > 1:
+            falhas += 1
+    conn = sqlite3.connect(aplicacao.DATABASE)
+    sobrepostas = conn.execute('''
+        SELECT COUNT(*) FROM reservas a JOIN reservas b
+        ON a.laboratorio_id = b.laboratorio_id AND a.data = b.data AND a.id < b.id
+        AND a.status != 'cancelada' AND b.status != 'cancelada'
+        AND a.horario_inicio < b.horario_fim AND a.horario_fim > b.horario_inicio
+        WHERE a.disciplina = 'Corrida'
+    ''').fetchone()[0]
+    conn.close()
+    return falhas, sobrepostas
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark da API de agendamento')
+    parser.add_argument('--laboratorios', type=int, default=10)
+    parser.add_argument('--professores', type=int, default=200)
+    parser.add_argument('--anos', type=int, default=3, help='Anos de histórico de reservas')
+    parser.add_argument('--ocupacao', type=float, default=0.5, help='Fração dos horários ocupados (0-1)')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--requisicoes', type=int, default=400, help='Requisições por endpoint')
+    parser.add_argument('--bcrypt-rounds', type=int, default=aplicacao.app.config['BCRYPT_ROUNDS'])
+    parser.add_argument('--rodadas-corrida', type=int, default=20, help='Rodadas do teste de dupla reserva')
+    parser.add_argument('--servidor', action='store_true', help='Usa HTTP contra um servidor local em vez do test client')
+    parser.add_argument('--escritor', action='store_true', help='Grava as escritas pela thread escritora (group commit)')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--json', help='Grava os resultados também neste arquivo JSON')
+    args = parser.parse_args()
+
+    diretorio = tempfile.mkdtemp(prefix='bench_agendamento_')
+    aplicacao.DATABASE = os.path.join(diretorio, 'agendamento.db')
+    aplicacao.app.config['BCRYPT_ROUNDS'] = args.bcrypt_rounds
+    aplicacao.app.config['ESCRITOR_RESERVAS'] = args.escritor or aplicacao.app.config['ESCRITOR_RESERVAS']
+    aplicacao.init_database()
+    conn = sqlite3.connect(aplicacao.DATABASE)
+    lab_ids, matriculas = popular_banco(conn, args.laboratorios, args.professores, args.anos, args.ocupacao, args.semente)
+    conn.close()
+
+    if args.servidor:
+        import logging
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR) # Sem uma linha de log por requisição
+        servidor = make_server('127.0.0.1', 0, aplicacao.app, threaded=True)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        novo_cliente = lambda: ClienteHTTP(servidor.server_port)
+        print(f"🌐 Servidor local em http://127.0.0.1:{servidor.server_port}")
+    else:
+        novo_cliente = ClienteTeste
+
+    rng = random.Random(args.semente)
+    cliente = novo_cliente()
+    tokens = []
+    for matricula in matriculas[:max(args.workers, 10)]:
+        status, corpo = cliente.requisitar('POST', '/api/login', {'matricula': matricula, 'senha': SENHA_PADRAO})
+        if status != 200:
+            sys.exit(f"❌ Login de {matricula} falhou ({status})")
+        tokens.append({'Authorization': f"Bearer {corpo['token']}"})
+    status, corpo = cliente.requisitar('POST', '/api/login', {'matricula': '999999', 'senha': 'admin123'})
+    if status != 200:
+        sys.exit("❌ Login do admin '999999' falhou")
+    admin = {'Authorization': f"Bearer {corpo['token']}"}
+
+    hoje = datetime.date.today()
+    dia_aleatorio = lambda: (hoje + datetime.timedelta(days=rng.randrange(-365 * args.anos, 120))).isoformat()
+
+    def janela_calendario():
+        # Visão mensal do FullCalendar: ~6 semanas a partir do início de um mês qualquer
+        inicio = (hoje + datetime.timedelta(days=rng.randrange(-365 * args.anos, 120))).replace(day=1)
+        return f'/api/reservas-calendario?start={inicio.isoformat()}&end={(inicio + datetime.timedelta(days=42)).isoformat()}'
+
+    cenarios = [
+        ('POST /api/login', lambda i: ('POST', '/api/login',
+                                       {'matricula': matriculas[i % len(matriculas)], 'senha': SENHA_PADRAO}, {})),
+        ('POST /api/verificar-disponibilidade', lambda i: ('POST', '/api/verificar-disponibilidade', {
+            'laboratorio_id': rng.choice(lab_ids), 'data': dia_aleatorio(),
+            'horario_inicio': rng.choice(HORARIOS)[0], 'horario_fim': rng.choice(HORARIOS)[1]}, tokens[i % len(tokens)])),
+        ('POST /api/reservas', lambda i: ('POST', '/api/reservas', {
+            'laboratorio_id': rng.choice(lab_ids), 'data': (hoje + datetime.timedelta(days=rng.randrange(1, 120))).isoformat(),
+            'horario_inicio': '22:10', 'horario_fim': '22:50', 'disciplina': 'Bench', 'turma': 'B'}, tokens[i % len(tokens)])),
+        ('GET /api/reservas-calendario', lambda i: ('GET', janela_calendario(), None, tokens[i % len(tokens)])),
+        ('GET /api/reservas-admin', lambda i: ('GET', '/api/reservas-admin?limit=100', None, admin)),
+        ('GET /api/dashboard', lambda i: ('GET', '/api/dashboard', None, tokens[i % len(tokens)])),
+    ]
+
+    print(f"🚀 {args.requisicoes} requisições por endpoint, {args.workers} workers\n")
+    resultados = []
+    print(f"{'Endpoint':<40}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'5xx':>6}")
+    for nome, gerar in cenarios:
+        total = min(args.requisicoes, 50) if nome == 'POST /api/login' else args.requisicoes
+        resultado = executar_cenario(nome, novo_cliente, gerar, total, args.workers)
+        resultados.append(resultado)
+        print(f"{nome:<40}{resultado['vazao_rps']:>10}{resultado['p50_ms']:>10}"
+              f"{resultado['p95_ms']:>10}{resultado['p99_ms']:>10}{resultado['erros_5xx']:>6}")
+
+    workers_corrida = max(2, args.workers)
+    headers_corrida = [tokens[i % len(tokens)] for i in range(workers_corrida)]
+    falhas, sobrepostas = verificar_dupla_reserva(novo_cliente, headers_corrida, lab_ids[0],
+                                                  workers_corrida, args.rodadas_corrida)
+    if falhas or sobrepostas:
+        print(f"\n❌ Dupla reserva: {falhas} de {args.rodadas_corrida} rodadas aceitaram mais de uma reserva "
+              f"({sobrepostas} pares sobrepostos no banco)")
+    else:
+        print(f"\n✅ Nenhuma dupla reserva em {args.rodadas_corrida} rodadas com {workers_corrida} pedidos simultâneos")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as arquivo:
+            json.dump({'parametros': vars(args), 'endpoints': resultados,
+                       'dupla_reserva': {'rodadas_com_falha': falhas, 'pares_sobrepostos': sobrepostas}},
+                      arquivo, ensure_ascii=False, indent=2)
+    sys.exit(1 if falhas or sobrepostas else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+# importar_professores.py
+# Execute: python importar_professores.py professores.csv
+#          python importar_professores.py professores.jsonl --threads 8
+#
+# Cadastra professores em massa a partir de um CSV (cabeçalho nome_completo,matricula,senha,email,
+# telefone,departamento) ou JSONL (um objeto por linha, mesmos campos). As senhas são criptografadas
+# em várias threads e as linhas entram em lotes; matrícula/email repetidos são recusados por linha
+# sem interromper o restante do arquivo.
+
+import argparse
+import os
+import sys
+
+import app as aplicacao
+
+ICONES = {'criado': '✅', 'conflito': '⚠️', 'duplicado_no_arquivo': '🔁', 'invalido': '❌'}
+
+def main():
+    parser = argparse.ArgumentParser(description='Importa professores de um arquivo CSV ou JSONL')
+    parser.add_argument('arquivo')
+    parser.add_argument('--formato', choices=['csv', 'jsonl'], help='Padrão: pela extensão do arquivo')
+    parser.add_argument('--threads', type=int, help='Threads para o bcrypt (padrão: nº de CPUs)')
+    parser.add_argument('--banco', default=aplicacao.DATABASE, help='Banco SQLite de destino')
+    args = parser.parse_args()
+
+    formato = args.formato or ('jsonl' if args.arquivo.lower().endswith(('.jsonl', '.ndjson')) else 'csv')
+    try:
+        with open(args.arquivo, encoding='utf-8-sig', newline='') as f:
+            conteudo = f.read()
+        linhas = aplicacao.ler_professores(conteudo, formato)
+    except (OSError, UnicodeDecodeError, ValueError) as e:
+        print(f"❌ Não foi possível ler {args.arquivo}: {e}")
+        return 1
+
+    aplicacao.DATABASE = args.banco
+    aplicacao.init_database()
+    print(f"📥 Importando {len(linhas)} linha(s) de {os.path.basename(args.arquivo)} para {args.banco}...")
+    with aplicacao.app.app_context(): # Conexão do pool, devolvida ao sair
+        relatorio = aplicacao.importar_professores(linhas, args.threads)
+
+    for item in relatorio['resultados']:
+        if item['resultado'] != 'criado':
+            print(f"  {ICONES[item['resultado']]} linha {item['linha']} ({item['matricula'] or '-'}): {item['error']}")
+    print(f"\n✅ {relatorio['criados']} criado(s), {relatorio['recusados']} recusado(s) de {relatorio['total']}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+import datetime
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as aplicacao
+
+
+def _limpar_estado():
+    # Caches de processo que sobreviveriam de um banco temporário para o outro
+    aplicacao.pool.limpar()
+    aplicacao.cache_laboratorios.invalidar()
+    aplicacao.cache_autenticacao.invalidar()
+
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    """Banco novo (migrações + dados iniciais) num diretório temporário; agendamento.db não é tocado"""
+    monkeypatch.setattr(aplicacao, 'DATABASE', str(tmp_path / 'agendamento.db'))
+    monkeypatch.setitem(aplicacao.app.config, 'BCRYPT_ROUNDS', 4) # Senhas iniciais e logins rápidos
+    _limpar_estado()
+    aplicacao.init_database()
+    yield aplicacao.DATABASE
+    _limpar_estado()
+
+
+@pytest.fixture
+def cliente(banco):
+    return aplicacao.app.test_client()
+
+
+def _entrar(cliente, matricula, senha):
+    resposta = cliente.post('/api/login', json={'matricula': matricula, 'senha': senha})
+    assert resposta.status_code == 200, resposta.get_data(as_text=True)
+    return {'Authorization': f"Bearer {resposta.get_json()['token']}"}
+
+
+@pytest.fixture
+def professor(cliente):
+    return _entrar(cliente, '123456', '123456')
+
+
+@pytest.fixture
+def admin(cliente):
+    return _entrar(cliente, '999999', 'admin123')
+
+
+@pytest.fixture
+def dia_util():
+    """Próximo dia de funcionamento a pelo menos uma semana de hoje"""
+    dia = datetime.date.today() + datetime.timedelta(days=7)
+    while dia.weekday() not in aplicacao.app.config['DIAS_FUNCIONAMENTO']:
+        dia += datetime.timedelta(days=1)
+    return dia.isoformat()
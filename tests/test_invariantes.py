@@ -0,0 +1,160 @@
+"""Invariantes mantidas por trigger e pela checagem de conflitos: contadores, ocupação diária e dupla reserva"""
+import sqlite3
+
+import pytest
+
+import app as aplicacao
+
+
+def _reservar(cliente, headers, dia, inicio, fim, laboratorio_id=1):
+    return cliente.post('/api/reservas', headers=headers, json={
+        'laboratorio_id': laboratorio_id, 'data': dia, 'horario_inicio': inicio, 'horario_fim': fim,
+        'disciplina': 'Redes', 'turma': 'T1',
+    })
+
+
+def _movimentar(cliente, professor, admin, dia):
+    """Cria, altera, cancela e apaga reservas pelos caminhos que mexem nas tabelas derivadas"""
+    ids = [_reservar(cliente, professor, dia, f'{hora:02d}:00', f'{hora + 1:02d}:00').get_json()['reserva_id']
+           for hora in (8, 10, 13, 15)]
+    assert cliente.put(f'/api/reservas/{ids[0]}/cancelar', headers=professor).status_code == 200
+    assert cliente.put(f'/api/reservas/{ids[1]}/status', headers=admin, json={'status': 'pendente'}).status_code == 200
+    assert cliente.put(f'/api/reservas/{ids[2]}', headers=professor, json={
+        'laboratorio_id': 2, 'data': dia, 'horario_inicio': '13:00', 'horario_fim': '14:30',
+        'disciplina': 'Redes', 'turma': 'T1'}).status_code == 200
+    conn = aplicacao._nova_conexao()
+    with conn:
+        conn.execute('DELETE FROM reservas WHERE id = ?', (ids[3],))
+        conn.execute("UPDATE professores SET departamento = 'Física' WHERE matricula = '123456'")
+    conn.close()
+
+
+def _tabela(conn, sql):
+    return sorted(tuple(row) for row in conn.execute(sql))
+
+
+def test_contadores_batem_com_recalculo(cliente, professor, admin, dia_util):
+    _movimentar(cliente, professor, admin, dia_util)
+    conn = aplicacao._nova_conexao()
+    consulta = 'SELECT * FROM contadores_professor WHERE total > 0'
+    mantidos = _tabela(conn, consulta)
+    with conn:
+        aplicacao.reconstruir_contadores(conn)
+    assert mantidos == _tabela(conn, consulta)
+    conn.close()
+
+
+def test_ocupacao_diaria_bate_com_recalculo(cliente, professor, admin, dia_util):
+    _movimentar(cliente, professor, admin, dia_util)
+    conn = aplicacao._nova_conexao()
+    consulta = 'SELECT * FROM ocupacao_diaria WHERE reservas > 0'
+    mantida = _tabela(conn, consulta)
+    with conn:
+        aplicacao.reconstruir_ocupacao(conn)
+    assert mantida == _tabela(conn, consulta)
+    conn.close()
+
+
+def test_conflito_de_horario(cliente, professor, dia_util):
+    assert _reservar(cliente, professor, dia_util, '08:00', '10:00').status_code == 201
+    assert _reservar(cliente, professor, dia_util, '09:00', '11:00').status_code == 409 # Sobreposição parcial
+    assert _reservar(cliente, professor, dia_util, '07:00', '12:00').status_code == 409 # Engloba a existente
+    assert _reservar(cliente, professor, dia_util, '08:30', '09:30').status_code == 409 # Contida na existente
+    assert _reservar(cliente, professor, dia_util, '10:00', '11:00').status_code == 201 # Encostada
+    assert _reservar(cliente, professor, dia_util, '08:00', '10:00', laboratorio_id=2).status_code == 201
+
+
+def test_reserva_cancelada_libera_horario(cliente, professor, dia_util):
+    reserva_id = _reservar(cliente, professor, dia_util, '08:00', '09:00').get_json()['reserva_id']
+    cliente.put(f'/api/reservas/{reserva_id}/cancelar', headers=professor)
+    assert _reservar(cliente, professor, dia_util, '08:00', '09:00').status_code == 201
+
+
+def test_conflito_com_reserva_gravada_por_outro_processo(cliente, professor, dia_util):
+    # A reserva entra por outra conexão, como faria outro processo
+    disponibilidade = {'laboratorio_id': 1, 'data': dia_util, 'horario_inicio': '08:00', 'horario_fim': '09:00'}
+    assert cliente.post('/api/verificar-disponibilidade', headers=professor, json=disponibilidade).get_json()['disponivel']
+    conn = aplicacao._nova_conexao()
+    with conn:
+        conn.execute('''
+            INSERT INTO reservas (professor_id, laboratorio_id, data, horario_inicio, horario_fim, disciplina, turma, status)
+            VALUES (2, 1, ?, '08:00', '09:00', 'Redes', 'T2', 'confirmada')
+        ''', (dia_util,))
+    conn.close()
+    assert not cliente.post('/api/verificar-disponibilidade', headers=professor, json=disponibilidade).get_json()['disponivel']
+    assert _reservar(cliente, professor, dia_util, '08:30', '09:30').status_code == 409
+
+
+@pytest.mark.parametrize('data, inicio, fim, valido', [
+    ('2030-01-10', '00:00', '01:00', True),
+    ('2030-01-10', '23:00', '24:00', True),
+    ('2030-01-10', '08:00:00', '09:00:00', True),
+    ('2030-01-10 junk', '08:00', '09:00', False),
+    ('2030-W02-4', '08:00', '09:00', False),
+    ('2030-02-30', '08:00', '09:00', False),
+    (20300110, '08:00', '09:00', False),
+    ('2030-01-10', '8:00', '09:00', False),
+    ('2030-01-10', '08:60', '09:00', False),
+    ('2030-01-10', '23:00', '24:01', False),
+    ('2030-01-10', '09:00', '08:00', False),
+])
+def test_validacao_de_data_e_horario(data, inicio, fim, valido):
+    assert (aplicacao.erro_data_horario(data, inicio, fim) is None) == valido
+
+
+@pytest.mark.parametrize('data, inicio, fim', [
+    ('2030-01-10 junk', '08:00', '09:00'),
+    ('2030-02-30', '08:00', '09:00'),
+    ('2030-01-10', 'xx:yy', '09:00'),
+    ('2030-01-10', '08:00', '25:00'),
+])
+def test_banco_recusa_data_ou_horario_invalido(banco, data, inicio, fim):
+    conn = aplicacao._nova_conexao()
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute('''
+            INSERT INTO reservas (professor_id, laboratorio_id, data, horario_inicio, horario_fim, disciplina, turma, status)
+            VALUES (2, 1, ?, ?, ?, 'Redes', 'T1', 'confirmada')
+        ''', (data, inicio, fim))
+    conn.close()
+
+
+@pytest.mark.parametrize('hora_inicio, hora_fim, status', [
+    ('07:00', '22:00', 200),
+    ('00:00', '24:00', 200),
+    ('25:99', '26:00', 400),
+    ('07:00', '24:30', 400),
+    ('7:00', '22:00', 400),
+    ('22:00', '07:00', 400),
+])
+def test_horarios_livres_valida_janela(cliente, professor, dia_util, hora_inicio, hora_fim, status):
+    resposta = cliente.get(f'/api/horarios-livres?duracao=60&data_inicio={dia_util}'
+                           f'&hora_inicio={hora_inicio}&hora_fim={hora_fim}', headers=professor)
+    assert resposta.status_code == status
+    if status == 200:
+        assert all(h['horario_fim'] <= '24:00' for h in resposta.get_json()['horarios'])
+
+
+def test_reativar_reserva_cancelada_verifica_conflito(cliente, professor, admin, dia_util):
+    cancelada = _reservar(cliente, professor, dia_util, '08:00', '09:00').get_json()['reserva_id']
+    cliente.put(f'/api/reservas/{cancelada}/cancelar', headers=professor)
+    assert _reservar(cliente, professor, dia_util, '08:30', '09:30').status_code == 201
+    resposta = cliente.put(f'/api/reservas/{cancelada}/status', headers=admin, json={'status': 'confirmada'})
+    assert resposta.status_code == 409
+    livre = _reservar(cliente, professor, dia_util, '10:00', '11:00').get_json()['reserva_id']
+    cliente.put(f'/api/reservas/{livre}/cancelar', headers=professor)
+    assert cliente.put(f'/api/reservas/{livre}/status', headers=admin, json={'status': 'pendente'}).status_code == 200
+
+
+def test_respostas_nao_expoem_colunas_internas(cliente, professor, admin, dia_util):
+    reserva_id = _reservar(cliente, professor, dia_util, '08:00', '09:00').get_json()['reserva_id']
+    internas = {'dia', 'inicio_min', 'fim_min', 'versao_alteracao'}
+    respostas = [
+        cliente.get('/api/minhas-reservas', headers=professor).get_json(),
+        cliente.get('/api/reservas-admin', headers=admin).get_json(),
+        cliente.get('/api/reservas-admin?incluir_arquivo=1', headers=admin).get_json(),
+        cliente.get('/api/reservas/busca?q=redes', headers=admin).get_json(),
+        cliente.get('/api/dashboard', headers=professor).get_json()['proximasReservas'],
+        [cliente.get(f'/api/reservas/{reserva_id}', headers=professor).get_json()],
+    ]
+    for reservas in respostas:
+        assert reservas and all(internas.isdisjoint(reserva) for reserva in reservas), reservas
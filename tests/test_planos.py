@@ -0,0 +1,86 @@
+"""Cada consulta das rotas de reservas usa o índice esperado (EXPLAIN QUERY PLAN), sem varrer a tabela"""
+import datetime
+import re
+import sqlite3
+
+import pytest
+
+import app as aplicacao
+
+
+def _consultas_da_requisicao(cliente, metodo, url, headers, corpo=None):
+    """SQL que a requisição executou sobre reservas (a conexão do pool é a mesma entre requisições)"""
+    comandos = []
+    conn = aplicacao.pool.obter()
+    conn.set_trace_callback(comandos.append)
+    aplicacao.pool.devolver(conn)
+    try:
+        resposta = cliente.open(url, method=metodo, headers=headers, json=corpo)
+    finally:
+        conn.set_trace_callback(None)
+    assert resposta.status_code < 400, resposta.get_data(as_text=True)
+    return [sql for sql in comandos
+            if re.match(r'\s*(SELECT|WITH|UPDATE|DELETE)\b', sql) and re.search(r'\breservas\b', sql)]
+
+
+def _indices(banco, sql):
+    conn = sqlite3.connect(banco)
+    try:
+        detalhes = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+    finally:
+        conn.close()
+    assert not any(aplicacao._varre_reservas(detalhe) for detalhe in detalhes), (sql, detalhes)
+    return {indice for detalhe in detalhes for indice in re.findall(r'USING (?:COVERING )?INDEX (\w+)', detalhe)}
+
+
+def test_conflitos_do_dia_usam_indice_por_laboratorio_e_dia(banco):
+    params = (1, '2030-01-10', None, 600, 480, 480, 600, 480, 600)
+    conn = sqlite3.connect(banco)
+    detalhes = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {aplicacao.SQL_CONFLITOS_DIA}', params)]
+    conn.close()
+    assert any('idx_reservas_lab_dia_horario' in detalhe for detalhe in detalhes), detalhes
+
+
+def test_consultas_do_verificar_planos_nao_varrem_reservas(banco, cliente):
+    # Mesmas rotas do comando verificar-planos (busca, ICS, relatórios e feed de alterações incluídos)
+    planos, erros = aplicacao.planos_das_rotas(cliente)
+    assert not erros, [(r.request.path, r.status_code) for r in erros]
+    assert planos
+    varreduras = [(sql, detalhes) for sql, detalhes in planos if any(map(aplicacao._varre_reservas, detalhes))]
+    assert not varreduras, varreduras
+
+
+def _casos(dia):
+    fim = (datetime.date.fromisoformat(dia) + datetime.timedelta(days=30)).isoformat()
+    periodo = f'data_inicio={dia}&data_fim={fim}'
+    reserva = {'laboratorio_id': 1, 'data': dia, 'horario_inicio': '08:00', 'horario_fim': '09:00',
+               'disciplina': 'Cálculo I', 'turma': 'T1'}
+    return [
+        ('POST', '/api/verificar-disponibilidade', 'professor', reserva, 'idx_reservas_lab_dia_horario'),
+        ('POST', '/api/reservas', 'professor', reserva, 'idx_reservas_lab_dia_horario'),
+        ('GET', f'/api/minhas-reservas?status=confirmada&{periodo}', 'professor', None, 'idx_reservas_prof_data_horario'),
+        ('GET', '/api/minhas-reservas?limit=5', 'professor', None, 'idx_reservas_prof_data_horario'),
+        ('GET', '/api/dashboard', 'professor', None, 'idx_reservas_prof_status_dia'),
+        ('GET', '/api/reservas-admin?limit=10', 'admin', None, 'idx_reservas_data_horario'),
+        ('GET', f'/api/reservas-calendario?start={dia}&end={fim}&laboratorio_id=1', 'professor', None,
+         'idx_reservas_lab_dia_horario'),
+        ('GET', f'/api/horarios-livres?duracao=60&{periodo}&laboratorio_id=1', 'professor', None,
+         'idx_reservas_lab_dia_horario'),
+        ('GET', f'/api/reservas-admin?status=cancelada&{periodo}', 'admin', None, 'idx_reservas_status_dia'),
+        ('PUT', '/api/reservas/status-em-lote', 'admin',
+         {'status': 'pendente', 'filtro': {'status_atual': 'confirmada', 'data_inicio': dia, 'data_fim': fim}},
+         'idx_reservas_status_dia'),
+        ('PUT', '/api/reservas/status-em-lote', 'admin',
+         {'status': 'confirmada', 'filtro': {'professor_id': 2, 'status_atual': 'pendente'}},
+         'idx_reservas_prof_status_dia'),
+    ]
+
+
+@pytest.mark.parametrize('indice_caso', range(len(_casos('2030-01-10'))))
+def test_rotas_usam_indice_esperado(banco, cliente, professor, admin, dia_util, indice_caso):
+    metodo, url, usuario, corpo, esperado = _casos(dia_util)[indice_caso]
+    headers = {'professor': professor, 'admin': admin}[usuario]
+    consultas = _consultas_da_requisicao(cliente, metodo, url, headers, corpo)
+    assert consultas, f'{metodo} {url} não consultou reservas'
+    usados = set().union(*(_indices(banco, sql) for sql in consultas))
+    assert esperado in usados, (metodo, url, usados)
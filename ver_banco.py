@@ -3,6 +3,7 @@
 
 import sqlite3
 import json
+import os
 
 def main():
     try:
@@ -84,6 +85,15 @@ def main():
             total = cursor.fetchone()[0]
             print(f"  • {tabela.title()}: {total}")
         
+        # Reservas movidas para o arquivo (flask --app app arquivar)
+        if os.path.exists('agendamento_arquivo.db'):
+            conn.execute("ATTACH DATABASE 'agendamento_arquivo.db' AS arquivo")
+            try:
+                total = conn.execute("SELECT COUNT(*) FROM arquivo.reservas").fetchone()[0]
+                print(f"  • Reservas arquivadas: {total}")
+            except sqlite3.OperationalError:
+                pass
+        
         conn.close()
         
     except sqlite3.Error as e: